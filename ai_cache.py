@@ -0,0 +1,153 @@
+import hashlib
+import math
+import os
+import re
+import threading
+from functools import lru_cache
+import cache, models
+from database import Base, SERVER_WORKERS
+
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "3600"))
+AI_CACHE_MAXSIZE = int(os.getenv("AI_CACHE_MAXSIZE", "512"))
+# Name of a local Ollama embedding model (e.g. nomic-embed-text) to let paraphrases hit
+AI_CACHE_EMBEDDINGS = os.getenv("AI_CACHE_EMBEDDINGS")
+AI_CACHE_SIMILARITY = float(os.getenv("AI_CACHE_SIMILARITY", "0.92"))
+
+TABLES = tuple(table.name for table in Base.metadata.sorted_tables)
+
+def normalize(question: str) -> str:
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(question.split())
+
+def schema_version() -> str:
+    shape = "\n".join(
+        f"{table.name}(" + ",".join(f"{c.name} {c.type}" for c in table.columns) + ")"
+        for table in Base.metadata.sorted_tables
+    )
+    return hashlib.sha1(shape.encode()).hexdigest()[:12]
+
+def referenced_tables(queries) -> set:
+    found = set()
+    for sql in queries:
+        found.update(re.findall(r"\b(%s)\b" % "|".join(TABLES), sql.lower()))
+    return found
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+class AICache:
+    """
+    Answers to /ai/query keyed on (schema version, query mode, normalized
+    question), with an optional embedding lookup for paraphrases. Entries remember the tables
+    their SQL read so a write to any of them drops the entry.
+    """
+    def __init__(self, maxsize: int = AI_CACHE_MAXSIZE, ttl: float = AI_CACHE_TTL, embeddings=None, similarity: float = AI_CACHE_SIMILARITY):
+        # Entries and their invalidation live in this process, so with several
+        # workers a write on one would leave the others answering from old data
+        self.enabled = AI_CACHE_ENABLED and SERVER_WORKERS == 1
+        self.version = schema_version()
+        self.entries = cache.LRUCache(maxsize=maxsize, ttl=ttl)
+        self.embeddings = embeddings
+        self.similarity = similarity
+        self.counters = {"hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+        self._vectors = {}
+        self._by_table = {}
+        self._invalidated = {}
+        self._lock = threading.Lock()
+        if embeddings is not None:
+            self._embed = lru_cache(maxsize=maxsize)(embeddings.embed_query)
+
+    def _key(self, question: str, mode: str) -> str:
+        return f"{self.version}:{mode}:{normalize(question)}"
+
+    def _nearest(self, question: str, mode: str):
+        vector = self._embed(normalize(question))
+        prefix = f"{self.version}:{mode}:"
+        with self._lock:
+            candidates = [(key, other) for key, other in self._vectors.items() if key.startswith(prefix)]
+        best_key, best_score = None, self.similarity
+        for key, other in candidates:
+            score = _cosine(vector, other)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return self.entries.get(best_key) if best_key else None
+
+    def stamp(self) -> dict:
+        """
+        Per-table invalidation counts, taken before looking an answer up and
+        handed back to put(), which drops the answer if a table it read has
+        been written since (as cache.list_key does with generations).
+        """
+        with self._lock:
+            return dict(self._invalidated)
+
+    def get(self, question: str, mode: str):
+        if not self.enabled:
+            return None
+        entry = self.entries.get(self._key(question, mode))
+        if entry is not None:
+            self.counters["hits"] += 1
+            return entry
+        if self.embeddings is not None:
+            entry = self._nearest(question, mode)
+            if entry is not None:
+                self.counters["semantic_hits"] += 1
+                return entry
+        self.counters["misses"] += 1
+        return None
+
+    def put(self, question: str, mode: str, queries: list, answer, stamp: dict):
+        if not self.enabled:
+            return
+        key = self._key(question, mode)
+        # An answer reached without any SQL we could see may depend on anything
+        tables = referenced_tables(queries) if queries else set(TABLES)
+        vector = self._embed(normalize(question)) if self.embeddings is not None else None
+        with self._lock:
+            # Computed from rows a write has since changed: storing it would
+            # outlive that write's invalidate_table
+            if any(self._invalidated.get(table, 0) != stamp.get(table, 0) for table in tables):
+                return
+            self.entries.set(key, {"queries": queries, "answer": answer, "tables": tables})
+            if vector is not None:
+                self._vectors[key] = vector
+                if len(self._vectors) > self.entries.maxsize:
+                    # Drop vectors whose entries the LRU has evicted or expired
+                    self._vectors = {k: v for k, v in self._vectors.items() if self.entries.get(k) is not None}
+            for table in tables:
+                keys = self._by_table.setdefault(table, set())
+                keys.add(key)
+                if len(keys) > self.entries.maxsize:
+                    # Likewise for keys of evicted or expired entries
+                    self._by_table[table] = {k for k in keys if self.entries.get(k) is not None}
+
+    def invalidate_table(self, table: str):
+        with self._lock:
+            self._invalidated[table] = self._invalidated.get(table, 0) + 1
+            keys = self._by_table.pop(table, set())
+            for key in keys:
+                self._vectors.pop(key, None)
+        if keys:
+            self.entries.delete(*keys)
+            self.counters["invalidations"] += len(keys)
+
+    def stats(self):
+        return {
+            **self.counters,
+            "evictions": self.entries.evictions,
+            "expirations": self.entries.expirations,
+            "size": self.entries.size(),
+            "schema_version": self.version,
+        }
+
+def _embeddings():
+    if not AI_CACHE_EMBEDDINGS:
+        return None
+    from langchain_ollama import OllamaEmbeddings
+    return OllamaEmbeddings(model=AI_CACHE_EMBEDDINGS)
+
+answers = AICache(embeddings=_embeddings())
+cache.listeners.append(answers.invalidate_table)
@@ -0,0 +1,221 @@
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "4"))
+AI_QUEUE_LIMIT = int(os.getenv("AI_QUEUE_LIMIT", "32"))
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "120"))
+
+class Overloaded(Exception):
+    pass
+
+class _Call:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+class AIExecutor:
+    """
+    Runs AI questions on a dedicated thread pool, off the threadpool that
+    serves the CRUD routes. At most `concurrency` questions run at once and at
+    most `queue_limit` wait; beyond that callers get Overloaded. Identical
+    in-flight questions share one run, which is cancelled once every caller
+    waiting on it has given up.
+    """
+    def __init__(self, concurrency: int = AI_CONCURRENCY, queue_limit: int = AI_QUEUE_LIMIT, timeout: float = AI_TIMEOUT):
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.waiting = 0
+        self.running = 0
+        self.draining = False
+        self.metrics = {
+            "submitted": 0,
+            "coalesced": 0,
+            "rejected": 0,
+            "timed_out": 0,
+            "failed": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+            "run_seconds_total": 0.0,
+            "run_seconds_max": 0.0,
+            "runs": 0,
+        }
+        self._threads = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ai")
+        self._slots = asyncio.Semaphore(concurrency)
+        self._inflight = {}
+
+    def reopen(self):
+        """
+        Admit questions again after drain(). Called by server.lifespan on
+        startup, so an app can be started more than once in a process (tests,
+        lifespan restarts).
+        """
+        self.draining = False
+        if not self.running and not self.waiting:
+            # The semaphore binds to the loop it is first used on
+            self._slots = asyncio.Semaphore(self.concurrency)
+
+    def _observe(self, name: str, seconds: float):
+        self.metrics[f"{name}_seconds_total"] += seconds
+        self.metrics[f"{name}_seconds_max"] = max(self.metrics[f"{name}_seconds_max"], seconds)
+
+    def check(self):
+        """
+        Raise Overloaded if a question would be turned away now, without
+        reserving a place; lets a route answer 503 before it starts a stream.
+        """
+        if self.draining:
+            self.metrics["rejected"] += 1
+            raise Overloaded("Server is shutting down")
+        if self.waiting >= self.queue_limit:
+            self.metrics["rejected"] += 1
+            raise Overloaded(f"{self.waiting} AI queries already queued")
+
+    def admit(self):
+        # Reserve the queue place now, in the same step as the check, so a
+        # burst of callers cannot all pass before any of them starts waiting.
+        # _acquire gives it back once the caller holds a slot.
+        self.check()
+        self.waiting += 1
+
+    async def _acquire(self):
+        enqueued = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self._observe("queue_wait", time.perf_counter() - enqueued)
+        self.running += 1
+        return time.perf_counter()
+
+    def _release(self, started: float):
+        self.running -= 1
+        self.metrics["runs"] += 1
+        self._observe("run", time.perf_counter() - started)
+        self._slots.release()
+
+    async def _execute(self, fn, args):
+        started = await self._acquire()
+        loop = asyncio.get_running_loop()
+        # The worker thread inherits the caller's context (request metrics etc.)
+        future = loop.run_in_executor(self._threads, contextvars.copy_context().run, fn, *args)
+        # A running thread cannot be interrupted, so its slot is only freed
+        # when it actually finishes, even if every caller has gone away
+        future.add_done_callback(lambda _: self._release(started))
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            self.metrics["failed"] += 1
+            raise
+
+    async def run(self, fn, *args, key=None, timeout: float = None):
+        """
+        Run fn(*args) in the pool and return its result, sharing the run with
+        any in-flight call with the same `key`.
+        """
+        call = self._inflight.get(key) if key is not None else None
+        if call is None:
+            self.admit()
+            self.metrics["submitted"] += 1
+            call = _Call(asyncio.ensure_future(self._execute(fn, args)))
+            if key is not None:
+                self._inflight[key] = call
+                call.task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.metrics["coalesced"] += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(call.task), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.metrics["timed_out"] += 1
+            raise
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    async def _close(self, context, iterator, started: float):
+        try:
+            if iterator is not None:
+                await asyncio.get_running_loop().run_in_executor(self._threads, context.run, iterator.close)
+        finally:
+            self._release(started)
+
+    async def _close_after(self, hop, context, iterator, started: float):
+        # The thread is still inside fn or the generator; close it once it
+        # comes back rather than from a second thread now
+        try:
+            result = await hop
+            iterator = iterator if iterator is not None else result
+        except Exception:
+            pass
+        await self._close(context, iterator, started)
+
+    async def stream(self, fn, *args, timeout: float = None):
+        """
+        Iterate the generator fn(*args) in the pool, one item per hop, holding
+        a concurrency slot until it is exhausted or the client disconnects.
+        Raises asyncio.TimeoutError once `timeout` seconds (default the
+        executor's, as for run()) have passed, counting the wait for a slot; a
+        hop still running then keeps its slot until it returns, as in run().
+        """
+        self.admit()
+        deadline = time.perf_counter() + (timeout or self.timeout)
+        try:
+            started = await asyncio.wait_for(self._acquire(), deadline - time.perf_counter())
+        except asyncio.TimeoutError:
+            self.metrics["timed_out"] += 1
+            raise
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        done = object()
+        iterator = hop = None
+        try:
+            hop = loop.run_in_executor(self._threads, context.run, fn, *args)
+            iterator = await asyncio.wait_for(asyncio.shield(hop), deadline - time.perf_counter())
+            while True:
+                hop = loop.run_in_executor(self._threads, context.run, next, iterator, done)
+                item = await asyncio.wait_for(asyncio.shield(hop), deadline - time.perf_counter())
+                if item is done:
+                    break
+                yield item
+        except asyncio.TimeoutError:
+            self.metrics["timed_out"] += 1
+            raise
+        finally:
+            if hop is not None and not hop.done():
+                asyncio.ensure_future(self._close_after(hop, context, iterator, started))
+            else:
+                await self._close(context, iterator, started)
+
+    async def drain(self, timeout: float = AI_TIMEOUT) -> int:
+        """
+        Stop admitting questions, wait up to `timeout` seconds for the queued
+        and running ones to finish, then shut the threads down. Returns the
+        number of questions abandoned. reopen() starts it again.
+        """
+        self.draining = True
+        deadline = time.perf_counter() + timeout
+        while (self.running or self.waiting) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        abandoned = self.running + self.waiting
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        # Threads start on first use, so the replacement costs nothing until reopen()
+        self._threads = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="ai")
+        return abandoned
+
+    def stats(self):
+        return {
+            **self.metrics,
+            "waiting": self.waiting,
+            "running": self.running,
+            "concurrency": self.concurrency,
+            "queue_limit": self.queue_limit,
+            "draining": self.draining,
+        }
+
+executor = AIExecutor()
@@ -0,0 +1,308 @@
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+import cache, models, rollups
+from crud import VersionMismatch, WriteRejected, invalidate_after_commit, item_dates, order_date, rating_updates, unlink_children
+
+# Async mirror of crud.py for the AsyncSession stack in async_database.py
+
+# -------------------- PAGINATION --------------------
+async def _page(db: AsyncSession, model, key, skip: int, limit: int, after=None):
+    stmt = select(model).order_by(key)
+    if after is not None:
+        stmt = stmt.filter(key > after).limit(limit)
+    else:
+        stmt = stmt.offset(skip).limit(limit)
+    return (await db.scalars(stmt)).all()
+
+# -------------------- CONDITIONAL WRITES --------------------
+# As in crud.py: one UPDATE or DELETE ... RETURNING per write, conditional on
+# `version` (from If-Match) when one is given
+async def _explain_miss(db: AsyncSession, model, row_id, version, *columns):
+    # As crud._explain_miss
+    table = model.__table__
+    row = (await db.execute(select(table.c.version, *columns).where(table.primary_key.columns[0] == row_id))).first()
+    await db.rollback()
+    if row is None:
+        return None
+    if version is not None and row.version != version:
+        raise VersionMismatch(row.version)
+    return row
+
+async def _patch(db: AsyncSession, model, row_id, changes: dict, version: int = None, where=()):
+    # As crud._patch; does not commit
+    table = model.__table__
+    stmt = update(table).where(table.primary_key.columns[0] == row_id, *where).values(**changes, version=table.c.version + 1)
+    if version is not None:
+        stmt = stmt.where(table.c.version == version)
+    try:
+        row = (await db.execute(stmt.returning(*table.columns))).first()
+    except IntegrityError as e:
+        await db.rollback()
+        raise WriteRejected(str(e.orig).splitlines()[0])
+    if row is None and not where:
+        await _explain_miss(db, model, row_id, version)
+    return row
+
+async def _delete(db: AsyncSession, model, row_id, version: int = None):
+    """
+    DELETE ... RETURNING the row, or None if it does not exist. Foreign keys
+    pointing at it are nulled with one UPDATE per relationship, as in
+    crud._delete, rather than by loading the children. Does not commit.
+    """
+    table = model.__table__
+    children = {}
+    for name, stmt in unlink_children(model, row_id):
+        children.setdefault(name, []).extend((await db.execute(stmt)).scalars())
+    stmt = delete(table).where(table.primary_key.columns[0] == row_id)
+    if version is not None:
+        stmt = stmt.where(table.c.version == version)
+    row = (await db.execute(stmt.returning(*table.columns))).first()
+    if row is None:
+        await _explain_miss(db, model, row_id, version)
+        return row
+    invalidate_after_commit(db.sync_session, children)
+    return row
+
+async def _touch(db: AsyncSession, table: str, where, columns=None):
+    # As crud._touch
+    for stmt in rollups.touched(table, where, columns):
+        await db.execute(stmt)
+
+async def _save(db: AsyncSession, obj):
+    db.add(obj)
+    await db.commit()
+    cache.invalidate(obj.__tablename__)
+    await db.refresh(obj)
+    return obj
+
+# -------------------- USERS --------------------
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.scalar(select(models.User).filter(models.User.user_id == user_id))
+
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100, after: int = None):
+    return await _page(db, models.User, models.User.user_id, skip, limit, after)
+
+async def create_user(db: AsyncSession, name: str, email: str, password_hash: str):
+    user = models.User(name=name, email=email, password_hash=password_hash)
+    try:
+        return await _save(db, user)
+    except IntegrityError:
+        await db.rollback()
+        return None
+
+async def patch_user(db: AsyncSession, user_id: int, version: int = None, **changes):
+    user = await _patch(db, models.User, user_id, changes, version)
+    if not user:
+        return None
+    await db.commit()
+    cache.invalidate("users", user_id)
+    return user
+
+async def delete_user(db: AsyncSession, user_id: int, version: int = None):
+    await _touch(db, "orders", models.Order.user_id == user_id, {"user_id"})
+    user = await _delete(db, models.User, user_id, version)
+    if not user:
+        return None
+    await db.commit()
+    cache.invalidate("users", user_id)
+    cache.invalidate("orders")
+    cache.invalidate("reviews")
+    return user
+
+# -------------------- CATEGORIES --------------------
+async def get_category(db: AsyncSession, category_id: int):
+    return await db.scalar(select(models.Category).filter(models.Category.category_id == category_id))
+
+async def get_categories(db: AsyncSession, skip: int = 0, limit: int = 100, after: int = None):
+    return await _page(db, models.Category, models.Category.category_id, skip, limit, after)
+
+async def create_category(db: AsyncSession, name: str, description: str = None):
+    category = models.Category(name=name, description=description)
+    return await _save(db, category)
+
+async def patch_category(db: AsyncSession, category_id: int, version: int = None, **changes):
+    category = await _patch(db, models.Category, category_id, changes, version)
+    if not category:
+        return None
+    await db.commit()
+    cache.invalidate("categories", category_id)
+    return category
+
+async def delete_category(db: AsyncSession, category_id: int, version: int = None):
+    category = await _delete(db, models.Category, category_id, version)
+    if not category:
+        return None
+    await db.commit()
+    cache.invalidate("categories", category_id)
+    cache.flush("products")
+    return category
+
+# -------------------- PRODUCTS --------------------
+async def get_product(db: AsyncSession, product_id: int):
+    return await db.scalar(select(models.Product).filter(models.Product.product_id == product_id))
+
+async def get_products(db: AsyncSession, skip: int = 0, limit: int = 100, after: int = None):
+    return await _page(db, models.Product, models.Product.product_id, skip, limit, after)
+
+async def create_product(db: AsyncSession, name: str, description: str, price: float, stock: int, category_id: int = None):
+    product = models.Product(name=name, description=description, price=price, stock=stock, category_id=category_id)
+    return await _save(db, product)
+
+async def patch_product(db: AsyncSession, product_id: int, version: int = None, stock_delta: int = None, **changes):
+    # `stock_delta` as in crud.patch_product
+    where = ()
+    stock = models.Product.__table__.c.stock
+    if stock_delta:
+        changes["stock"] = stock + stock_delta
+        where = (stock + stock_delta >= 0,)
+    product = await _patch(db, models.Product, product_id, changes, version, where)
+    if product is None and where:
+        current = await _explain_miss(db, models.Product, product_id, version, stock)
+        if current is not None:
+            raise WriteRejected(f"Insufficient stock: {current.stock} left")
+    if not product:
+        return None
+    await db.commit()
+    cache.invalidate("products", product_id)
+    return product
+
+async def delete_product(db: AsyncSession, product_id: int, version: int = None):
+    await _touch(db, "order_items", models.OrderItem.product_id == product_id, {"product_id"})
+    await _touch(db, "reviews", models.Review.product_id == product_id, {"product_id"})
+    product = await _delete(db, models.Product, product_id, version)
+    if not product:
+        return None
+    await db.commit()
+    cache.invalidate("products", product_id)
+    cache.invalidate("order_items")
+    cache.invalidate("reviews")
+    return product
+
+# -------------------- ORDERS --------------------
+async def get_order(db: AsyncSession, order_id: int):
+    return await db.scalar(select(models.Order).filter(models.Order.order_id == order_id))
+
+async def get_orders(db: AsyncSession, skip: int = 0, limit: int = 100, after: int = None):
+    return await _page(db, models.Order, models.Order.order_id, skip, limit, after)
+
+async def create_order(db: AsyncSession, user_id: int, total_amount: float, status: str = "pending"):
+    order = models.Order(user_id=user_id, total_amount=total_amount, status=status)
+    return await _save(db, order)
+
+async def patch_order(db: AsyncSession, order_id: int, version: int = None, **changes):
+    where = models.Order.order_id == order_id
+    items = models.OrderItem.order_id == order_id
+    await _touch(db, "orders", where, changes)
+    if "order_date" in changes:
+        await _touch(db, "order_items", items, ["created_at"])
+    order = await _patch(db, models.Order, order_id, changes, version)
+    if not order:
+        return None
+    moved = []
+    if "order_date" in changes:
+        moved = (await db.execute(item_dates(order_id))).scalars().all()
+        await _touch(db, "order_items", items, ["created_at"])
+    await _touch(db, "orders", where, changes)
+    await db.commit()
+    cache.invalidate("orders", order_id)
+    if moved:
+        cache.invalidate("order_items", *moved)
+    return order
+
+async def delete_order(db: AsyncSession, order_id: int, version: int = None):
+    await _touch(db, "orders", models.Order.order_id == order_id)
+    order = await _delete(db, models.Order, order_id, version)
+    if not order:
+        return None
+    await db.commit()
+    cache.invalidate("orders", order_id)
+    cache.invalidate("order_items")
+    return order
+
+# -------------------- ORDER ITEMS --------------------
+async def get_order_item(db: AsyncSession, order_item_id: int):
+    return await db.scalar(select(models.OrderItem).filter(models.OrderItem.order_item_id == order_item_id))
+
+async def get_order_items(db: AsyncSession, skip: int = 0, limit: int = 100, after: int = None):
+    return await _page(db, models.OrderItem, models.OrderItem.order_item_id, skip, limit, after)
+
+async def create_order_item(db: AsyncSession, order_id: int, product_id: int, quantity: int, price: float):
+    item = models.OrderItem(order_id=order_id, product_id=product_id, quantity=quantity, price=price, created_at=order_date(order_id))
+    return await _save(db, item)
+
+async def patch_order_item(db: AsyncSession, order_item_id: int, version: int = None, **changes):
+    where = models.OrderItem.order_item_id == order_item_id
+    await _touch(db, "order_items", where, changes)
+    item = await _patch(db, models.OrderItem, order_item_id, changes, version)
+    if not item:
+        return None
+    await _touch(db, "order_items", where, changes)
+    await db.commit()
+    cache.invalidate("order_items", order_item_id)
+    return item
+
+async def delete_order_item(db: AsyncSession, order_item_id: int, version: int = None):
+    await _touch(db, "order_items", models.OrderItem.order_item_id == order_item_id)
+    item = await _delete(db, models.OrderItem, order_item_id, version)
+    if not item:
+        return None
+    await db.commit()
+    cache.invalidate("order_items", order_item_id)
+    return item
+
+# -------------------- REVIEWS --------------------
+async def get_review(db: AsyncSession, review_id: int):
+    return await db.scalar(select(models.Review).filter(models.Review.review_id == review_id))
+
+async def get_reviews(db: AsyncSession, skip: int = 0, limit: int = 100, after: int = None):
+    return await _page(db, models.Review, models.Review.review_id, skip, limit, after)
+
+async def create_review(db: AsyncSession, product_id: int, user_id: int, rating: int, comment: str = None):
+    review = models.Review(product_id=product_id, user_id=user_id, rating=rating, comment=comment)
+    for stmt in rating_updates(None, (product_id, rating)):
+        await db.execute(stmt)
+    try:
+        review = await _save(db, review)
+        cache.invalidate("products", product_id)
+        return review
+    except IntegrityError:
+        await db.rollback()
+        return None
+
+async def patch_review(db: AsyncSession, review_id: int, version: int = None, **changes):
+    # As crud.patch_review: only a change of rating or product_id reads the
+    # previous values, under a row lock
+    rated = "rating" in changes or "product_id" in changes
+    before = None
+    if rated:
+        table = models.Review.__table__
+        before = (await db.execute(
+            select(table.c.product_id, table.c.rating).where(table.c.review_id == review_id).with_for_update()
+        )).first()
+    where = models.Review.review_id == review_id
+    await _touch(db, "reviews", where, changes)
+    review = await _patch(db, models.Review, review_id, changes, version)
+    if not review:
+        return None
+    if rated:
+        for stmt in rating_updates(tuple(before), (review.product_id, review.rating)):
+            await db.execute(stmt)
+    await _touch(db, "reviews", where, changes)
+    await db.commit()
+    cache.invalidate("reviews", review_id)
+    if rated:
+        cache.invalidate("products", before.product_id, review.product_id)
+    return review
+
+async def delete_review(db: AsyncSession, review_id: int, version: int = None):
+    await _touch(db, "reviews", models.Review.review_id == review_id)
+    review = await _delete(db, models.Review, review_id, version)
+    if not review:
+        return None
+    for stmt in rating_updates((review.product_id, review.rating), None):
+        await db.execute(stmt)
+    await db.commit()
+    cache.invalidate("reviews", review_id)
+    cache.invalidate("products", review.product_id)
+    return review
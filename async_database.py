@@ -0,0 +1,21 @@
+import os
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from database import DATABASE_URL, engine_options
+import instrumentation
+
+ASYNC_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL",
+    DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1),
+)
+
+# Sized inside DB_CONNECTION_BUDGET: the request share when ASYNC_REQUESTS
+# is set, as by server.py for main_async; see database.pool_limits
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, pool="async"))
+instrumentation.instrument_engine(async_engine.sync_engine, "async")
+
+# Objects stay loaded after commit: an AsyncSession cannot lazy-load on attribute access
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,57 @@
+"""
+/ai/query latency with and without the answer cache.
+
+    python benchmarks/bench_ai_cache.py --rounds 5
+
+Asks the dashboard example questions `--rounds` times through
+sql_agent.run_query, first with the cache disabled and then enabled, and
+reports p50/p95 wall time per question.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ai_cache import answers
+from sql_agent import run_query
+
+QUESTIONS = [
+    "Show top 5 users",
+    "List all products under category Electronics",
+    "Give orders of user 101",
+    "Show top 5 products by price",
+]
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def measure(rounds):
+    samples = []
+    for _ in range(rounds):
+        for question in QUESTIONS:
+            start = time.perf_counter()
+            run_query(question)
+            samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'mode':<10} {'p50 ms':>10} {'p95 ms':>10}")
+    for enabled in (False, True):
+        answers.enabled = enabled
+        samples = measure(args.rounds)
+        print(f"{'cached' if enabled else 'uncached':<10} {percentile(samples, 0.5):>10.1f} {percentile(samples, 0.95):>10.1f}")
+    print(answers.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+LLM calls, tokens and wall time per question for the fast path and the agent.
+
+    python benchmarks/bench_ai_modes.py
+
+The answer cache is disabled so every question reaches the model.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from langchain_core.callbacks import BaseCallbackHandler
+from ai_cache import answers
+from llm import get_llm
+from sql_agent import run_query
+
+QUESTIONS = [
+    "Show top 5 users",
+    "List all products under category Electronics",
+    "Give orders of user 101",
+    "Show top 5 products by price",
+]
+
+
+class UsageCounter(BaseCallbackHandler):
+    def __init__(self):
+        self.calls = self.input_tokens = self.output_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        self.calls += 1
+        for generation in response.generations[0]:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            self.input_tokens += usage.get("input_tokens", 0)
+            self.output_tokens += usage.get("output_tokens", 0)
+
+
+def main():
+    answers.enabled = False
+    print(f"{'mode':<6} {'used':<6} {'calls':>6} {'in tok':>8} {'out tok':>8} {'sec':>7}  question")
+    for mode in ("fast", "agent"):
+        for question in QUESTIONS:
+            counter = UsageCounter()
+            get_llm().callbacks = [counter]
+            start = time.perf_counter()
+            result = run_query(question, mode)
+            elapsed = time.perf_counter() - start
+            print(f"{mode:<6} {result['mode'] or '-':<6} {counter.calls:>6} {counter.input_tokens:>8} {counter.output_tokens:>8} {elapsed:>7.2f}  {question}")
+
+
+if __name__ == "__main__":
+    main()
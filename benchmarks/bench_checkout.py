@@ -0,0 +1,78 @@
+"""
+Concurrent checkouts against a handful of hot SKUs.
+
+    python benchmarks/bench_checkout.py --checkouts 200 --connections 50 --skus 3 --stock 150
+
+Runs `--checkouts` parallel crud.place_order calls, contending for
+`--connections` pooled connections (kept under PostgreSQL's default
+max_connections of 100), each buying random quantities of the hot products,
+then checks that stock never went negative and that every unit sold is
+accounted for by exactly one order item.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+import crud, database, models
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkouts", type=int, default=200)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--skus", type=int, default=3)
+    parser.add_argument("--stock", type=int, default=150)
+    args = parser.parse_args()
+
+    # Checkouts beyond the pool queue for a connection rather than failing
+    engine = create_engine(database.DATABASE_URL, pool_size=args.connections, max_overflow=0, pool_timeout=300)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    with Session() as db:
+        user = crud.create_user(db, "checkout bench", f"checkout-{time.time_ns()}@example.com", "x")
+        user_id = user.user_id
+        skus = [crud.create_product(db, f"hot sku {i}", None, 9.99, args.stock).product_id for i in range(args.skus)]
+
+    def checkout(seed):
+        rng = random.Random(seed)
+        lines = [{"product_id": pid, "quantity": rng.randint(1, 3)} for pid in rng.sample(skus, rng.randint(1, len(skus)))]
+        with Session() as db:
+            try:
+                return crud.place_order(db, user_id, lines) is not None
+            except crud.OrderRejected:
+                return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.checkouts) as pool:
+        placed = sum(pool.map(checkout, range(args.checkouts)))
+    elapsed = time.perf_counter() - start
+
+    with Session() as db:
+        stock = dict(db.query(models.Product.product_id, models.Product.stock).filter(models.Product.product_id.in_(skus)))
+        sold = dict(
+            db.query(models.OrderItem.product_id, func.sum(models.OrderItem.quantity))
+            .join(models.Order)
+            .filter(models.Order.user_id == user_id)
+            .group_by(models.OrderItem.product_id)
+        )
+
+    print(f"{placed}/{args.checkouts} checkouts placed in {elapsed:.2f}s ({args.checkouts / elapsed:.0f}/s)")
+    oversold = False
+    for pid in skus:
+        units = sold.get(pid, 0)
+        ok = stock[pid] >= 0 and stock[pid] + units == args.stock
+        oversold |= not ok
+        print(f"product {pid}: stock {stock[pid]:>4} sold {units:>4} {'ok' if ok else 'MISMATCH'}")
+    engine.dispose()
+    sys.exit(1 if oversold else 0)
+
+
+if __name__ == "__main__":
+    main()
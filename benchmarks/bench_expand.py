@@ -0,0 +1,58 @@
+"""
+SQL statements per request for each ?expand= combination.
+
+    python benchmarks/bench_expand.py --items 50
+
+Creates an order with `--items` line items (one product each) in the
+configured database and reads it back through the app with every expand
+combination of tests/test_expand.py, which asserts the same counts on
+SQLite. Exits non-zero if any request runs more statements than that.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+import crud, database
+from main import app
+from test_expand import CASES
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=50)
+    args = parser.parse_args()
+
+    with database.SessionLocal() as db:
+        user = crud.create_user(db, "expand bench", f"expand-{time.time_ns()}@example.com", "x")
+        category = crud.create_category(db, "expand bench")
+        products = [crud.create_product(db, f"expand {i}", None, 1, 1000, category.category_id) for i in range(args.items)]
+        order = crud.place_order(db, user.user_id, [{"product_id": p.product_id, "quantity": 1} for p in products])
+        ids = {"order_id": order.order_id, "user_id": user.user_id, "product_id": products[0].product_id}
+
+    statements = []
+    listener = lambda *a, **kw: statements.append(1)
+    event.listen(database.engine, "before_cursor_execute", listener)
+
+    client = TestClient(app)
+    failures = 0
+    print(f"{'statements':>10} {'budget':>7}  path")
+    for path, budget in CASES:
+        statements.clear()
+        resp = client.get(path.format(**ids))
+        resp.raise_for_status()
+        ok = len(statements) <= budget
+        failures += not ok
+        print(f"{len(statements):>10} {budget:>7}  {path}{'' if ok else '  OVER BUDGET'}")
+
+    event.remove(database.engine, "before_cursor_execute", listener)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Export throughput and peak memory, per format, against paging the list API.
+
+    python benchmarks/bench_export.py --table order_items
+
+Each case runs in a fresh subprocess so its peak RSS is its own:
+ndjson, csv and parquet through export.stream, and the old approach of
+paging crud.get_<table> 100 rows at a time into one JSON list. Output is
+counted and discarded.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+FORMATS = ["ndjson", "csv", "parquet", "paged-json"]
+
+def run_one(table: str, fmt: str):
+    from fastapi.encoders import jsonable_encoder
+    from sqlalchemy import func, select
+    import crud, database, export
+
+    model = export.TABLES[table][0]
+    with database.SessionLocal() as db:
+        rows = db.scalar(select(func.count()).select_from(model))
+
+    start = time.perf_counter()
+    size = 0
+    if fmt == "paged-json":
+        schema = export.TABLES[table][1]
+        fetch = getattr(crud, f"get_{table}")
+        pages, skip = [], 0
+        with database.SessionLocal() as db:
+            while True:
+                page = fetch(db, skip=skip, limit=100)
+                pages.extend(jsonable_encoder([schema.from_orm(row) for row in page]))
+                if len(page) < 100:
+                    break
+                skip += 100
+        size = len(json.dumps(pages))
+    else:
+        for chunk in export.stream(table, fmt):
+            size += len(chunk)
+    seconds = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"rows": rows, "seconds": seconds, "bytes": size, "peak_rss_mb": peak_kb / 1024}))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", default="order_items")
+    parser.add_argument("--formats", nargs="+", default=FORMATS)
+    parser.add_argument("--one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        run_one(args.table, args.one)
+        return
+
+    print(f"{'format':>11} {'rows':>9} {'rows/s':>10} {'MB out':>8} {'peak RSS MB':>12}")
+    for fmt in args.formats:
+        out = subprocess.run(
+            [sys.executable, __file__, "--table", args.table, "--one", fmt],
+            capture_output=True, text=True,
+        )
+        if out.returncode:
+            print(f"{fmt:>11}  failed: {out.stderr.strip().splitlines()[-1] if out.stderr.strip() else out.returncode}")
+            continue
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{fmt:>11} {r['rows']:>9} {r['rows'] / r['seconds']:>10.0f} {r['bytes'] / 1e6:>8.1f} {r['peak_rss_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
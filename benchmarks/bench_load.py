@@ -0,0 +1,61 @@
+"""
+HTTP load test: requests/sec and latency at a fixed number of concurrent clients.
+
+    uvicorn main:app --port 8000 &
+    uvicorn main_async:app --port 8001 &
+    python benchmarks/bench_load.py --url http://127.0.0.1:8000 --url http://127.0.0.1:8001 --clients 500
+
+Each client loops over `--path` requests until `--duration` seconds have passed.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def client(http, path, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            resp = await http.get(path)
+            resp.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except httpx.HTTPError:
+            errors.append(1)
+
+
+async def run(url, path, clients, duration):
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as http:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(client(http, path, deadline, latencies, errors) for _ in range(clients)))
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+    return {
+        "rps": len(latencies) / duration,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", action="append", required=True)
+    parser.add_argument("--path", default="/products?limit=20")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30)
+    args = parser.parse_args()
+
+    print(f"{'url':<30} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7}")
+    for url in args.url:
+        r = asyncio.run(run(url, args.path, args.clients, args.duration))
+        print(f"{url:<30} {r['rps']:>9.0f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
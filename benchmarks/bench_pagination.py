@@ -0,0 +1,74 @@
+"""
+Offset vs keyset pagination latency on the orders table.
+
+    python benchmarks/bench_pagination.py --rows 1000000
+
+Seeds the orders table with generate_series (PostgreSQL) until it holds
+`--rows` rows, then times single pages fetched at increasing depths.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import text
+import crud, database
+
+
+def seed(rows: int):
+    with database.engine.begin() as conn:
+        existing = conn.execute(text("SELECT count(*) FROM orders")).scalar()
+        if existing >= rows:
+            return
+        user_id = conn.execute(text("SELECT min(user_id) FROM users")).scalar()
+        if user_id is None:
+            user_id = conn.execute(text(
+                "INSERT INTO users (name, email, password_hash) "
+                "VALUES ('bench', 'bench@example.com', 'x') RETURNING user_id"
+            )).scalar()
+        conn.execute(text(
+            "INSERT INTO orders (user_id, total_amount, status) "
+            "SELECT :user_id, (random() * 500)::numeric(10,2), 'pending' "
+            "FROM generate_series(1, :n)"
+        ), {"user_id": user_id, "n": rows - existing})
+        conn.execute(text("ANALYZE orders"))
+
+
+def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    seed(args.rows)
+    db = database.SessionLocal()
+    try:
+        ids = [row[0] for row in db.execute(text("SELECT order_id FROM orders ORDER BY order_id")).yield_per(100_000)]
+        print(f"{'depth':>10} {'offset ms':>12} {'keyset ms':>12}")
+        depth = args.limit
+        while depth < len(ids):
+            after = ids[depth - 1]
+            offset_ms = timed(lambda: crud.get_orders(db, skip=depth, limit=args.limit), args.repeat)
+            keyset_ms = timed(lambda: crud.get_orders(db, limit=args.limit, after=after), args.repeat)
+            print(f"{depth:>10} {offset_ms:>12.2f} {keyset_ms:>12.2f}")
+            db.expunge_all()
+            depth *= 10
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Insert throughput and recent-range query latency: a plain orders-shaped
+table vs one range-partitioned by month. PostgreSQL only.
+
+    python benchmarks/bench_partitions.py --rows 100000000 --months 36
+    python benchmarks/bench_partitions.py --rows 2000000 --batch 500000 --repeat 50
+
+Both tables are scratch copies (bench_orders_plain, bench_orders_monthly)
+with the orders indexes, filled with the same generate_series rows spread
+over the last --months months, --batch rows per transaction. Insert rows/s
+is reported for every batch, so index growth on the plain table shows up as
+the load goes on. Then each recent-range question is timed on both tables,
+with the partitions EXPLAIN says it scans. Exits 1 if the partitioned table
+scans every month for them. --keep leaves the tables for a closer look.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import text
+import database, partitions
+
+PLAIN = "bench_orders_plain"
+MONTHLY = "bench_orders_monthly"
+
+COLUMNS = "order_id BIGINT NOT NULL, user_id INTEGER, order_date TIMESTAMP WITH TIME ZONE NOT NULL, total_amount NUMERIC(10, 2), status VARCHAR(50)"
+
+QUESTIONS = [
+    ("orders in the last 30 days",
+     "SELECT count(*), sum(total_amount) FROM {table} WHERE order_date >= now() - interval '30 days'"),
+    ("one user's orders this month",
+     "SELECT order_id, total_amount FROM {table} WHERE user_id = :user_id "
+     "AND order_date >= date_trunc('month', now()) ORDER BY order_date DESC LIMIT 50"),
+    ("revenue per day, last 7 days",
+     "SELECT date_trunc('day', order_date) AS day, sum(total_amount) FROM {table} "
+     "WHERE order_date >= now() - interval '7 days' GROUP BY day ORDER BY day"),
+]
+
+def create_tables(conn, months: int):
+    for table in (PLAIN, MONTHLY):
+        conn.execute(text(f"DROP TABLE IF EXISTS {table} CASCADE"))
+    conn.execute(text(f"CREATE TABLE {PLAIN} ({COLUMNS}, PRIMARY KEY (order_id))"))
+    conn.execute(text(f"CREATE TABLE {MONTHLY} ({COLUMNS}, PRIMARY KEY (order_id, order_date)) PARTITION BY RANGE (order_date)"))
+    this_month = partitions.month_start(date.today())
+    partitions.create_partitions(conn, MONTHLY, partitions.add_months(this_month, -months), partitions.add_months(this_month, 1))
+    for table in (PLAIN, MONTHLY):
+        conn.execute(text(f"CREATE INDEX ix_{table}_user_id ON {table} (user_id)"))
+        conn.execute(text(f"CREATE INDEX ix_{table}_order_date ON {table} (order_date)"))
+
+def load(table: str, rows: int, batch: int, months: int, users: int):
+    # Ids walk forward while dates are scattered, as with orders backfilled
+    # or arriving late; every row lands in a random one of the months
+    sql = text(
+        f"INSERT INTO {table} (order_id, user_id, order_date, total_amount, status) "
+        "SELECT i, 1 + (hashint4(i::int) & 2147483647) % :users, "
+        "now() - (hashint4(i::int + 7) & 2147483647) % (:days * 86400) * interval '1 second', "
+        "((hashint4(i::int + 13) & 2147483647) % 50000) / 100.0, 'completed' "
+        "FROM generate_series(CAST(:low AS BIGINT) + 1, CAST(:high AS BIGINT)) AS i"
+    )
+    rates = []
+    for low in range(0, rows, batch):
+        high = min(low + batch, rows)
+        start = time.perf_counter()
+        with database.engine.begin() as conn:
+            conn.execute(sql, {"low": low, "high": high, "users": users, "days": months * 30})
+        rates.append((high - low) / (time.perf_counter() - start))
+        print(f"  {table}: {high:>12,} rows  {rates[-1]:>10,.0f} rows/s", flush=True)
+    with database.engine.begin() as conn:
+        conn.execute(text(f"ANALYZE {table}"))
+    return rates
+
+def scanned(conn, sql: str, params) -> int:
+    # Relations the plan reads: the table itself, or each partition it kept
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+    names = set()
+
+    def walk(node):
+        if "Relation Name" in node:
+            names.add(node["Relation Name"])
+        for child in node.get("Plans", ()):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return len(names)
+
+def timed(conn, sql: str, params, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(text(sql), params).all()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000_000)
+    parser.add_argument("--batch", type=int, default=1_000_000)
+    parser.add_argument("--months", type=int, default=24, help="months of history the rows are spread over")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--keep", action="store_true", help="leave the scratch tables in place")
+    args = parser.parse_args()
+
+    if database.engine.dialect.name != "postgresql":
+        sys.exit("bench_partitions.py needs PostgreSQL")
+    with database.engine.begin() as conn:
+        create_tables(conn, args.months)
+
+    inserts = {}
+    for table in (PLAIN, MONTHLY):
+        print(f"Loading {args.rows:,} rows into {table}")
+        inserts[table] = load(table, args.rows, args.batch, args.months, args.users)
+
+    print(f"\n{'insert rows/s':<32} {'plain':>12} {'monthly':>12}")
+    for label, pick in (("first batch", lambda r: r[0]), ("last batch", lambda r: r[-1]), ("median", statistics.median)):
+        print(f"{label:<32} {pick(inserts[PLAIN]):>12,.0f} {pick(inserts[MONTHLY]):>12,.0f}")
+
+    failed = False
+    with database.engine.connect() as conn:
+        total = len(partitions.attached(conn, MONTHLY))
+        print(f"\n{'question':<32} {'plain ms':>9} {'monthly ms':>11} {'partitions':>11}")
+        for name, sql in QUESTIONS:
+            params = {"user_id": 1 + args.users // 2} if ":user_id" in sql else {}
+            plain = timed(conn, sql.format(table=PLAIN), params, args.repeat)
+            monthly = timed(conn, sql.format(table=MONTHLY), params, args.repeat)
+            kept = scanned(conn, sql.format(table=MONTHLY), params)
+            print(f"{name:<32} {plain:>9.2f} {monthly:>11.2f} {kept:>5} of {total:<3}", flush=True)
+            if kept >= total:
+                failed = True
+
+    if not args.keep:
+        with database.engine.begin() as conn:
+            for table in (PLAIN, MONTHLY):
+                conn.execute(text(f"DROP TABLE {table} CASCADE"))
+    if failed:
+        sys.exit("the partitioned table scanned every partition for a recent range")
+
+
+if __name__ == "__main__":
+    main()
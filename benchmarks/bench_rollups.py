@@ -0,0 +1,89 @@
+"""
+Typical analytic questions answered from the base tables vs the rollups.
+
+    python benchmarks/bench_rollups.py --repeat 20
+
+Rebuilds the rollups, times an incremental refresh after one new order, then
+reports the median latency of each question both ways and checks that the
+answers agree.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import text
+import crud, database, rollups
+
+QUESTIONS = [
+    (
+        "top 5 products by revenue",
+        "SELECT p.product_id, SUM(oi.quantity * oi.price) AS revenue FROM order_items oi "
+        "JOIN products p ON p.product_id = oi.product_id GROUP BY p.product_id ORDER BY revenue DESC, p.product_id LIMIT 5",
+        "SELECT product_id, SUM(revenue) AS revenue FROM daily_product_revenue "
+        "GROUP BY product_id ORDER BY revenue DESC, product_id LIMIT 5",
+    ),
+    (
+        "average rating per category",
+        "SELECT p.category_id, ROUND(AVG(r.rating), 2) FROM reviews r JOIN products p ON p.product_id = r.product_id "
+        "WHERE r.rating IS NOT NULL GROUP BY p.category_id ORDER BY p.category_id",
+        "SELECT p.category_id, ROUND(CAST(SUM(s.rating_sum) AS NUMERIC) / NULLIF(SUM(s.rating_count), 0), 2) "
+        "FROM product_rating_stats s JOIN products p ON p.product_id = s.product_id GROUP BY p.category_id ORDER BY p.category_id",
+    ),
+    (
+        "daily sales",
+        "SELECT DATE(o.order_date) AS day, SUM(oi.quantity * oi.price) FROM order_items oi "
+        "JOIN orders o ON o.order_id = oi.order_id WHERE oi.product_id IS NOT NULL GROUP BY DATE(o.order_date) ORDER BY day",
+        "SELECT day, SUM(revenue) FROM daily_product_revenue GROUP BY day ORDER BY day",
+    ),
+    (
+        "top 5 customers by spend",
+        "SELECT user_id, SUM(total_amount) AS spent FROM orders WHERE user_id IS NOT NULL "
+        "GROUP BY user_id ORDER BY spent DESC, user_id LIMIT 5",
+        "SELECT user_id, total_spent FROM user_order_stats ORDER BY total_spent DESC, user_id LIMIT 5",
+    ),
+]
+
+def timed(conn, sql, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = conn.execute(text(sql)).all()
+        samples.append(time.perf_counter() - start)
+    return rows, statistics.median(samples)
+
+def normalize(rows):
+    return [tuple(float(v) if hasattr(v, "as_tuple") else str(v) if v is not None else None for v in row) for row in rows]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with database.SessionLocal() as db:
+        for name, result in rollups.refresh(db, full=True).items():
+            print(f"full rebuild     {name:<24} {result['seconds'] * 1000:8.1f} ms")
+        product = crud.get_products(db, limit=1)
+        user = crud.get_users(db, limit=1)
+        if product and user:
+            crud.place_order(db, user[0].user_id, [{"product_id": product[0].product_id, "quantity": 1}])
+        for name, result in rollups.refresh(db).items():
+            print(f"incremental      {name:<24} {result['seconds'] * 1000:8.1f} ms  ({result['mode']})")
+
+    mismatches = 0
+    print(f"\n{'base ms':>9} {'rollup ms':>10} {'speedup':>8}  question")
+    with database.engine.connect() as conn:
+        for question, base_sql, rollup_sql in QUESTIONS:
+            base_rows, base = timed(conn, base_sql, args.repeat)
+            rollup_rows, rolled = timed(conn, rollup_sql, args.repeat)
+            same = normalize(base_rows) == normalize(rollup_rows)
+            mismatches += not same
+            print(f"{base * 1000:9.2f} {rolled * 1000:10.2f} {base / rolled:7.1f}x  {question}{'' if same else '  MISMATCH'}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Throughput as server.py goes from 1 to N worker processes.
+
+    python benchmarks/bench_scaling.py --workers 1 2 4 8 --budget 40
+    python benchmarks/bench_scaling.py --app main_async:app --path "/orders?limit=50"
+
+For each worker count, starts `python server.py --workers N`, waits until it
+answers, then runs bench_load.py's closed-loop clients against it for
+--duration seconds. The clients are spread over --client-processes
+processes so the load generator is not the bottleneck. The server is then
+stopped with SIGINT, through the graceful shutdown path. Speedup and
+per-worker efficiency are relative to the first worker count.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import httpx
+from bench_load import run
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def _load(url, path, clients, duration):
+    return asyncio.run(run(url, path, clients, duration))
+
+def wait_ready(url: str, server, timeout: float = 120) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            return False
+        try:
+            if httpx.get(f"{url}/", timeout=2).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    return False
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--app", default="main:app")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--budget", type=int, default=40, help="DB connection budget shared by the workers")
+    parser.add_argument("--path", default="/products?limit=20")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--client-processes", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.port}"
+    print(f"{'workers':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7} {'speedup':>8} {'eff.':>6}")
+    base = None
+    for workers in args.workers:
+        server = subprocess.Popen(
+            [sys.executable, "server.py", "--app", args.app, "--workers", str(workers), "--port", str(args.port),
+             "--budget", str(args.budget), "--log-level", "warning"],
+            cwd=ROOT,
+        )
+        try:
+            if not wait_ready(url, server):
+                sys.exit(f"server with {workers} workers did not start")
+            per_process = max(args.clients // args.client_processes, 1)
+            with ProcessPoolExecutor(args.client_processes) as pool:
+                results = list(pool.map(_load, *zip(*[(url, args.path, per_process, args.duration)] * args.client_processes)))
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(60)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+        rps = sum(r["rps"] for r in results)
+        p50 = sum(r["p50_ms"] for r in results) / len(results)
+        p95 = max(r["p95_ms"] for r in results)
+        errors = sum(r["errors"] for r in results)
+        if base is None:
+            base = (workers, rps)
+        speedup = rps / base[1] if base[1] else 0
+        efficiency = speedup / (workers / base[0])
+        print(f"{workers:>7} {rps:>9.0f} {p50:>8.1f} {p95:>8.1f} {errors:>7} {speedup:>7.2f}x {efficiency:>6.0%}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
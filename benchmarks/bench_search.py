@@ -0,0 +1,110 @@
+"""
+Latency of GET /products/search queries on a large synthetic catalog.
+
+    python benchmarks/bench_search.py --seed 1000000 --repeat 50
+
+--seed adds that many products (names and descriptions drawn from a fixed
+vocabulary, 50 categories) with generate_series, so point DATABASE_URL at a
+scratch database. Run `python create_tables.py` first so the search column
+and indexes exist. Each scenario runs the same crud calls as the endpoint:
+one page, plus the facet counts on a first page. Exits non-zero if the
+overall p95 is over --target-ms. PostgreSQL only.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import text
+import crud, database
+
+WORDS = [
+    "wireless", "bluetooth", "headphones", "speaker", "charger", "laptop", "stand", "keyboard",
+    "mouse", "monitor", "camera", "tripod", "backpack", "bottle", "steel", "cotton", "shirt",
+    "jacket", "running", "shoes", "leather", "wallet", "watch", "smart", "lamp", "desk", "chair",
+    "ergonomic", "kitchen", "knife", "blender", "coffee", "grinder", "organic", "tea", "yoga",
+    "mat", "garden", "hose", "portable", "compact", "premium", "vintage", "classic", "mini", "pro",
+]
+
+SCENARIOS = [
+    ("single term", {"q": "headphones"}),
+    ("two terms", {"q": "wireless charger"}),
+    ("phrase", {"q": '"running shoes"'}),
+    ("typo (fuzzy fallback)", {"q": "hedphones"}),
+    ("category filter", {"q": "steel", "category_id": 7}),
+    ("price range", {"q": "lamp", "min_price": 20, "max_price": 80}),
+    ("in stock, min rating", {"q": "coffee", "in_stock": True, "min_rating": 4}),
+    ("sort by price", {"q": "premium", "sort": "price_asc"}),
+    ("sort by price desc", {"q": "jacket", "sort": "price_desc", "in_stock": True}),
+]
+
+def seed(conn, count: int, batch: int = 100000):
+    conn.execute(text(
+        "INSERT INTO categories (name) SELECT 'Search bench ' || g FROM generate_series(1, 50) g"
+    ))
+    categories = [row[0] for row in conn.execute(text(
+        "SELECT category_id FROM categories WHERE name LIKE 'Search bench %' ORDER BY category_id DESC LIMIT 50"
+    ))]
+    for start in range(0, count, batch):
+        size = min(batch, count - start)
+        conn.execute(
+            text(
+                "INSERT INTO products (name, description, price, stock, category_id, rating_count, rating_sum, rating_avg) "
+                "SELECT initcap(w[1 + (g * 7) % n] || ' ' || w[1 + (g * 13) % n] || ' ' || w[1 + (g * 31) % n]), "
+                "'A ' || w[1 + (g * 17) % n] || ' ' || w[1 + (g * 23) % n] || ' made for ' || w[1 + (g * 29) % n] || ' lovers', "
+                "round((1 + random() * 499)::numeric, 2), greatest((random() * 60)::int - 10, 0), "
+                "(:categories)[1 + g % 50], 0, 0, round((random() * 5)::numeric, 2) "
+                "FROM generate_series(:start, :end) g, (SELECT CAST(:words AS text[]) AS w, :n AS n) v"
+            ),
+            {"start": start, "end": start + size - 1, "words": WORDS, "n": len(WORDS), "categories": categories},
+        )
+        conn.commit()
+        print(f"seeded {start + size}/{count} products", flush=True)
+    conn.execute(text("ANALYZE products"))
+    conn.commit()
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0, help="products to add before measuring")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--target-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    if not database.DATABASE_URL.startswith("postgresql"):
+        sys.exit("bench_search needs a Postgres DATABASE_URL")
+    if args.seed:
+        with database.engine.connect() as conn:
+            seed(conn, args.seed)
+
+    everything = []
+    print(f"\n{'p50 ms':>8} {'p95 ms':>8} {'hits':>5} {'mode':>9}  scenario")
+    with database.SessionLocal() as db:
+        for name, params in SCENARIOS:
+            params = dict(params)
+            q, sort = params.pop("q"), params.pop("sort", "relevance")
+            samples = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                rows, fuzzy = crud.search_products(db, q, sort, None, args.limit, **params)
+                crud.search_facets(db, q, fuzzy, **params)
+                samples.append((time.perf_counter() - start) * 1000)
+            db.rollback()
+            everything.extend(samples)
+            mode = "fuzzy" if fuzzy else "fulltext"
+            print(f"{statistics.median(samples):8.2f} {percentile(samples, 0.95):8.2f} {len(rows):>5} {mode:>9}  {name}")
+
+    p95 = percentile(everything, 0.95)
+    print(f"\noverall p95 {p95:.2f} ms (target {args.target_ms:.0f} ms)")
+    sys.exit(1 if p95 > args.target_ms else 0)
+
+
+if __name__ == "__main__":
+    main()
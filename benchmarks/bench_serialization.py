@@ -0,0 +1,63 @@
+"""
+Per-row cost of serializing a list response, default path vs fastjson.
+
+    python benchmarks/bench_serialization.py --sizes 10 100 1000 10000
+
+No database needed: rows are built in memory as order_items. The default
+path is what a response_model route does (from_orm validation per row, then
+jsonable_encoder and json.dumps). The fast path turns column tuples into
+dicts and encodes them with fastjson.dumps, which uses orjson when it is
+installed. Both outputs are checked to decode to the same JSON.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.encoders import jsonable_encoder
+import fastjson, models, schemas
+
+def default_path(objects):
+    return json.dumps(jsonable_encoder([schemas.OrderItem.from_orm(obj) for obj in objects]), separators=(",", ":")).encode()
+
+def fast_path(keys, tuples):
+    return fastjson.dumps([dict(zip(keys, row)) for row in tuples])
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    keys = [column.name for column in fastjson.columns(models.OrderItem, schemas.OrderItem)]
+    print(f"encoder: {'orjson' if fastjson.orjson else 'json (orjson not installed)'}")
+    print(f"{'rows':>7} {'default us/row':>15} {'fast us/row':>12} {'speedup':>8}")
+    for size in args.sizes:
+        values = [
+            {"order_item_id": i, "order_id": i // 3 + 1, "product_id": i % 500 + 1, "quantity": i % 4 + 1, "price": Decimal("19.99") + i % 100}
+            for i in range(size)
+        ]
+        objects = [models.OrderItem(**row) for row in values]
+        tuples = [tuple(row[key] for key in keys) for row in values]
+        if json.loads(default_path(objects)) != json.loads(fast_path(keys, tuples)):
+            sys.exit("default and fast output differ")
+
+        slow = best_of(lambda: default_path(objects), args.repeat) / size
+        fast = best_of(lambda: fast_path(keys, tuples), args.repeat) / size
+        print(f"{size:>7} {slow * 1e6:>15.2f} {fast * 1e6:>12.2f} {slow / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
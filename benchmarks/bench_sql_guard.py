@@ -0,0 +1,33 @@
+"""
+Parse overhead per query of safety.guard, over the accepted queries of the
+tests/test_safety.py corpus, which is also where the verdicts are checked.
+
+    python benchmarks/bench_sql_guard.py --repeat 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+import safety
+from test_safety import ACCEPTED
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for sql in ACCEPTED:
+            safety.guard(sql)
+    per_query = (time.perf_counter() - start) / (args.repeat * len(ACCEPTED))
+
+    print(f"guard overhead over {len(ACCEPTED)} queries: {per_query * 1e6:.0f} µs/query")
+
+
+if __name__ == "__main__":
+    main()
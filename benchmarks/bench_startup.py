@@ -0,0 +1,97 @@
+"""
+Import time and first-request latency of the app, for this tree or others.
+
+    python benchmarks/bench_startup.py
+    git worktree add /tmp/before <commit>
+    python benchmarks/bench_startup.py --root /tmp/before --root .
+
+Each measurement runs in a fresh subprocess with --root first on sys.path:
+the time to import sql_agent and then main, the first GET /products and
+the first /ai/query in agent mode, both through main.app's ASGI stack. The
+AI path uses the replay model from suite.py, so no Ollama is needed, and the
+answer cache is disabled.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+def measure(root: str):
+    sys.path[:0] = [root, BENCHMARKS]
+    os.chdir(root)
+    timings = {}
+    start = time.perf_counter()
+    import sql_agent
+    timings["import_sql_agent_ms"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    import main
+    timings["import_main_ms"] = (time.perf_counter() - start) * 1000
+
+    import asyncio
+    import httpx
+    import llm
+    from ai_cache import answers
+    from suite import replay_model
+
+    llm.set_llm(replay_model())
+    answers.enabled = False
+
+    async def first_requests():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+            for name, method, path, body in (
+                ("first_products_ms", "GET", "/products?limit=20", None),
+                ("first_ai_agent_ms", "POST", "/ai/query", {"question": "How many users are there?", "mode": "agent"}),
+                ("second_ai_agent_ms", "POST", "/ai/query", {"question": "Orders per status", "mode": "agent"}),
+            ):
+                start = time.perf_counter()
+                response = await http.request(method, path, json=body)
+                timings[name] = (time.perf_counter() - start) * 1000
+                if response.status_code >= 400:
+                    timings[name] = None
+
+    asyncio.run(first_requests())
+    print(json.dumps(timings))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", action="append", help="repository checkout to measure (repeatable)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        measure(args.one)
+        return
+
+    roots = args.root or [os.path.dirname(BENCHMARKS)]
+    names = ["import_sql_agent_ms", "import_main_ms", "first_products_ms", "first_ai_agent_ms", "second_ai_agent_ms"]
+    print(f"{'root':<30} " + " ".join(f"{name[:-3]:>18}" for name in names))
+    failed = False
+    for root in roots:
+        runs = []
+        for _ in range(args.repeat):
+            out = subprocess.run([sys.executable, __file__, "--one", os.path.abspath(root)], capture_output=True, text=True)
+            if out.returncode:
+                print(f"{root:<30} failed: {out.stderr.strip().splitlines()[-1] if out.stderr.strip() else out.returncode}")
+                failed = True
+                break
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        if not runs:
+            continue
+        # Median of the runs per column; None when the request failed
+        row = []
+        for name in names:
+            values = sorted(run[name] for run in runs if run.get(name) is not None)
+            row.append(f"{values[len(values) // 2]:>18.1f}" if values else f"{'error':>18}")
+        print(f"{root:<30} " + " ".join(row))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Round trips and latency per write: the read-modify-write path the crud
+update_*/delete_* functions used to take vs the single-statement
+UPDATE/DELETE ... RETURNING of crud.patch_* / crud.delete_*.
+
+    python benchmarks/bench_updates.py --iterations 500
+    python benchmarks/bench_updates.py --threads 16 --stock 1000
+
+Round trips are the statements sent plus COMMITs, counted on
+database.engine. The concurrency check then has --threads sessions sell
+one unit each of a product until it runs out, once with get/decrement/commit
+(retried when the version check sees a concurrent sale) and once with
+stock_delta. Exits 1 if stock_delta loses an update or oversells.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import event
+from sqlalchemy.orm.exc import StaleDataError
+import cache, crud, database, models, rollups
+
+# -------------------- Previous write path --------------------
+conflicts = 0
+
+def legacy_update(db, product_id: int, **changes):
+    product = crud.get_product(db, product_id)
+    for key, value in changes.items():
+        setattr(product, key, value)
+    db.commit()
+    cache.invalidate("products", product_id)
+    db.refresh(product)
+    return product
+
+def legacy_sell(db, product_id: int, quantity: int):
+    global conflicts
+    while True:
+        product = crud.get_product(db, product_id)
+        if product.stock < quantity:
+            db.rollback()
+            return None
+        product.stock -= quantity
+        try:
+            db.commit()
+        except StaleDataError:
+            # The mapper's version check caught a concurrent sale; start over
+            db.rollback()
+            conflicts += 1
+            continue
+        cache.invalidate("products", product_id)
+        db.refresh(product)
+        return product
+
+def legacy_delete(db, product_id: int):
+    product = crud.get_product(db, product_id)
+    db.delete(product)
+    for stmt in rollups.mark_stale("order_items", "reviews"):
+        db.execute(stmt)
+    db.commit()
+    cache.invalidate("products", product_id)
+    return product
+
+def conditional_sell(db, product_id: int, quantity: int):
+    try:
+        return crud.patch_product(db, product_id, stock_delta=-quantity)
+    except crud.WriteRejected:
+        return None
+
+# -------------------- Measurement --------------------
+round_trips = 0
+
+def _count(*args, **kwargs):
+    global round_trips
+    round_trips += 1
+
+def measure(write, ids, iterations: int):
+    global round_trips
+    samples, trips = [], []
+    with database.SessionLocal() as db:
+        for i in range(iterations):
+            round_trips = 0
+            start = time.perf_counter()
+            write(db, ids[i % len(ids)], i)
+            samples.append((time.perf_counter() - start) * 1000)
+            trips.append(round_trips)
+    return statistics.mean(trips), statistics.median(samples), sorted(samples)[int(len(samples) * 0.95)]
+
+def new_products(count: int):
+    with database.SessionLocal() as db:
+        return [crud.create_product(db, f"bench update {i}", "", 10, 10 ** 6).product_id for i in range(count)]
+
+def sell_out(sell, threads: int, stock: int):
+    with database.SessionLocal() as db:
+        product_id = crud.create_product(db, "bench contended", "", 10, stock).product_id
+
+    def worker(_):
+        sold = 0
+        with database.SessionLocal() as db:
+            while sell(db, product_id, 1) is not None:
+                sold += 1
+        return sold
+
+    with ThreadPoolExecutor(threads) as pool:
+        sold = sum(pool.map(worker, range(threads)))
+    with database.SessionLocal() as db:
+        left = crud.get_product(db, product_id).stock
+    # Every unit sold must be missing from stock; the rest were lost updates
+    return sold, left, sold - (stock - left)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--stock", type=int, default=500)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(database.engine)
+    event.listen(database.engine, "before_cursor_execute", _count)
+    event.listen(database.engine, "commit", _count)
+
+    ids = new_products(args.products)
+    doomed = new_products(args.iterations * 2)
+    cases = [
+        ("update name+price", lambda db, pid, i: legacy_update(db, pid, name=f"renamed {i}", price=10 + i % 7),
+                              lambda db, pid, i: crud.patch_product(db, pid, name=f"renamed {i}", price=10 + i % 7)),
+        ("sell 1 unit", lambda db, pid, i: legacy_sell(db, pid, 1),
+                        lambda db, pid, i: conditional_sell(db, pid, 1)),
+        ("delete", lambda db, pid, i: legacy_delete(db, doomed[i]),
+                   lambda db, pid, i: crud.delete_product(db, doomed[args.iterations + i])),
+    ]
+    print(f"{'write':<18} {'path':<10} {'round trips':>11} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, legacy, current in cases:
+        for path, write in (("before", legacy), ("RETURNING", current)):
+            trips, p50, p95 = measure(write, ids, args.iterations)
+            print(f"{name:<18} {path:<10} {trips:>11.1f} {p50:>8.2f} {p95:>8.2f}", flush=True)
+
+    print(f"\n{args.threads} threads selling {args.stock} units one at a time")
+    failed = False
+    for path, sell in (("before", legacy_sell), ("stock_delta", conditional_sell)):
+        start = time.perf_counter()
+        sold, left, lost = sell_out(sell, args.threads, args.stock)
+        elapsed = time.perf_counter() - start
+        retried = conflicts if path == "before" else 0
+        print(f"{path:<12} sold {sold:>6}  left {left:>6}  lost {lost:>4}  retries {retried:>6}  {sold / elapsed:>8.0f} sales/s")
+        if path == "stock_delta" and (lost or left < 0):
+            failed = True
+    if failed:
+        sys.exit("stock_delta lost updates or oversold")
+
+
+if __name__ == "__main__":
+    main()
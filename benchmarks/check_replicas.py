@@ -0,0 +1,91 @@
+"""
+End-to-end check of read-replica routing, with two SQLite files as the
+primary and the replica (or two PostgreSQL databases that do NOT replicate).
+
+    python benchmarks/check_replicas.py
+    python benchmarks/check_replicas.py --primary postgresql://.../a --replica postgresql://.../b
+
+The replica is left empty, so where a read lands is visible in its result:
+
+1. POST /users goes to the primary
+2. the same client reads the user back within READ_YOUR_WRITES_SECONDS:
+   sticky to the primary, found
+3. another client reads it: served by the replica, not found
+4. the AI path reads from the replica
+5. the replica goes away and fails its health check: reads and the AI path
+   fall back to the primary
+
+Exits 1 if any step routes differently.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--primary", help="primary URL (default: a temporary SQLite file)")
+    parser.add_argument("--replica", help="replica URL (default: a temporary SQLite file)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    replica_file = os.path.join(directory, "replica.db")
+    primary = args.primary or f"sqlite:///{os.path.join(directory, 'primary.db')}"
+    # Read-only URI mode: once the file is gone the replica cannot be reached
+    replica = args.replica or f"sqlite:///file:{replica_file}?mode=ro&uri=true"
+    os.environ.update(DATABASE_URL=primary, REPLICA_URLS=replica, REPLICA_CHECK_INTERVAL="0", LLM_BACKEND="fake")
+    os.environ.pop("AI_DATABASE_URL", None)
+
+    import httpx
+    from sqlalchemy import create_engine
+    import database, main as app_module, models
+
+    models.Base.metadata.create_all(database.engine)
+    models.Base.metadata.create_all(create_engine(f"sqlite:///{replica_file}") if not args.replica else database.replicas[0].engine)
+
+    failures = []
+
+    def expect(step: str, ok: bool):
+        print(f"{'ok  ' if ok else 'FAIL'} {step}")
+        if not ok:
+            failures.append(step)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as writer, \
+                httpx.AsyncClient(transport=transport, base_url="http://testserver") as reader:
+            response = await writer.post("/users", json={"name": "Replica Check", "email": "replica-check@example.com", "password_hash": "x"})
+            expect("POST /users is written to the primary", response.status_code == 200)
+            user_id = response.json().get("user_id")
+            expect("the write sets the read-your-writes cookie", app_module.PRIMARY_UNTIL_COOKIE in writer.cookies)
+
+            response = await writer.get(f"/users/{user_id}")
+            expect("the writer reads its write from the primary", response.status_code == 200)
+            response = await reader.get(f"/users/{user_id}")
+            expect("another client reads from the replica", response.status_code == 404)
+            expect("the AI path uses the replica", database.ai_engine() is database.replicas[0].readonly_engine)
+
+            if args.replica:
+                print("stop the replica server, then press enter")
+                input()
+            else:
+                os.remove(replica_file)
+            for replica in database.replicas:
+                replica.engine.dispose()
+                replica.readonly_engine.dispose()
+            database.check_replicas()
+            expect("the unreachable replica fails its health check", not database.replicas[0].healthy)
+            response = await reader.get(f"/users/{user_id}")
+            expect("reads fail over to the primary", response.status_code == 200)
+            expect("the AI path fails over to the primary", database.ai_engine() is database.readonly_engine)
+
+    asyncio.run(run())
+    if failures:
+        sys.exit(f"{len(failures)} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
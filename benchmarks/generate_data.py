@@ -0,0 +1,135 @@
+"""
+Synthetic data files for bulk_import.py and the benchmarks.
+
+    python benchmarks/generate_data.py data/ --order-items 10000000
+    python benchmarks/generate_data.py data/ --format ndjson --order-items 100000
+
+Writes <table>.csv (or .ndjson) for every table with explicit ids, so the
+files load in any database and children always point at existing parents.
+The other tables scale from --order-items: about 3 items per order, 5 orders
+per user, one product per 20 items and a review for about 1 purchase in 20.
+Output is deterministic for a given --seed.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+STATUSES = ["pending", "paid", "shipped", "delivered", "cancelled"]
+WORDS = ["wireless", "steel", "organic", "compact", "classic", "smart", "leather", "ultra", "portable", "cotton",
+         "lamp", "kettle", "backpack", "headphones", "chair", "blender", "jacket", "monitor", "bottle", "speaker"]
+START = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+class Writer:
+    # One output file in either format
+    def __init__(self, directory: str, table: str, columns, fmt: str):
+        self.file = open(os.path.join(directory, f"{table}.{fmt}"), "w", encoding="utf-8", newline="")
+        self.columns = columns
+        self.fmt = fmt
+        self.rows = 0
+        if fmt == "csv":
+            self.csv = csv.writer(self.file, lineterminator="\n")
+            self.csv.writerow(columns)
+
+    def write(self, *values):
+        self.rows += 1
+        if self.fmt == "csv":
+            self.csv.writerow(values)
+        else:
+            self.file.write(json.dumps(dict(zip(self.columns, values)), separators=(",", ":")) + "\n")
+
+    def close(self):
+        self.file.close()
+
+def generate(directory: str, order_items: int, fmt: str = "csv", seed: int = 1):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    users = max(order_items // 15, 1)
+    products = max(order_items // 20, 1)
+    categories = max(min(products // 50, 500), 1)
+    counts = {}
+
+    out = Writer(directory, "categories", ["category_id", "name", "description"], fmt)
+    for category_id in range(1, categories + 1):
+        out.write(category_id, f"Category {category_id}", f"Synthetic category {category_id}")
+    out.close()
+    counts["categories"] = out.rows
+
+    out = Writer(directory, "users", ["user_id", "name", "email", "password_hash", "created_at"], fmt)
+    for user_id in range(1, users + 1):
+        joined = START + timedelta(seconds=rng.randrange(365 * 86400))
+        out.write(user_id, f"User {user_id}", f"user{user_id}@example.com", "x" * 60, joined.isoformat())
+    out.close()
+    counts["users"] = out.rows
+
+    prices = [0] * (products + 1)
+    out = Writer(directory, "products", ["product_id", "name", "description", "price", "stock", "category_id", "created_at"], fmt)
+    for product_id in range(1, products + 1):
+        name = " ".join(rng.sample(WORDS, 3))
+        prices[product_id] = round(rng.uniform(2, 500), 2)
+        listed = START + timedelta(seconds=rng.randrange(365 * 86400))
+        out.write(product_id, f"{name.title()} {product_id}", f"A {name} for everyday use", f"{prices[product_id]:.2f}",
+                  rng.randrange(0, 200), rng.randrange(1, categories + 1), listed.isoformat())
+    out.close()
+    counts["products"] = out.rows
+
+    # Orders and their items in one pass so totals match the items and the
+    # items share their order's date, and so its month partition
+    order_out = Writer(directory, "orders", ["order_id", "user_id", "order_date", "total_amount", "status"], fmt)
+    item_out = Writer(directory, "order_items", ["order_item_id", "order_id", "product_id", "quantity", "price", "created_at"], fmt)
+    bought = {}
+    order_id = item_id = 0
+    while item_id < order_items:
+        order_id += 1
+        user_id = rng.randrange(1, users + 1)
+        placed = START + timedelta(seconds=rng.randrange(2 * 365 * 86400))
+        total = 0
+        for _ in range(min(rng.randint(1, 5), order_items - item_id)):
+            item_id += 1
+            product_id = rng.randrange(1, products + 1)
+            quantity = rng.randint(1, 4)
+            total += prices[product_id] * quantity
+            item_out.write(item_id, order_id, product_id, quantity, f"{prices[product_id]:.2f}", placed.isoformat())
+            if rng.random() < 0.05:
+                bought.setdefault(user_id, set()).add(product_id)
+        order_out.write(order_id, user_id, placed.isoformat(), f"{total:.2f}", rng.choice(STATUSES))
+    order_out.close()
+    item_out.close()
+    counts["orders"] = order_out.rows
+    counts["order_items"] = item_out.rows
+
+    out = Writer(directory, "reviews", ["review_id", "user_id", "product_id", "rating", "comment", "created_at"], fmt)
+    review_id = 0
+    for user_id, product_ids in sorted(bought.items()):
+        for product_id in sorted(product_ids):
+            review_id += 1
+            written = START + timedelta(seconds=rng.randrange(2 * 365 * 86400))
+            out.write(review_id, user_id, product_id, rng.choices([1, 2, 3, 4, 5], [1, 1, 2, 4, 6])[0],
+                      rng.choice(["Great", "Works as described", "Not worth it", "Would buy again", None]), written.isoformat())
+    out.close()
+    counts["reviews"] = out.rows
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory")
+    parser.add_argument("--order-items", type=int, default=100000)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = generate(args.directory, args.order_items, args.format, args.seed)
+    for table, rows in counts.items():
+        print(f"{table:>12} {rows:>10}")
+    print(f"written to {args.directory} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+Reproducible benchmark suite for the API and AI paths, with a baseline to
+compare against.
+
+    python benchmarks/suite.py --scale 10000 --save-baseline         # SQLite stand-in
+    python benchmarks/suite.py --scale 10000                         # compare with it
+    python benchmarks/suite.py --database-url postgresql://... --scale 10000000
+    python benchmarks/suite.py --driver http --url http://127.0.0.1:8000 --server-pid 1234
+
+1. seed: synthetic files from generate_data.py, loaded with bulk_import.py
+   on PostgreSQL or batched inserts on SQLite, then ratings and rollups are
+   rebuilt. --scale is the number of order_items; the other tables scale
+   with it. Skipped when the database already holds that many order_items.
+2. drive: each scenario sends --requests requests from --concurrency
+   clients, in process through main.app's ASGI stack or over HTTP to a
+   running server (seeded from the same --database-url).
+3. report: throughput, p50/p95/p99 latency, SQL statements per request
+   (from the Server-Timing header) and peak RSS per scenario, written to
+   --output as JSON and compared with --baseline. Exits 1 on a regression
+   beyond --tolerance.
+
+/ai/query runs against ReplayChatModel, a fake chat model that answers the
+fast path with canned SQL and walks the agent through a canned
+list-tables / schema / query sequence of tool calls, so the overhead around
+the model is measured without Ollama. --llm-latency adds a fixed delay per
+call. The answer cache is disabled.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+DEFAULT_DATABASE_URL = "sqlite:///bench_suite.db"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# name -> (method, path, body); {table} placeholders get a random existing id
+SCENARIOS = {
+    "list_products": ("GET", "/products?limit=20", None),
+    "list_products_fast": ("GET", "/products?limit=20&fast=true", None),
+    "products_by_rating": ("GET", "/products?limit=20&sort=rating", None),
+    "get_product": ("GET", "/products/{products}", None),
+    "list_orders_expanded": ("GET", "/orders?limit=50&expand=items", None),
+    "get_user_expanded": ("GET", "/users/{users}?expand=orders", None),
+    "search_products": ("GET", "/products/search?q=wireless&limit=20", None),
+    "top_products": ("GET", "/analytics/top-products", None),
+    "ai_fast": ("POST", "/ai/query", {"mode": "fast"}),
+    "ai_agent": ("POST", "/ai/query", {"mode": "agent"}),
+}
+
+QUESTIONS = {
+    "How many users are there?": "SELECT count(*) AS users FROM users",
+    "Top 5 products by price": "SELECT name, price FROM products ORDER BY price DESC LIMIT 5",
+    "Orders per status": "SELECT status, count(*) AS orders FROM orders GROUP BY status",
+}
+
+# Higher is worse for every metric but throughput
+METRICS = ["throughput_rps", "p50_ms", "p95_ms", "p99_ms", "statements_per_request", "peak_rss_mb"]
+
+# -------------------- Fake LLM --------------------
+def replay_model(latency: float = 0.0):
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, ToolMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+
+    class ReplayChatModel(BaseChatModel):
+        """
+        Deterministic chat model: canned SQL for the fast path, a canned
+        sequence of SQL tool calls for the agent.
+        """
+        latency: float = 0.0
+
+        @property
+        def _llm_type(self) -> str:
+            return "replay"
+
+        def bind_tools(self, tools, **kwargs):
+            return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            if self.latency:
+                time.sleep(self.latency)
+            text = "\n".join(str(message.content) for message in messages)
+            sql = next((sql for question, sql in QUESTIONS.items() if question in text), next(iter(QUESTIONS.values())))
+            if kwargs.get("tools"):
+                steps = [
+                    ("sql_db_list_tables", {"tool_input": ""}),
+                    ("sql_db_schema", {"table_names": re.search(r"FROM (\w+)", sql).group(1)}),
+                    ("sql_db_query", {"query": sql}),
+                ]
+                done = sum(isinstance(message, ToolMessage) for message in messages)
+                if done < len(steps):
+                    name, args = steps[done]
+                    message = AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{done}"}])
+                else:
+                    message = AIMessage(content=f"Replayed answer from: {sql}")
+            elif text.startswith("Question:"):
+                message = AIMessage(content="Replayed narrative answer.")
+            else:
+                message = AIMessage(content=sql)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+    return ReplayChatModel(latency=latency)
+
+# -------------------- Seeding --------------------
+def _convert(column, value):
+    from datetime import datetime
+    from decimal import Decimal
+    from sqlalchemy import Integer, Numeric, TIMESTAMP
+
+    if value == "":
+        return None
+    if isinstance(column.type, Integer):
+        return int(value)
+    if isinstance(column.type, Numeric):
+        return Decimal(value)
+    if isinstance(column.type, TIMESTAMP):
+        return datetime.fromisoformat(value)
+    return value
+
+def _load_inserts(directory: str, batch_size: int = 10000):
+    # SQLite has no COPY: batched executemany inserts in bulk_import's order
+    import csv
+    import bulk_import
+    from database import engine
+
+    for table, model in bulk_import.TABLES.items():
+        with open(os.path.join(directory, f"{table}.csv"), encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            columns = [model.__table__.c[name] for name in next(reader)]
+            batch = []
+            for values in reader:
+                batch.append({column.name: _convert(column, value) for column, value in zip(columns, values)})
+                if len(batch) >= batch_size:
+                    with engine.begin() as conn:
+                        conn.execute(model.__table__.insert(), batch)
+                    batch = []
+            if batch:
+                with engine.begin() as conn:
+                    conn.execute(model.__table__.insert(), batch)
+
+def seed(scale: int, reseed: bool = False):
+    from sqlalchemy import func, select
+    import bulk_import, crud, migrations, models, rollups
+    from database import Base, SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    migrations.upgrade(engine)
+    with SessionLocal() as db:
+        existing = db.scalar(select(func.count()).select_from(models.OrderItem))
+    if existing == scale and not reseed:
+        print(f"seed: {existing} order_items already loaded")
+        return
+    if existing:
+        sys.exit(f"seed: database holds {existing} order_items, not {scale}; point --database-url at an empty database")
+
+    from generate_data import generate
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory:
+        counts = generate(directory, scale)
+        print(f"seed: generated {sum(counts.values())} rows in {time.perf_counter() - started:.1f}s")
+        if engine.dialect.name == "postgresql":
+            bulk_import.run(directory)
+        else:
+            _load_inserts(directory)
+            with SessionLocal() as db:
+                crud.reconcile_ratings(db)
+    with SessionLocal() as db:
+        rollups.refresh(db, full=True)
+    print(f"seed: loaded in {time.perf_counter() - started:.1f}s")
+
+def table_sizes():
+    from sqlalchemy import func, select
+    import bulk_import
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        return {
+            table: db.scalar(select(func.max(model.__table__.primary_key.columns[0]))) or 1
+            for table, model in bulk_import.TABLES.items()
+        }
+
+# -------------------- Drivers --------------------
+def _statements(header: str) -> int:
+    match = re.search(r'db;[^,]*desc="(\d+) queries"', header or "")
+    return int(match.group(1)) if match else 0
+
+def _percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else 0
+
+def _peak_rss_mb(server_pid=None) -> float:
+    if server_pid:
+        with open(f"/proc/{server_pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def drive(http, scenario: str, requests: int, concurrency: int, sizes, server_pid=None):
+    method, template, body = SCENARIOS[scenario]
+    rng = random.Random(scenario)
+    latencies, statements = [], []
+    errors = 0
+    remaining = requests
+
+    async def client():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            path = template.format(**{table: rng.randint(1, size) for table, size in sizes.items()})
+            payload = {**body, "question": rng.choice(list(QUESTIONS))} if body is not None else None
+            start = time.perf_counter()
+            try:
+                response = await http.request(method, path, json=payload)
+            except Exception:
+                errors += 1
+                continue
+            if response.status_code >= 400:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            statements.append(_statements(response.headers.get("server-timing")))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "statements_per_request": statistics.fmean(statements) if statements else 0,
+        "peak_rss_mb": _peak_rss_mb(server_pid),
+    }
+
+async def run_all(args, sizes):
+    import httpx
+
+    if args.driver == "http":
+        http = httpx.AsyncClient(base_url=args.url, timeout=120, limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        import main
+        http = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://suite", timeout=120)
+    results = {}
+    async with http:
+        for scenario in args.scenarios:
+            # One untimed pass warms connection pools and caches
+            await drive(http, scenario, min(args.concurrency, args.requests), args.concurrency, sizes)
+            result = await drive(http, scenario, args.requests, args.concurrency, sizes, args.server_pid)
+            results[scenario] = result
+            print(
+                f"{scenario:<22} {result['throughput_rps']:>9.0f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+                f"{result['p99_ms']:>8.1f} {result['statements_per_request']:>6.1f} {result['peak_rss_mb']:>8.0f} {result['errors']:>6}",
+                flush=True,
+            )
+    return results
+
+# -------------------- Baseline --------------------
+def compare(results, baseline, tolerance: float):
+    regressions = []
+    for scenario, result in results.items():
+        before = baseline.get("results", {}).get(scenario)
+        if not before:
+            continue
+        for metric in METRICS:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if metric == "throughput_rps" else change
+            # Statement counts are deterministic, so any increase counts
+            limit = 0 if metric == "statements_per_request" else tolerance
+            flag = "REGRESSION" if worse > limit else ""
+            if flag:
+                regressions.append((scenario, metric))
+            print(f"{scenario:<22} {metric:<24} {old:>10.1f} {new:>10.1f} {change:>+8.1%} {flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL))
+    parser.add_argument("--scale", type=int, default=10000, help="order_items to seed (10k to 10M)")
+    parser.add_argument("--reseed", action="store_true")
+    parser.add_argument("--driver", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--server-pid", type=int, help="read peak RSS from this server process (http driver)")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per fake LLM call")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    # Read by database.py at import, so set before anything imports it
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("AI_DATABASE_URL", args.database_url)
+    os.environ.setdefault("LLM_BACKEND", "fake")
+    sys.path.insert(0, os.path.dirname(__file__))
+
+    seed(args.scale, args.reseed)
+    sizes = table_sizes()
+
+    import llm
+    from ai_cache import answers
+    llm.set_llm(replay_model(args.llm_latency))
+    answers.enabled = False
+
+    print(f"{'scenario':<22} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'stmts':>6} {'RSS MB':>8} {'errors':>6}")
+    results = asyncio.run(run_all(args, sizes))
+    report = {
+        "meta": {
+            "scale": args.scale,
+            "database": args.database_url.split(":", 1)[0],
+            "driver": args.driver,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "llm_latency": args.llm_latency,
+            "python": platform.python_version(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["meta"]["scale"] != args.scale or baseline["meta"]["driver"] != args.driver:
+        print("baseline was recorded with a different --scale or --driver; numbers are not comparable")
+    print(f"\n{'scenario':<22} {'metric':<24} {'baseline':>10} {'now':>10} {'change':>8}")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        sys.exit(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
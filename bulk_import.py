@@ -0,0 +1,346 @@
+"""
+Bulk loader for seeding and catalog loads. PostgreSQL only.
+
+    python bulk_import.py data/                 # <table>.csv or <table>.ndjson files
+    python bulk_import.py data/ --tables products
+    python benchmarks/generate_data.py data/    # synthetic files to try it with
+
+Each file goes through four steps, one table at a time in foreign-key order:
+
+1. stage: COPY FROM STDIN into an unlogged staging table, with the file's
+   columns plus a _row sequence and an _error column
+2. validate: set-based UPDATEs set _error on rows with missing required
+   values or dangling foreign keys, and on rows whose key is repeated later
+   in the file (the last one wins)
+3. merge: INSERT ... SELECT into the real table in _row ranges of
+   IMPORT_CHUNK_SIZE, one transaction per range. Rows are upserted on the
+   primary key when the file has one, else on the table's natural key. On
+   the partitioned orders and order_items tables the key includes the
+   partition column, so files with ids must carry order_date / created_at
+4. finish: move the id sequence past the imported ids and drop the staging
+   table
+
+Progress is recorded in import_progress in the same transaction as each step,
+so rerunning the same command after a failure resumes where it stopped.
+CSV files need a header row. Empty CSV fields and JSON nulls load as NULL.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from sqlalchemy import text
+import cache, crud, models, partitions, rollups
+from database import SessionLocal, engine
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "100000"))
+
+# Foreign-key order
+TABLES = {
+    model.__tablename__: model
+    for model in (models.Category, models.User, models.Product, models.Order, models.OrderItem, models.Review)
+}
+
+# Maintained from other tables and recomputed after the import instead
+DERIVED = {"products": {"rating_count", "rating_sum", "rating_avg"}}
+
+# Upsert key for files without the primary key column
+NATURAL_KEYS = {"users": ("email",), "reviews": ("user_id", "product_id")}
+
+STEPS = ("staged", "validated", "merged", "done")
+
+class ImportFailed(Exception):
+    pass
+
+# -------------------- Files --------------------
+def find_files(directory: str, tables=None):
+    files = {}
+    for table in TABLES:
+        if tables and table not in tables:
+            continue
+        for ext in ("csv", "ndjson"):
+            path = os.path.join(directory, f"{table}.{ext}")
+            if os.path.exists(path):
+                files[table] = path
+    return files
+
+def import_id(files) -> str:
+    # Same files, same id: a rerun picks up the recorded progress
+    digest = hashlib.sha1()
+    for table, path in sorted(files.items()):
+        stat = os.stat(path)
+        digest.update(f"{table}:{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:12]
+
+def file_columns(path: str):
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            return next(csv.reader(f))
+        for line in f:
+            if line.strip():
+                return list(json.loads(line))
+    return []
+
+class NDJSONReader:
+    """
+    File object for COPY FROM STDIN that renders an NDJSON file as CSV, with
+    a header row, in `columns` order.
+    """
+    def __init__(self, path: str, columns):
+        self.lines = open(path, encoding="utf-8")
+        self.columns = columns
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator="\n")
+        self.writer.writerow(columns)
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or self.buffer.tell() < size:
+            line = self.lines.readline()
+            if not line:
+                break
+            if line.strip():
+                row = json.loads(line)
+                self.writer.writerow([row.get(column) for column in self.columns])
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def close(self):
+        self.lines.close()
+
+def _reader(path: str, columns):
+    if path.endswith(".csv"):
+        return open(path, "rb")
+    return NDJSONReader(path, columns)
+
+# -------------------- Progress --------------------
+def _ensure_progress_table():
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS import_progress ("
+            "import_id VARCHAR(40), table_name VARCHAR(100), step VARCHAR(20) NOT NULL, "
+            "rows_staged BIGINT DEFAULT 0, rows_rejected BIGINT DEFAULT 0, merged_through BIGINT DEFAULT 0, "
+            "updated_at TIMESTAMPTZ DEFAULT now(), PRIMARY KEY (import_id, table_name))"
+        ))
+
+def _progress(import_id: str, table: str):
+    with engine.connect() as conn:
+        row = conn.execute(
+            text("SELECT step, rows_staged, rows_rejected, merged_through FROM import_progress WHERE import_id = :id AND table_name = :table"),
+            {"id": import_id, "table": table},
+        ).mappings().first()
+    return dict(row) if row else {"step": None, "rows_staged": 0, "rows_rejected": 0, "merged_through": 0}
+
+def _record(cursor, import_id: str, table: str, **values):
+    sets = ", ".join(f"{name} = %({name})s" for name in values)
+    params = {"id": import_id, "table": table, **values}
+    sql = (
+        "INSERT INTO import_progress (import_id, table_name, step) VALUES (%(id)s, %(table)s, %(step)s) "
+        f"ON CONFLICT (import_id, table_name) DO UPDATE SET {sets}, updated_at = now()"
+    )
+    cursor.execute(sql, {"step": values.get("step", "staged"), **params})
+
+def _done(progress, step: str) -> bool:
+    return progress["step"] is not None and STEPS.index(progress["step"]) >= STEPS.index(step)
+
+# -------------------- Steps --------------------
+def _quote(names):
+    return ", ".join(f'"{name}"' for name in names)
+
+def stage(import_id: str, table: str, staging: str, path: str, columns):
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(f'DROP TABLE IF EXISTS "{staging}"')
+        cursor.execute(f'CREATE UNLOGGED TABLE "{staging}" AS SELECT {_quote(columns)} FROM "{table}" WITH NO DATA')
+        cursor.execute(f'ALTER TABLE "{staging}" ADD COLUMN _row BIGSERIAL, ADD COLUMN _error TEXT')
+        reader = _reader(path, columns)
+        try:
+            cursor.copy_expert(f'COPY "{staging}" ({_quote(columns)}) FROM STDIN WITH (FORMAT csv, HEADER)', reader, size=1 << 20)
+        finally:
+            reader.close()
+        cursor.execute(f'SELECT COALESCE(MAX(_row), 0) FROM "{staging}"')
+        (staged,) = cursor.fetchone()
+        _record(cursor, import_id, table, step="staged", rows_staged=staged)
+        raw.commit()
+        return staged
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+def _partition_column(table: str):
+    with engine.connect() as conn:
+        return partitions.PARTITIONED[table] if table in partitions.PARTITIONED and partitions.is_partitioned(conn, table) else None
+
+def _merge_key(table: str, columns):
+    model = TABLES[table]
+    pk = [column.name for column in model.__table__.primary_key.columns]
+    # A partitioned table's primary key also holds the partition column
+    partition_column = _partition_column(table)
+    if partition_column:
+        pk.append(partition_column)
+    if all(name in columns for name in pk):
+        return pk
+    natural = NATURAL_KEYS.get(table, ())
+    return list(natural) if all(name in columns for name in natural) else []
+
+def validate(import_id: str, table: str, staging: str, columns):
+    """
+    Mark the rows the merge must skip and return (rejected, {error: count}).
+    Parents are merged before children, so foreign keys are checked against
+    the real tables.
+    """
+    model = TABLES[table]
+    checks = []
+    for column in model.__table__.columns:
+        if column.name not in columns:
+            continue
+        if not column.nullable and not column.primary_key:
+            checks.append((f"{column.name} is required", f's."{column.name}" IS NULL'))
+        for fk in column.foreign_keys:
+            parent = fk.column
+            checks.append((
+                f"{column.name} not found in {parent.table.name}",
+                f's."{column.name}" IS NOT NULL AND NOT EXISTS '
+                f'(SELECT 1 FROM "{parent.table.name}" p WHERE p."{parent.name}" = s."{column.name}")',
+            ))
+    key = _merge_key(table, columns)
+    if key:
+        match = " AND ".join(f'later."{name}" = s."{name}"' for name in key)
+        checks.append((
+            f"duplicate {', '.join(key)} in file, a later row wins",
+            f'EXISTS (SELECT 1 FROM "{staging}" later WHERE {match} AND later._row > s._row)',
+        ))
+    natural = NATURAL_KEYS.get(table)
+    pk = [column.name for column in model.__table__.primary_key.columns]
+    if natural and key == pk and all(name in columns for name in natural):
+        match = " AND ".join(f't."{name}" = s."{name}"' for name in natural)
+        differs = " OR ".join(f't."{name}" <> s."{name}"' for name in pk)
+        checks.append((
+            f"{', '.join(natural)} already used by another {table[:-1]}",
+            f'EXISTS (SELECT 1 FROM "{table}" t WHERE {match} AND ({differs}))',
+        ))
+
+    with engine.begin() as conn:
+        for error, condition in checks:
+            conn.execute(
+                text(f'UPDATE "{staging}" s SET _error = :error WHERE s._error IS NULL AND {condition}'),
+                {"error": error},
+            )
+        errors = dict(conn.execute(text(
+            f'SELECT _error, COUNT(*) FROM "{staging}" WHERE _error IS NOT NULL GROUP BY _error'
+        )).all())
+        rejected = sum(errors.values())
+        _record(conn.connection.cursor(), import_id, table, step="validated", rows_rejected=rejected)
+    return rejected, errors
+
+def merge(import_id: str, table: str, staging: str, columns, staged: int, start: int):
+    key = _merge_key(table, columns)
+    sql = f'INSERT INTO "{table}" ({_quote(columns)}) SELECT {_quote(columns)} FROM "{staging}" WHERE _row > :low AND _row <= :high AND _error IS NULL'
+    if key:
+        updates = [name for name in columns if name not in key and name != "version"]
+        # A row rewritten in place gets a new version, so its old ETag stops matching
+        sets = [f"{_quote([name])} = EXCLUDED.{_quote([name])}" for name in updates] + [f'version = "{table}".version + 1']
+        action = f"DO UPDATE SET {', '.join(sets)}" if updates else "DO NOTHING"
+        sql += f" ON CONFLICT ({_quote(key)}) {action}"
+    for low in range(start, staged, IMPORT_CHUNK_SIZE):
+        high = min(low + IMPORT_CHUNK_SIZE, staged)
+        with engine.begin() as conn:
+            conn.execute(text(sql), {"low": low, "high": high})
+            _record(conn.connection.cursor(), import_id, table, step="validated", merged_through=high)
+        print(f"  {table}: merged {high}/{staged}", flush=True)
+    with engine.begin() as conn:
+        _record(conn.connection.cursor(), import_id, table, step="merged", merged_through=staged)
+
+def finish(import_id: str, table: str, staging: str, columns, keep: bool = False):
+    model = TABLES[table]
+    with engine.begin() as conn:
+        for column in model.__table__.primary_key.columns:
+            if column.name in columns and column.autoincrement:
+                conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', '{column.name}'), "
+                    f'GREATEST((SELECT MAX("{column.name}") FROM "{table}"), 1))'
+                ))
+        if not keep:
+            conn.execute(text(f'DROP TABLE IF EXISTS "{staging}"'))
+        _record(conn.connection.cursor(), import_id, table, step="done")
+
+# -------------------- Driver --------------------
+def import_table(import_id: str, table: str, path: str, keep: bool = False):
+    model = TABLES[table]
+    columns = file_columns(path)
+    known = {column.name for column in model.__table__.columns} - DERIVED.get(table, set())
+    unknown = [name for name in columns if name not in known]
+    if unknown:
+        raise ImportFailed(f"{path}: columns not importable into {table}: {', '.join(unknown)}")
+    missing = [
+        column.name for column in model.__table__.columns
+        if not column.nullable and not column.primary_key and column.default is None
+        and column.server_default is None and column.name not in columns
+    ]
+    if missing:
+        raise ImportFailed(f"{path}: missing required columns for {table}: {', '.join(missing)}")
+    partition_column = _partition_column(table)
+    if partition_column and partition_column not in columns and any(c.name in columns for c in model.__table__.primary_key.columns):
+        # Without it ids cannot be matched to existing rows, and would be duplicated
+        raise ImportFailed(f"{path}: {table} is partitioned; rows with ids also need {partition_column}")
+    staging = f"import_{import_id}_{table}"
+    progress = _progress(import_id, table)
+    if _done(progress, "done"):
+        print(f"{table}: already imported")
+        return
+
+    started = time.perf_counter()
+    if not _done(progress, "staged"):
+        progress["rows_staged"] = stage(import_id, table, staging, path, columns)
+        print(f"{table}: staged {progress['rows_staged']} rows in {time.perf_counter() - started:.1f}s", flush=True)
+    if not _done(progress, "validated"):
+        rejected, errors = validate(import_id, table, staging, columns)
+        for error, count in errors.items():
+            print(f"{table}: rejected {count} rows: {error}")
+    if not _done(progress, "merged"):
+        merge(import_id, table, staging, columns, progress["rows_staged"], progress["merged_through"])
+    finish(import_id, table, staging, columns, keep)
+    print(f"{table}: done in {time.perf_counter() - started:.1f}s", flush=True)
+
+def run(directory: str, tables=None, keep: bool = False, given_id: str = None):
+    if engine.dialect.name != "postgresql":
+        raise ImportFailed("bulk_import needs PostgreSQL (COPY FROM STDIN)")
+    files = find_files(directory, tables)
+    if not files:
+        raise ImportFailed(f"No <table>.csv or <table>.ndjson files in {directory}")
+    _ensure_progress_table()
+    run_id = given_id or import_id(files)
+    print(f"import {run_id}: {', '.join(files)}")
+    for table, path in files.items():
+        import_table(run_id, table, path, keep)
+
+    # Derived data: rating columns, rollups and cached responses
+    if "reviews" in files:
+        with SessionLocal() as db:
+            print(f"reviews: recounted ratings for {crud.reconcile_ratings(db)} products")
+    with engine.begin() as conn:
+        for stmt in rollups.mark_stale(*files):
+            conn.execute(stmt)
+        # The servers' caches, which flush() below cannot reach
+        conn.execute(cache.publish(*files))
+    for table in files:
+        cache.flush(table)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import CSV/NDJSON files through COPY")
+    parser.add_argument("directory")
+    parser.add_argument("--tables", nargs="+", choices=list(TABLES))
+    parser.add_argument("--import-id", help="resume a specific import instead of deriving the id from the files")
+    parser.add_argument("--keep-staging", action="store_true", help="keep staging tables (and rejected rows) for inspection")
+    args = parser.parse_args()
+    try:
+        run(args.directory, args.tables, args.keep_staging, args.import_id)
+    except ImportFailed as e:
+        sys.exit(str(e))
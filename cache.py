@@ -0,0 +1,289 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select, update
+import fastjson, models
+from database import SERVER_WORKERS
+
+CACHE_URL = os.getenv("CACHE_URL")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "4096"))
+CACHE_SYNC_INTERVAL = float(os.getenv("CACHE_SYNC_INTERVAL", "5"))
+
+logger = logging.getLogger(__name__)
+
+# -------------------- Backends --------------------
+class LRUCache:
+    """
+    In-process cache bounded by entry count, with a per-entry TTL.
+    """
+    def __init__(self, maxsize: int = CACHE_MAXSIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    # Counters live outside the LRU so a generation can never be evicted
+    # and roll back to a value that stale entries are still keyed on
+    def counter(self, key) -> int:
+        return self._counters.get(key, 0)
+
+    def incr(self, key) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def size(self) -> int:
+        return len(self._data)
+
+class RedisCache:
+    """
+    Backend for anything speaking the redis-py client API (redis.Redis,
+    fakeredis, a local stand-in), shared by every worker process. Counters
+    live under their own prefix, which delete_prefix never matches, and have
+    no TTL, so a volatile-* maxmemory-policy never evicts them either.
+    """
+    def __init__(self, client, ttl: float = CACHE_TTL, prefix: str = "ecommerce:", counter_prefix: str = "ecommerce-counters:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.counter_prefix = counter_prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl: float = None):
+        self.client.set(self.prefix + key, pickle.dumps(value), px=int((self.ttl if ttl is None else ttl) * 1000))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def delete_prefix(self, prefix: str):
+        keys = list(self.client.scan_iter(match=self.prefix + prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def counter(self, key) -> int:
+        return int(self.client.get(self.counter_prefix + key) or 0)
+
+    def incr(self, key) -> int:
+        return self.client.incr(self.counter_prefix + key)
+
+    @property
+    def evictions(self):
+        return self.client.info("stats").get("evicted_keys", 0)
+
+    @property
+    def expirations(self):
+        return self.client.info("stats").get("expired_keys", 0)
+
+    def size(self) -> int:
+        return self.client.dbsize()
+
+class NullCache:
+    """
+    Stores nothing. The backend for several workers without CACHE_URL, where
+    each worker's LRUCache would keep serving rows another worker changed.
+    """
+    evictions = 0
+    expirations = 0
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl: float = None):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def delete_prefix(self, prefix: str):
+        pass
+
+    def counter(self, key) -> int:
+        return 0
+
+    def incr(self, key) -> int:
+        return 0
+
+    def size(self) -> int:
+        return 0
+
+def _backend():
+    if CACHE_URL:
+        import redis
+        return RedisCache(redis.Redis.from_url(CACHE_URL))
+    if SERVER_WORKERS > 1:
+        return NullCache()
+    return LRUCache()
+
+backend = _backend()
+counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+# Called with the table name after every write, so other caches can drop
+# entries derived from that table
+listeners = []
+
+# -------------------- Keys & invalidation --------------------
+def key(table: str, *parts) -> str:
+    return ":".join([table, *map(str, parts)])
+
+def list_key(table: str, *parts) -> str:
+    # List pages are keyed on the table generation, which every write bumps
+    generation = backend.counter(key(table, "gen"))
+    return key(table, "list", generation, *parts)
+
+def invalidate(table: str, *ids):
+    backend.delete(*(key(table, id_) for id_ in ids))
+    backend.incr(key(table, "gen"))
+    counters["invalidations"] += 1
+    for listener in listeners:
+        listener(table)
+
+def flush(table: str):
+    # The generation moves on rather than restarting at 0, where list pages
+    # cached before an earlier flush could still be keyed
+    backend.delete_prefix(table + ":")
+    backend.incr(key(table, "gen"))
+    counters["invalidations"] += 1
+    for listener in listeners:
+        listener(table)
+
+# -------------------- Other processes --------------------
+# invalidate and flush only reach this process's caches (and Redis). Jobs run
+# outside the servers publish their writes through cache_generations instead,
+# and every worker's watcher flushes what moved.
+_seen = {}
+_stop = threading.Event()
+_watcher = None
+
+def publish(*tables):
+    """
+    UPDATE bumping the shared generation of `tables`, for the caller to
+    execute in the transaction of its writes. Workers flush those tables
+    within CACHE_SYNC_INTERVAL seconds.
+    """
+    generation = models.CacheGeneration
+    return update(generation).where(generation.table_name.in_(tables)).values(generation=generation.generation + 1)
+
+def sync(conn):
+    # Flush the tables whose generation moved since the last call; the first
+    # call only records where they stand
+    first = not _seen
+    for table, generation in conn.execute(select(models.CacheGeneration.table_name, models.CacheGeneration.generation)):
+        if not first and _seen.get(table) != generation:
+            flush(table)
+        _seen[table] = generation
+
+def _watch(engine, interval: float):
+    while True:
+        try:
+            with engine.connect() as conn:
+                sync(conn)
+        except Exception:
+            logger.exception("Cache sync failed")
+        if _stop.wait(interval):
+            return
+
+def start_watcher(engine, interval: float = CACHE_SYNC_INTERVAL):
+    """
+    Poll cache_generations every `interval` seconds on a daemon thread.
+    CACHE_SYNC_INTERVAL=0 disables it, leaving caches to their TTL after
+    bulk imports and other jobs.
+    """
+    global _watcher
+    if interval <= 0 or _watcher is not None:
+        return
+    _stop.clear()
+    _seen.clear()
+    _watcher = threading.Thread(target=_watch, args=(engine, interval), name="cache-sync", daemon=True)
+    _watcher.start()
+
+def stop_watcher():
+    global _watcher
+    _stop.set()
+    if _watcher is not None:
+        _watcher.join()
+        _watcher = None
+
+def stats():
+    return {
+        **counters,
+        "evictions": backend.evictions,
+        "expirations": backend.expirations,
+        "size": backend.size(),
+    }
+
+# -------------------- HTTP --------------------
+def cached_json(request: Request, cache_key: str, load, trusted: bool = False):
+    """
+    Serve a JSON response from the cache, calling `load()` -> (content, headers)
+    on a miss. The ETag is a hash of the body unless `headers` carries one (a
+    row version). A matching If-None-Match is answered with 304 straight from
+    the stored ETag, without touching the database or re-serializing. `trusted`
+    content is already plain rows (fastjson) and skips jsonable_encoder; both
+    encodings produce the same body, so they share cache entries.
+    """
+    entry = backend.get(cache_key)
+    if entry is None:
+        counters["misses"] += 1
+        content, headers = load()
+        if trusted:
+            body = fastjson.dumps(content)
+        else:
+            body = json.dumps(jsonable_encoder(content), separators=(",", ":")).encode()
+        headers = dict(headers)
+        etag = headers.pop("ETag", None) or '"%s"' % hashlib.sha1(body).hexdigest()
+        entry = (body, etag, headers)
+        backend.set(cache_key, entry)
+    else:
+        counters["hits"] += 1
+
+    body, etag, headers = entry
+    headers = {**headers, "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
@@ -1,5 +1,7 @@
 from database import Base, engine
+import migrations
 import models 
 
 Base.metadata.create_all(bind=engine)
+migrations.upgrade(engine)
 print("All tables created successfully!")
@@ -1,203 +1,853 @@
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
-import models
+from decimal import Decimal
+from sqlalchemy import Date, Numeric, cast, delete, event, func, literal, literal_column, or_, select, tuple_, update
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.orm.interfaces import ONETOMANY
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+import cache, models, rollups
+
+BULK_CHUNK_SIZE = 1000
+
+# -------------------- PAGINATION --------------------
+def _page(query, key, skip: int, limit: int, after=None):
+    # Keyset mode seeks past the last key seen instead of scanning `skip` rows
+    query = query.order_by(key)
+    if after is not None:
+        return query.filter(key > after).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
+
+def get_rows(db: Session, columns, key, skip: int = 0, limit: int = 100, after=None, filters=()):
+    """
+    A page of plain dicts from column tuples, for fastjson list responses.
+    """
+    return [row._asdict() for row in _page(db.query(*columns).filter(*filters), key, skip, limit, after)]
+
+def time_range(column, since=None, until=None):
+    """
+    Filters for since <= column < until. Plain comparisons on the partition
+    column let PostgreSQL skip the months of orders and order_items outside
+    the range.
+    """
+    filters = []
+    if since is not None:
+        filters.append(column >= since)
+    if until is not None:
+        filters.append(column < until)
+    return filters
+
+# -------------------- EXPANSION --------------------
+EXPAND_MAX_DEPTH = 3
+
+# Shorthands for nested paths, e.g. /orders?expand=items,product
+EXPAND_ALIASES = {
+    models.Order: {"product": "items.product"},
+}
+
+def expand_options(model, paths):
+    """
+    Loader options for dotted relationship paths: selectinload for
+    collections, joinedload for many-to-one, so each level costs at most one
+    extra statement however many rows it covers.
+    """
+    options = []
+    for path in paths:
+        path = EXPAND_ALIASES.get(model, {}).get(path, path)
+        names = path.split(".")
+        if len(names) > EXPAND_MAX_DEPTH:
+            raise ValueError(f"Cannot expand {path!r}: nested more than {EXPAND_MAX_DEPTH} levels")
+        current, option = model, None
+        for name in names:
+            relationship = current.__mapper__.relationships.get(name)
+            if relationship is None:
+                raise ValueError(f"Cannot expand {path!r}: {current.__name__} has no relationship {name!r}")
+            loader = selectinload if relationship.uselist else joinedload
+            attr = getattr(current, name)
+            option = loader(attr) if option is None else getattr(option, loader.__name__)(attr)
+            current = relationship.mapper.class_
+        options.append(option)
+    return options
+
+# -------------------- CONDITIONAL WRITES --------------------
+# PATCH, PUT and DELETE write with one statement that returns the row, instead
+# of loading it first and reading it back after the commit. `version` (from
+# If-Match) makes the write conditional on the row being at that version.
+class VersionMismatch(Exception):
+    def __init__(self, version: int):
+        super().__init__(f"The row is at version {version}")
+        self.version = version
+
+class WriteRejected(Exception):
+    pass
+
+def _explain_miss(db: Session, model, row_id, version, *columns):
+    """
+    Called after a conditional UPDATE or DELETE matched no row, and rolls
+    back. Returns None if the row does not exist, raises VersionMismatch if it
+    is at another version, and otherwise returns its `columns`.
+    """
+    table = model.__table__
+    row = db.execute(select(table.c.version, *columns).where(table.primary_key.columns[0] == row_id)).first()
+    db.rollback()
+    if row is None:
+        return None
+    if version is not None and row.version != version:
+        raise VersionMismatch(row.version)
+    return row
+
+def _patch(db: Session, model, row_id, changes: dict, version: int = None, where=()):
+    """
+    UPDATE ... RETURNING the row with `changes` applied and its version
+    bumped, or None if it does not exist. A miss under extra `where`
+    conditions is left to the caller to explain. Does not commit.
+    """
+    table = model.__table__
+    stmt = update(table).where(table.primary_key.columns[0] == row_id, *where).values(**changes, version=table.c.version + 1)
+    if version is not None:
+        stmt = stmt.where(table.c.version == version)
+    try:
+        row = db.execute(stmt.returning(*table.columns)).first()
+    except IntegrityError as e:
+        db.rollback()
+        raise WriteRejected(str(e.orig).splitlines()[0])
+    if row is None and not where:
+        _explain_miss(db, model, row_id, version)
+    return row
+
+def unlink_children(model, row_id) -> list:
+    """
+    (table name, UPDATE) pairs nulling the foreign keys that point at
+    `row_id`, as the ORM delete did. Each child's version is bumped, since
+    its body changes, and the UPDATE returns the child's id.
+    """
+    statements = []
+    for relationship in model.__mapper__.relationships:
+        if relationship.direction is ONETOMANY:
+            for column in relationship.remote_side:
+                child = column.table
+                stmt = update(child).where(column == row_id).values({column.name: None, "version": child.c.version + 1})
+                statements.append((child.name, stmt.returning(child.primary_key.columns[0])))
+    return statements
+
+def invalidate_after_commit(session, ids: dict):
+    # Drop the cached copies of rows changed as a side effect, once committed
+    def invalidate(_):
+        for table, keys in ids.items():
+            cache.invalidate(table, *keys)
+    event.listen(session, "after_commit", invalidate, once=True)
+
+def _delete(db: Session, model, row_id, version: int = None):
+    """
+    DELETE ... RETURNING the row, or None if it does not exist. Foreign keys
+    pointing at it are nulled first (unlink_children). Does not commit.
+    """
+    table = model.__table__
+    children = {}
+    for name, stmt in unlink_children(model, row_id):
+        children.setdefault(name, []).extend(db.execute(stmt).scalars())
+    stmt = delete(table).where(table.primary_key.columns[0] == row_id)
+    if version is not None:
+        stmt = stmt.where(table.c.version == version)
+    row = db.execute(stmt.returning(*table.columns)).first()
+    if row is None:
+        _explain_miss(db, model, row_id, version)
+        return row
+    invalidate_after_commit(db, children)
+    return row
+
+def _touch(db: Session, table: str, where, columns=None):
+    # Rollup groups an update or delete moves rows in or out of; see rollups.touched
+    for stmt in rollups.touched(table, where, columns):
+        db.execute(stmt)
+
+def _commit(db: Session, created):
+    """
+    Commit the transaction that created `created`. A hook left in
+    db.info["before_commit"] (main.idempotent) runs first, with the row
+    flushed and loaded, so an idempotency key commits with its response.
+    """
+    before_commit = db.info.pop("before_commit", None)
+    if before_commit is not None:
+        db.flush()
+        db.refresh(created)
+        before_commit(created)
+    db.commit()
 
 # -------------------- USERS --------------------
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.user_id == user_id).first()
+def get_user(db: Session, user_id: int, expand=()):
+    query = db.query(models.User).options(*expand_options(models.User, expand))
+    return query.filter(models.User.user_id == user_id).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(db: Session, skip: int = 0, limit: int = 100, after: int = None, expand=()):
+    query = db.query(models.User).options(*expand_options(models.User, expand))
+    return _page(query, models.User.user_id, skip, limit, after)
 
 def create_user(db: Session, name: str, email: str, password_hash: str):
     user = models.User(name=name, email=email, password_hash=password_hash)
     db.add(user)
     try:
-        db.commit()
+        _commit(db, user)
+        cache.invalidate("users")
         db.refresh(user)
         return user
     except IntegrityError:
         db.rollback()
         return None
 
-def update_user(db: Session, user_id: int, **kwargs):
-    user = get_user(db, user_id)
+def patch_user(db: Session, user_id: int, version: int = None, **changes):
+    user = _patch(db, models.User, user_id, changes, version)
     if not user:
         return None
-    for key, value in kwargs.items():
-        setattr(user, key, value)
     db.commit()
-    db.refresh(user)
+    cache.invalidate("users", user_id)
     return user
 
-def delete_user(db: Session, user_id: int):
-    user = get_user(db, user_id)
+def delete_user(db: Session, user_id: int, version: int = None):
+    # The user's orders lose their user_id, and with it their user_order_stats row
+    _touch(db, "orders", models.Order.user_id == user_id, {"user_id"})
+    user = _delete(db, models.User, user_id, version)
     if not user:
         return None
-    db.delete(user)
     db.commit()
+    cache.invalidate("users", user_id)
+    cache.invalidate("orders")
+    cache.invalidate("reviews")
     return user
 
 # -------------------- CATEGORIES --------------------
-def get_category(db: Session, category_id: int):
-    return db.query(models.Category).filter(models.Category.category_id == category_id).first()
+def get_category(db: Session, category_id: int, expand=()):
+    query = db.query(models.Category).options(*expand_options(models.Category, expand))
+    return query.filter(models.Category.category_id == category_id).first()
 
-def get_categories(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Category).offset(skip).limit(limit).all()
+def get_categories(db: Session, skip: int = 0, limit: int = 100, after: int = None, expand=()):
+    query = db.query(models.Category).options(*expand_options(models.Category, expand))
+    return _page(query, models.Category.category_id, skip, limit, after)
 
 def create_category(db: Session, name: str, description: str = None):
     category = models.Category(name=name, description=description)
     db.add(category)
-    db.commit()
+    _commit(db, category)
+    cache.invalidate("categories")
     db.refresh(category)
     return category
 
-def update_category(db: Session, category_id: int, **kwargs):
-    category = get_category(db, category_id)
+def patch_category(db: Session, category_id: int, version: int = None, **changes):
+    category = _patch(db, models.Category, category_id, changes, version)
     if not category:
         return None
-    for key, value in kwargs.items():
-        setattr(category, key, value)
     db.commit()
-    db.refresh(category)
+    cache.invalidate("categories", category_id)
     return category
 
-def delete_category(db: Session, category_id: int):
-    category = get_category(db, category_id)
+def delete_category(db: Session, category_id: int, version: int = None):
+    category = _delete(db, models.Category, category_id, version)
     if not category:
         return None
-    db.delete(category)
     db.commit()
+    cache.invalidate("categories", category_id)
+    cache.flush("products")
     return category
 
 # -------------------- PRODUCTS --------------------
-def get_product(db: Session, product_id: int):
-    return db.query(models.Product).filter(models.Product.product_id == product_id).first()
+def get_product(db: Session, product_id: int, expand=()):
+    query = db.query(models.Product).options(*expand_options(models.Product, expand))
+    return query.filter(models.Product.product_id == product_id).first()
+
+def _product_page(query, skip: int, limit: int, after=None, sort: str = None, min_rating: float = None):
+    """
+    `sort="rating"` lists the best rated first, keyed on (rating_avg,
+    product_id) so a page is one range scan of ix_products_rating_avg.
+    """
+    if min_rating is not None:
+        query = query.filter(models.Product.rating_avg >= min_rating)
+    if sort != "rating":
+        return _page(query, models.Product.product_id, skip, limit, after)
+    key = tuple_(models.Product.rating_avg, models.Product.product_id)
+    query = query.order_by(models.Product.rating_avg.desc(), models.Product.product_id.desc())
+    if after is not None:
+        return query.filter(key < tuple_(*after)).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
 
-def get_products(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Product).offset(skip).limit(limit).all()
+def get_products(db: Session, skip: int = 0, limit: int = 100, after=None, expand=(), sort: str = None, min_rating: float = None):
+    query = db.query(models.Product).options(*expand_options(models.Product, expand))
+    return _product_page(query, skip, limit, after, sort, min_rating)
+
+def get_product_rows(db: Session, columns, skip: int = 0, limit: int = 100, after=None, sort: str = None, min_rating: float = None):
+    return [row._asdict() for row in _product_page(db.query(*columns), skip, limit, after, sort, min_rating)]
 
 def create_product(db: Session, name: str, description: str, price: float, stock: int, category_id: int = None):
     product = models.Product(name=name, description=description, price=price, stock=stock, category_id=category_id)
     db.add(product)
-    db.commit()
+    _commit(db, product)
+    cache.invalidate("products")
     db.refresh(product)
     return product
 
-def update_product(db: Session, product_id: int, **kwargs):
-    product = get_product(db, product_id)
+def patch_product(db: Session, product_id: int, version: int = None, stock_delta: int = None, **changes):
+    """
+    `stock_delta` is added to the stored stock inside the UPDATE, so
+    concurrent sales cannot overwrite each other, and is rejected rather than
+    taking stock below zero.
+    """
+    where = ()
+    stock = models.Product.__table__.c.stock
+    if stock_delta:
+        changes["stock"] = stock + stock_delta
+        where = (stock + stock_delta >= 0,)
+    product = _patch(db, models.Product, product_id, changes, version, where)
+    if product is None and where:
+        current = _explain_miss(db, models.Product, product_id, version, stock)
+        if current is not None:
+            raise WriteRejected(f"Insufficient stock: {current.stock} left")
     if not product:
         return None
-    for key, value in kwargs.items():
-        setattr(product, key, value)
     db.commit()
-    db.refresh(product)
+    cache.invalidate("products", product_id)
     return product
 
-def delete_product(db: Session, product_id: int):
-    product = get_product(db, product_id)
+def delete_product(db: Session, product_id: int, version: int = None):
+    _touch(db, "order_items", models.OrderItem.product_id == product_id, {"product_id"})
+    _touch(db, "reviews", models.Review.product_id == product_id, {"product_id"})
+    product = _delete(db, models.Product, product_id, version)
     if not product:
         return None
-    db.delete(product)
     db.commit()
+    cache.invalidate("products", product_id)
+    cache.invalidate("order_items")
+    cache.invalidate("reviews")
     return product
 
+# -------------------- SEARCH --------------------
+SEARCH_CONFIG = "english"
+
+# sort -> (column builder, descending)
+SEARCH_SORTS = {
+    "relevance": (lambda score: score, True),
+    "price_asc": (lambda score: models.Product.price, False),
+    "price_desc": (lambda score: models.Product.price, True),
+}
+
+def _search_match(db: Session, q: str, fuzzy: bool):
+    """
+    (condition, score) for `q`: full-text match ranked by ts_rank_cd, or
+    trigram similarity on the name when `fuzzy`. Without PostgreSQL it
+    degrades to a substring match with a constant score.
+    """
+    product = models.Product
+    if db.get_bind().dialect.name != "postgresql":
+        pattern = f"%{q}%"
+        return or_(product.name.ilike(pattern), product.description.ilike(pattern)), literal(0.0)
+    if fuzzy:
+        return product.name.op("%")(q), func.similarity(product.name, q)
+    vector = literal_column("products.search_vector")
+    query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    return vector.op("@@")(query), func.ts_rank_cd(vector, query)
+
+def _search_filters(category_id=None, min_price=None, max_price=None, in_stock=False, min_rating=None):
+    product = models.Product
+    filters = []
+    if category_id is not None:
+        filters.append(product.category_id == category_id)
+    if min_price is not None:
+        filters.append(product.price >= min_price)
+    if max_price is not None:
+        filters.append(product.price <= max_price)
+    if in_stock:
+        filters.append(product.stock > 0)
+    if min_rating is not None:
+        filters.append(product.rating_avg >= min_rating)
+    return filters
+
+def _search_page(db: Session, q: str, filters, sort: str, after, limit: int, fuzzy: bool):
+    match, score = _search_match(db, q, fuzzy)
+    column, descending = SEARCH_SORTS[sort]
+    column = column(score)
+    key = tuple_(column, models.Product.product_id)
+    query = db.query(models.Product, score.label("score")).filter(match, *filters)
+    if after is not None:
+        query = query.filter(key < tuple_(*after) if descending else key > tuple_(*after))
+    if descending:
+        query = query.order_by(column.desc(), models.Product.product_id.desc())
+    else:
+        query = query.order_by(column, models.Product.product_id)
+    return query.limit(limit).all()
+
+def search_products(db: Session, q: str, sort: str = "relevance", after=None, limit: int = 20, fuzzy: bool = None, **filters):
+    """
+    One page of products matching `q` as (Product, score) rows, plus whether
+    the trigram fallback produced them. With fuzzy=None a first page that
+    finds nothing by full text is retried by similarity, so typos still hit;
+    later pages pass the mode their cursor was issued in.
+    """
+    conditions = _search_filters(**filters)
+    if fuzzy is None:
+        rows = _search_page(db, q, conditions, sort, after, limit, False)
+        if rows or after is not None or db.get_bind().dialect.name != "postgresql":
+            return rows, False
+        fuzzy = True
+    return _search_page(db, q, conditions, sort, after, limit, fuzzy), fuzzy
+
+def search_facets(db: Session, q: str, fuzzy: bool = False, **filters):
+    """
+    Match counts per category under every filter except the category one,
+    so the other categories stay visible after picking one.
+    """
+    filters.pop("category_id", None)
+    match, _ = _search_match(db, q, fuzzy)
+    count = func.count(models.Product.product_id)
+    return (
+        db.query(models.Product.category_id, models.Category.name, count.label("count"))
+        .outerjoin(models.Category, models.Category.category_id == models.Product.category_id)
+        .filter(match, *_search_filters(**filters))
+        .group_by(models.Product.category_id, models.Category.name)
+        .order_by(count.desc())
+        .all()
+    )
+
 # -------------------- ORDERS --------------------
-def get_order(db: Session, order_id: int):
-    return db.query(models.Order).filter(models.Order.order_id == order_id).first()
+def get_order(db: Session, order_id: int, expand=()):
+    query = db.query(models.Order).options(*expand_options(models.Order, expand))
+    return query.filter(models.Order.order_id == order_id).first()
 
-def get_orders(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Order).offset(skip).limit(limit).all()
+def get_orders(db: Session, skip: int = 0, limit: int = 100, after: int = None, expand=(), since=None, until=None):
+    query = db.query(models.Order).options(*expand_options(models.Order, expand))
+    query = query.filter(*time_range(models.Order.order_date, since, until))
+    return _page(query, models.Order.order_id, skip, limit, after)
 
 def create_order(db: Session, user_id: int, total_amount: float, status: str = "pending"):
     order = models.Order(user_id=user_id, total_amount=total_amount, status=status)
     db.add(order)
-    db.commit()
+    _commit(db, order)
+    cache.invalidate("orders")
     db.refresh(order)
     return order
 
-def update_order(db: Session, order_id: int, **kwargs):
-    order = get_order(db, order_id)
+# An order's items share its month (the partition both are stored in), so
+# they take its order_date as created_at and follow it when it changes
+def order_date(order_id):
+    date = select(models.Order.order_date).where(models.Order.order_id == order_id).scalar_subquery()
+    return func.coalesce(date, func.now())
+
+def item_dates(order_id: int):
+    # UPDATE ... RETURNING the ids of the order's items, moved to its order_date
+    table = models.OrderItem.__table__
+    stmt = update(table).where(table.c.order_id == order_id)
+    stmt = stmt.values(created_at=order_date(order_id), version=table.c.version + 1)
+    return stmt.returning(table.c.order_item_id)
+
+def patch_order(db: Session, order_id: int, version: int = None, **changes):
+    where = models.Order.order_id == order_id
+    items = models.OrderItem.order_id == order_id
+    _touch(db, "orders", where, changes)
+    if "order_date" in changes:
+        _touch(db, "order_items", items, ["created_at"])
+    order = _patch(db, models.Order, order_id, changes, version)
     if not order:
         return None
-    for key, value in kwargs.items():
-        setattr(order, key, value)
+    moved = []
+    if "order_date" in changes:
+        moved = db.execute(item_dates(order_id)).scalars().all()
+        _touch(db, "order_items", items, ["created_at"])
+    _touch(db, "orders", where, changes)
     db.commit()
-    db.refresh(order)
+    cache.invalidate("orders", order_id)
+    if moved:
+        cache.invalidate("order_items", *moved)
     return order
 
-def delete_order(db: Session, order_id: int):
-    order = get_order(db, order_id)
+def delete_order(db: Session, order_id: int, version: int = None):
+    _touch(db, "orders", models.Order.order_id == order_id)
+    order = _delete(db, models.Order, order_id, version)
     if not order:
         return None
-    db.delete(order)
     db.commit()
+    cache.invalidate("orders", order_id)
+    cache.invalidate("order_items")
+    return order
+
+class OrderRejected(Exception):
+    pass
+
+def place_order(db: Session, user_id: int, items: list):
+    """
+    Lock the ordered products, check and decrement stock, and write the order
+    with all of its items in a single transaction. Prices come from the
+    products table, never from the client.
+    """
+    quantities = {}
+    for item in items:
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+
+    # Rows are locked in primary key order so checkouts sharing SKUs queue
+    # behind each other instead of deadlocking
+    products = (
+        db.query(models.Product)
+        .filter(models.Product.product_id.in_(quantities))
+        .order_by(models.Product.product_id)
+        .with_for_update()
+        .all()
+    )
+    found = {product.product_id: product for product in products}
+    missing = sorted(set(quantities) - set(found))
+    if missing:
+        db.rollback()
+        raise OrderRejected(f"Products not found: {missing}")
+    short = sorted(pid for pid, quantity in quantities.items() if found[pid].stock < quantity)
+    if short:
+        db.rollback()
+        raise OrderRejected(f"Insufficient stock for products: {short}")
+
+    order = models.Order(user_id=user_id, status="pending")
+    total = Decimal(0)
+    for product_id, quantity in quantities.items():
+        product = found[product_id]
+        product.stock -= quantity
+        order.items.append(models.OrderItem(product_id=product_id, quantity=quantity, price=product.price))
+        total += product.price * quantity
+    order.total_amount = total
+    db.add(order)
+    try:
+        _commit(db, order)
+    except IntegrityError:
+        db.rollback()
+        return None
+    cache.invalidate("products", *quantities)
+    cache.invalidate("orders")
+    cache.invalidate("order_items")
+    db.refresh(order)
     return order
 
 # -------------------- ORDER ITEMS --------------------
-def get_order_item(db: Session, order_item_id: int):
-    return db.query(models.OrderItem).filter(models.OrderItem.order_item_id == order_item_id).first()
+def get_order_item(db: Session, order_item_id: int, expand=()):
+    query = db.query(models.OrderItem).options(*expand_options(models.OrderItem, expand))
+    return query.filter(models.OrderItem.order_item_id == order_item_id).first()
 
-def get_order_items(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.OrderItem).offset(skip).limit(limit).all()
+def get_order_items(db: Session, skip: int = 0, limit: int = 100, after: int = None, expand=(), since=None, until=None):
+    query = db.query(models.OrderItem).options(*expand_options(models.OrderItem, expand))
+    query = query.filter(*time_range(models.OrderItem.created_at, since, until))
+    return _page(query, models.OrderItem.order_item_id, skip, limit, after)
 
 def create_order_item(db: Session, order_id: int, product_id: int, quantity: int, price: float):
-    item = models.OrderItem(order_id=order_id, product_id=product_id, quantity=quantity, price=price)
+    item = models.OrderItem(order_id=order_id, product_id=product_id, quantity=quantity, price=price, created_at=order_date(order_id))
     db.add(item)
-    db.commit()
+    _commit(db, item)
+    cache.invalidate("order_items")
     db.refresh(item)
     return item
 
-def update_order_item(db: Session, order_item_id: int, **kwargs):
-    item = get_order_item(db, order_item_id)
+def patch_order_item(db: Session, order_item_id: int, version: int = None, **changes):
+    where = models.OrderItem.order_item_id == order_item_id
+    _touch(db, "order_items", where, changes)
+    item = _patch(db, models.OrderItem, order_item_id, changes, version)
     if not item:
         return None
-    for key, value in kwargs.items():
-        setattr(item, key, value)
+    _touch(db, "order_items", where, changes)
     db.commit()
-    db.refresh(item)
+    cache.invalidate("order_items", order_item_id)
     return item
 
-def delete_order_item(db: Session, order_item_id: int):
-    item = get_order_item(db, order_item_id)
+def delete_order_item(db: Session, order_item_id: int, version: int = None):
+    _touch(db, "order_items", models.OrderItem.order_item_id == order_item_id)
+    item = _delete(db, models.OrderItem, order_item_id, version)
     if not item:
         return None
-    db.delete(item)
     db.commit()
+    cache.invalidate("order_items", order_item_id)
     return item
 
 # -------------------- REVIEWS --------------------
-def get_review(db: Session, review_id: int):
-    return db.query(models.Review).filter(models.Review.review_id == review_id).first()
+def get_review(db: Session, review_id: int, expand=()):
+    query = db.query(models.Review).options(*expand_options(models.Review, expand))
+    return query.filter(models.Review.review_id == review_id).first()
 
-def get_reviews(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Review).offset(skip).limit(limit).all()
+def get_reviews(db: Session, skip: int = 0, limit: int = 100, after: int = None, expand=()):
+    query = db.query(models.Review).options(*expand_options(models.Review, expand))
+    return _page(query, models.Review.review_id, skip, limit, after)
 
 def create_review(db: Session, product_id: int, user_id: int, rating: int, comment: str = None):
     review = models.Review(product_id=product_id, user_id=user_id, rating=rating, comment=comment)
     db.add(review)
+    for stmt in rating_updates(None, (product_id, rating)):
+        db.execute(stmt)
     try:
-        db.commit()
+        _commit(db, review)
+        cache.invalidate("reviews")
+        cache.invalidate("products", product_id)
         db.refresh(review)
         return review
     except IntegrityError:
         db.rollback()
         return None
 
-def update_review(db: Session, review_id: int, **kwargs):
-    review = get_review(db, review_id)
+def patch_review(db: Session, review_id: int, version: int = None, **changes):
+    """
+    Only a change of rating or product_id needs the previous values, for the
+    product rating columns; that path locks the row and reads them first.
+    """
+    rated = "rating" in changes or "product_id" in changes
+    before = None
+    if rated:
+        table = models.Review.__table__
+        before = db.execute(
+            select(table.c.product_id, table.c.rating).where(table.c.review_id == review_id).with_for_update()
+        ).first()
+    where = models.Review.review_id == review_id
+    _touch(db, "reviews", where, changes)
+    review = _patch(db, models.Review, review_id, changes, version)
     if not review:
         return None
-    for key, value in kwargs.items():
-        setattr(review, key, value)
+    if rated:
+        for stmt in rating_updates(tuple(before), (review.product_id, review.rating)):
+            db.execute(stmt)
+    _touch(db, "reviews", where, changes)
     db.commit()
-    db.refresh(review)
+    cache.invalidate("reviews", review_id)
+    if rated:
+        cache.invalidate("products", before.product_id, review.product_id)
     return review
 
-def delete_review(db: Session, review_id: int):
-    review = get_review(db, review_id)
+def delete_review(db: Session, review_id: int, version: int = None):
+    _touch(db, "reviews", models.Review.review_id == review_id)
+    review = _delete(db, models.Review, review_id, version)
     if not review:
         return None
-    db.delete(review)
+    for stmt in rating_updates((review.product_id, review.rating), None):
+        db.execute(stmt)
     db.commit()
+    cache.invalidate("reviews", review_id)
+    cache.invalidate("products", review.product_id)
     return review
+
+# -------------------- RATINGS --------------------
+# products.rating_count / rating_sum / rating_avg are kept in step with
+# reviews inside the transaction of every review write. They are part of the
+# product's representation, so these writes bump its version (and ETag) too.
+def rating_update(product_id: int, count: int, total: int):
+    """
+    UPDATE adding `count` ratings summing to `total` to a product. The
+    arithmetic runs on the locked row, so concurrent review writes cannot
+    overwrite each other's changes.
+    """
+    product = models.Product
+    new_count = product.rating_count + count
+    new_sum = product.rating_sum + total
+    return (
+        update(product)
+        .where(product.product_id == product_id)
+        .values(
+            rating_count=new_count,
+            rating_sum=new_sum,
+            rating_avg=func.coalesce(func.round(cast(new_sum, Numeric) / func.nullif(new_count, 0), 2), 0),
+            version=product.version + 1,
+        )
+    )
+
+def rating_updates(before, after):
+    """
+    UPDATEs moving a review from `before` to `after`, each a (product_id,
+    rating) pair or None, in product_id order so writers lock in one order.
+    """
+    deltas = {}
+    for pair, sign in ((before, -1), (after, 1)):
+        if pair and pair[0] is not None and pair[1] is not None:
+            count, total = deltas.get(pair[0], (0, 0))
+            deltas[pair[0]] = (count + sign, total + sign * pair[1])
+    return [rating_update(pid, count, total) for pid, (count, total) in sorted(deltas.items()) if count or total]
+
+def rating_recount(product_ids=None):
+    """
+    UPDATE recomputing the rating columns from reviews, limited to
+    `product_ids` and to the products whose stored values have drifted.
+    """
+    product, review = models.Product, models.Review
+    reviews = lambda column: select(column).where(review.product_id == product.product_id).scalar_subquery()
+    count = reviews(func.count(review.rating))
+    total = reviews(func.coalesce(func.sum(review.rating), 0))
+    average = reviews(func.coalesce(func.round(func.avg(review.rating), 2), 0))
+    stmt = (
+        update(product)
+        .where(or_(product.rating_count != count, product.rating_sum != total, product.rating_avg != average))
+        .values(rating_count=count, rating_sum=total, rating_avg=average, version=product.version + 1)
+    )
+    if product_ids is not None:
+        stmt = stmt.where(product.product_id.in_(sorted(product_ids)))
+    return stmt
+
+def reconcile_ratings(db: Session, batch_size: int = BULK_CHUNK_SIZE):
+    """
+    Repair drifted rating columns, one product_id range per transaction.
+    Returns the number of products fixed.
+    """
+    fixed = 0
+    high = db.scalar(select(func.max(models.Product.product_id))) or 0
+    for start in range(0, high + 1, batch_size):
+        stmt = rating_recount().where(models.Product.product_id.between(start, start + batch_size - 1))
+        fixed += db.execute(stmt).rowcount
+        db.commit()
+    if fixed:
+        db.execute(cache.publish("products"))
+        db.commit()
+        cache.flush("products")
+    return fixed
+
+# -------------------- ANALYTICS --------------------
+# Reads of the rollup tables maintained by rollups.py
+def top_products(db: Session, since=None, until=None, category_id: int = None, limit: int = 10):
+    rollup = models.DailyProductRevenue
+    revenue = func.sum(rollup.revenue)
+    query = (
+        db.query(
+            models.Product.product_id,
+            models.Product.name,
+            models.Product.category_id,
+            func.sum(rollup.quantity).label("quantity"),
+            revenue.label("revenue"),
+        )
+        .select_from(rollup)
+        .join(models.Product, models.Product.product_id == rollup.product_id)
+    )
+    if since is not None:
+        query = query.filter(rollup.day >= since)
+    if until is not None:
+        query = query.filter(rollup.day < until)
+    if category_id is not None:
+        query = query.filter(models.Product.category_id == category_id)
+    return query.group_by(models.Product.product_id).order_by(revenue.desc()).limit(limit).all()
+
+def revenue_series(db: Session, since=None, until=None, granularity: str = "day", category_id: int = None):
+    rollup = models.DailyProductRevenue
+    if granularity == "day":
+        period = rollup.day
+    elif db.get_bind().dialect.name == "sqlite":
+        period = func.date(rollup.day, "start of month")
+    else:
+        period = cast(func.date_trunc("month", rollup.day), Date)
+    query = db.query(
+        period.label("period"),
+        func.sum(rollup.quantity).label("quantity"),
+        func.sum(rollup.revenue).label("revenue"),
+    )
+    if since is not None:
+        query = query.filter(rollup.day >= since)
+    if until is not None:
+        query = query.filter(rollup.day < until)
+    if category_id is not None:
+        query = query.join(models.Product, models.Product.product_id == rollup.product_id)
+        query = query.filter(models.Product.category_id == category_id)
+    return query.group_by(period).order_by(period).all()
+
+def category_ratings(db: Session):
+    stats = models.ProductRatingStats
+    count = func.sum(stats.rating_count)
+    return (
+        db.query(
+            models.Category.category_id,
+            models.Category.name,
+            count.label("rating_count"),
+            func.round(cast(func.sum(stats.rating_sum), Numeric) / func.nullif(count, 0), 2).label("rating_avg"),
+        )
+        .select_from(stats)
+        .join(models.Product, models.Product.product_id == stats.product_id)
+        .join(models.Category, models.Category.category_id == models.Product.category_id)
+        .group_by(models.Category.category_id)
+        .order_by(models.Category.category_id)
+        .all()
+    )
+
+def top_customers(db: Session, limit: int = 10):
+    stats = models.UserOrderStats
+    return (
+        db.query(
+            stats.user_id,
+            models.User.name,
+            stats.order_count,
+            stats.total_spent,
+            stats.first_order_at,
+            stats.last_order_at,
+        )
+        .join(models.User, models.User.user_id == stats.user_id)
+        .order_by(stats.total_spent.desc())
+        .limit(limit)
+        .all()
+    )
+
+# -------------------- BULK --------------------
+def _insert(db: Session, model):
+    dialect = sqlite if db.get_bind().dialect.name == "sqlite" else postgresql
+    return dialect.insert(model)
+
+def _insert_chunk(db: Session, model, rows, conflict=(), update=()):
+    pk = model.__mapper__.primary_key[0]
+    if not conflict:
+        stmt = _insert(db, model).values(rows).returning(pk)
+        return [row[0] for row in db.execute(stmt)]
+
+    # ON CONFLICT cannot touch the same row twice in one statement, so the
+    # last occurrence of a key wins and earlier duplicates share its id
+    key = lambda row: tuple(row[c] for c in conflict)
+    unique = list({key(row): row for row in rows}.values())
+    stmt = _insert(db, model).values(unique)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(conflict),
+        set_={**{c: stmt.excluded[c] for c in update}, "version": model.__table__.c.version + 1},
+    ).returning(pk, *(model.__table__.c[c] for c in conflict))
+    ids = {tuple(row[1:]): row[0] for row in db.execute(stmt)}
+    # Rows updated in place may already be folded into a rollup
+    _touch(db, model.__tablename__, pk.in_(list(ids.values())), update)
+    return [ids[key(row)] for row in rows]
+
+def _bulk_insert(db: Session, model, rows, conflict=(), update=(), after_write=None):
+    """
+    Multi-row INSERT ... RETURNING (or upsert on `conflict`), one transaction
+    per chunk. A failing chunk is replayed row by row under savepoints so
+    every row gets its own result. `after_write(rows)` runs inside the same
+    transaction (or savepoint) as the rows it is given.
+    """
+    results = []
+    for start in range(0, len(rows), BULK_CHUNK_SIZE):
+        chunk = rows[start:start + BULK_CHUNK_SIZE]
+        try:
+            ids = _insert_chunk(db, model, chunk, conflict, update)
+            if after_write:
+                after_write(chunk)
+            db.commit()
+            results.extend({"index": start + i, "id": id_} for i, id_ in enumerate(ids))
+            continue
+        except DBAPIError:
+            db.rollback()
+        for i, row in enumerate(chunk, start):
+            try:
+                with db.begin_nested():
+                    (id_,) = _insert_chunk(db, model, [row], conflict, update)
+                    if after_write:
+                        after_write([row])
+                results.append({"index": i, "id": id_})
+            except DBAPIError as e:
+                results.append({"index": i, "id": None, "error": str(e.orig).splitlines()[0]})
+        db.commit()
+    # Upserts may have rewritten rows that are already cached
+    updated = [r["id"] for r in results if r["id"] is not None] if conflict else []
+    cache.invalidate(model.__tablename__, *updated)
+    return results
+
+def bulk_create_users(db: Session, users: list):
+    return _bulk_insert(db, models.User, users, conflict=("email",), update=("name", "password_hash"))
+
+def bulk_create_products(db: Session, products: list):
+    return _bulk_insert(db, models.Product, products)
+
+def bulk_create_orders(db: Session, orders: list):
+    return _bulk_insert(db, models.Order, orders)
+
+def bulk_create_order_items(db: Session, items: list):
+    items = [{**item, "created_at": order_date(item.get("order_id"))} for item in items]
+    return _bulk_insert(db, models.OrderItem, items)
+
+def bulk_create_reviews(db: Session, reviews: list):
+    # Upserted ratings are recounted per product inside each chunk's transaction
+    recount = lambda rows: db.execute(rating_recount({row["product_id"] for row in rows}))
+    results = _bulk_insert(
+        db, models.Review, reviews,
+        conflict=("user_id", "product_id"), update=("rating", "comment"), after_write=recount,
+    )
+    cache.invalidate("products", *{review["product_id"] for review in reviews})
+    return results
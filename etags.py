@@ -0,0 +1,27 @@
+from typing import Optional
+from fastapi import Header, HTTPException
+from pydantic import BaseModel
+
+# Row versions as ETags, and the If-Match / PATCH body parsing shared by the
+# conditional write routes of main.py and main_async.py
+
+def etag(version: int) -> str:
+    return f'"v{version}"'
+
+def if_match(if_match: Optional[str] = Header(None)) -> Optional[int]:
+    """
+    The row version an If-Match header names, or None to write
+    unconditionally. Only ETags handed out by this API can match.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.strip().removeprefix("W/")
+    if tag.startswith('"v') and tag.endswith('"') and tag[2:-1].isdigit():
+        return int(tag[2:-1])
+    raise HTTPException(status_code=412, detail="If-Match does not name a version of this resource")
+
+def changes(update: BaseModel) -> dict:
+    values = update.dict(exclude_unset=True)
+    if not values:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    return values
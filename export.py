@@ -0,0 +1,234 @@
+"""
+Streaming table exports for GET /export/{table}.
+
+Rows are read from a server-side cursor in batches of EXPORT_BATCH_SIZE and
+encoded batch by batch, so memory stays flat whatever the table size:
+
+- ndjson: one JSON object per line (fastjson encoding)
+- csv: COPY ... TO STDOUT on PostgreSQL with psycopg2, the csv module elsewhere
+- parquet: one row group per batch (needs pyarrow)
+
+The columns are those of the table's response schema, so password hashes and
+other internal columns are never exported. `since` keeps rows whose
+timestamp is at or after it, for incremental exports.
+Exports read from a replica when REPLICA_URLS is set.
+"""
+import csv
+import importlib.util
+import io
+import os
+import queue
+import threading
+from sqlalchemy import Boolean, Date, Integer, Numeric, TIMESTAMP, select
+import fastjson, models, schemas
+import database
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+
+# table -> (model, schema, timestamp column for `since`)
+TABLES = {
+    "users": (models.User, schemas.User, models.User.created_at),
+    "categories": (models.Category, schemas.Category, None),
+    "products": (models.Product, schemas.Product, models.Product.created_at),
+    "orders": (models.Order, schemas.Order, models.Order.order_date),
+    "order_items": (models.OrderItem, schemas.OrderItem, models.OrderItem.created_at),
+    "reviews": (models.Review, schemas.Review, models.Review.created_at),
+}
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+class ExportError(Exception):
+    pass
+
+def statement(table: str, since=None):
+    model, schema, timestamp = TABLES[table]
+    stmt = select(*fastjson.columns(model, schema))
+    if since is not None:
+        if timestamp is None:
+            raise ExportError(f"{table} has no timestamp to filter on")
+        stmt = stmt.where(timestamp >= since)
+    return stmt.order_by(*model.__table__.primary_key.columns)
+
+def _batches(stmt, batch_size: int):
+    # Yields the column names, then lists of row tuples
+    with database.read_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(stmt)
+        yield list(result.keys())
+        for partition in result.partitions(batch_size):
+            yield partition
+
+# -------------------- NDJSON --------------------
+def _ndjson(stmt, batch_size: int):
+    batches = _batches(stmt, batch_size)
+    columns = next(batches)
+    for rows in batches:
+        yield b"".join(fastjson.dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+
+# -------------------- CSV --------------------
+def _csv(stmt, batch_size: int):
+    batches = _batches(stmt, batch_size)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(next(batches))
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+class _QueueSink:
+    """
+    File object for cursor.copy_expert that hands each write to the
+    response generator through a bounded queue. Raising once the generator
+    has gone away aborts the COPY.
+    """
+    def __init__(self, chunks: queue.Queue, stopped: threading.Event):
+        self.chunks = chunks
+        self.stopped = stopped
+
+    def write(self, data):
+        data = data.encode() if isinstance(data, str) else bytes(data)
+        while True:
+            if self.stopped.is_set():
+                raise ExportError("Export cancelled")
+            try:
+                self.chunks.put(data, timeout=1)
+                return len(data)
+            except queue.Full:
+                continue
+
+def _copy_csv(stmt, batch_size: int):
+    """
+    COPY (stmt) TO STDOUT WITH CSV HEADER, run on its own thread because
+    copy_expert blocks until the whole result has been written.
+    """
+    chunks = queue.Queue(maxsize=16)
+    stopped = threading.Event()
+    done = object()
+
+    def run():
+        try:
+            with database.read_engine().connect() as conn:
+                compiled = stmt.compile(dialect=conn.dialect)
+                cursor = conn.connection.cursor()
+                sql = cursor.mogrify(str(compiled), compiled.params).decode()
+                cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)", _QueueSink(chunks, stopped), size=batch_size * 64)
+        except Exception as e:
+            if not stopped.is_set():
+                chunks.put(e)
+        finally:
+            if not stopped.is_set():
+                chunks.put(done)
+
+    thread = threading.Thread(target=run, name="export-copy", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        # Keep the queue drained so the thread cannot block on a final put
+        while thread.is_alive():
+            try:
+                chunks.get_nowait()
+            except queue.Empty:
+                thread.join(0.1)
+
+def _copy_supported() -> bool:
+    return database.engine.dialect.name == "postgresql" and database.engine.dialect.driver == "psycopg2"
+
+# -------------------- Parquet --------------------
+def _arrow_type(pa, column):
+    kind = column.type
+    if isinstance(kind, Integer):
+        return pa.int64()
+    if isinstance(kind, Numeric):
+        return pa.decimal128(kind.precision or 38, kind.scale or 0)
+    if isinstance(kind, TIMESTAMP):
+        return pa.timestamp("us", tz="UTC" if kind.timezone else None)
+    if isinstance(kind, Date):
+        return pa.date32()
+    if isinstance(kind, Boolean):
+        return pa.bool_()
+    return pa.string()
+
+class _ByteSink:
+    # Collects what ParquetWriter writes so it can be streamed between row groups
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+def _parquet(stmt, batch_size: int):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column.name, _arrow_type(pa, column)) for column in stmt.selected_columns])
+    sink = _ByteSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    batches = _batches(stmt, batch_size)
+    columns = next(batches)
+    try:
+        for rows in batches:
+            writer.write_table(pa.Table.from_pydict(
+                {name: [row[i] for row in rows] for i, name in enumerate(columns)}, schema=schema
+            ))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def _parquet_supported() -> bool:
+    try:
+        return importlib.util.find_spec("pyarrow.parquet") is not None
+    except ImportError:
+        # find_spec imports pyarrow itself to look for the submodule
+        return False
+
+# -------------------- Entry point --------------------
+def stream(table: str, fmt: str = "ndjson", since=None, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Byte chunks of `table` in `fmt`. Raises ExportError up front for an
+    unknown table or format, or a format this install cannot produce.
+    """
+    if table not in TABLES:
+        raise ExportError(f"Unknown table {table}; expected one of: {', '.join(TABLES)}")
+    stmt = statement(table, since)
+    if fmt == "ndjson":
+        return _ndjson(stmt, batch_size)
+    if fmt == "csv":
+        return _copy_csv(stmt, batch_size) if _copy_supported() else _csv(stmt, batch_size)
+    if fmt == "parquet":
+        if not _parquet_supported():
+            raise ExportError("Parquet export needs pyarrow installed")
+        return _parquet(stmt, batch_size)
+    raise ExportError(f"Unknown format {fmt}; expected one of: {', '.join(MEDIA_TYPES)}")
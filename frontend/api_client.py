@@ -1,6 +1,8 @@
+import json
+import os
 import requests
 
-API_BASE = "http://127.0.0.1:8000"
+API_BASE = os.getenv("API_BASE", "http://127.0.0.1:8000")
 
 def ai_query(question: str):
     try:
@@ -10,6 +12,28 @@ def ai_query(question: str):
             timeout=1000
         )
         resp.raise_for_status()
-        return resp.json()["answer"]
+        data = resp.json()
+        return data.get("rows") or data["answer"]
     except requests.exceptions.RequestException as e:
         return f"API Error: {str(e)}"
+
+def ai_query_stream(question: str):
+    """
+    Yield (event, data) pairs from the /ai/query/stream Server-Sent Events.
+    """
+    try:
+        with requests.post(
+            f"{API_BASE}/ai/query/stream",
+            json={"question": question},
+            stream=True,
+            timeout=(10, 1000)
+        ) as resp:
+            resp.raise_for_status()
+            event = None
+            for line in resp.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    yield event, json.loads(line[len("data: "):])
+    except requests.exceptions.RequestException as e:
+        yield "error", f"API Error: {str(e)}"
@@ -1,32 +1,31 @@
 import gradio as gr
-from api_client import ai_query
+from api_client import ai_query_stream
 import pandas as pd
 
+# Rows kept in the table; the stream may carry many more
+DISPLAY_ROWS = 1000
 
-def run_ai_query(question):
-    try:
-        result = ai_query(question)
-
-        if isinstance(result, list):
-            return pd.DataFrame(result)
-
-        if isinstance(result, str):
-            lines = result.strip().split("\n")
 
-            final_answer = lines[-1]
-
-            return pd.DataFrame(
-                [{"answer": final_answer}]
-            )
-
-        return pd.DataFrame(
-            [{"message": str(result)}]
-        )
+def stream_ai_query(question):
+    sql, answer, columns, rows = "", "", None, []
+    try:
+        for event, data in ai_query_stream(question):
+            if event == "sql":
+                sql = data or ""
+            elif event == "columns":
+                columns = data
+            elif event == "rows" and len(rows) < DISPLAY_ROWS:
+                rows.extend(data[:DISPLAY_ROWS - len(rows)])
+            elif event == "token":
+                answer += data
+            elif event == "error":
+                answer = data
+            else:
+                continue
+            yield pd.DataFrame(rows, columns=columns), sql, answer
 
     except Exception as e:
-        return pd.DataFrame(
-            [{"error": f"{str(e)}"}]
-        )
+        yield pd.DataFrame([{"error": f"{str(e)}"}]), sql, answer
 
 
 with gr.Blocks(title="E-commerce AI Dashboard") as demo:
@@ -52,6 +51,16 @@ with gr.Blocks(title="E-commerce AI Dashboard") as demo:
 
     run_btn = gr.Button("Run Query")
 
+    answer_output = gr.Textbox(
+        label="Answer",
+        interactive=False
+    )
+
+    sql_output = gr.Code(
+        label="Generated SQL",
+        language="sql"
+    )
+
     output = gr.Dataframe(
         label="Query Result",
         wrap=True,
@@ -59,9 +68,9 @@ with gr.Blocks(title="E-commerce AI Dashboard") as demo:
     )
 
     run_btn.click(
-        fn=run_ai_query,
+        fn=stream_ai_query,
         inputs=query_input,
-        outputs=output
+        outputs=[output, sql_output, answer_output]
     )
 
 demo.launch()
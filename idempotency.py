@@ -0,0 +1,98 @@
+"""
+Idempotency keys for the create routes.
+
+A POST sent with an `Idempotency-Key` header claims the key and stores its
+response in the same transaction as the rows it creates, so a retry after a
+timeout or a dropped connection is answered with the first response instead
+of creating a second order, and a key never commits without its response.
+
+Keys expire after IDEMPOTENCY_TTL_HOURS; run `python idempotency.py purge`
+from cron to delete them.
+"""
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import SessionLocal
+import models
+
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+MAX_KEY_LENGTH = 200
+
+class KeyReused(Exception):
+    pass
+
+class InProgress(Exception):
+    pass
+
+def request_hash(route: str, payload) -> str:
+    return hashlib.sha256(json.dumps([route, payload], sort_keys=True, default=str).encode()).hexdigest()
+
+def _cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+
+def _expired(record) -> bool:
+    created_at = record.created_at
+    if created_at is None:
+        return False
+    # SQLite hands back naive UTC timestamps
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at < _cutoff()
+
+def claim(db: Session, key: str, route: str, payload):
+    """
+    The stored response for `key`, or None once the key is flushed into the
+    session's transaction, so it commits or rolls back with the request's own
+    writes. Raises KeyReused if the key came with a different request, and
+    InProgress if the first request has not committed yet.
+    """
+    digest = request_hash(route, payload)
+    record = db.get(models.IdempotencyKey, key)
+    if record is not None and _expired(record):
+        db.delete(record)
+        record = None
+    if record is None:
+        db.add(models.IdempotencyKey(key=key, route=route, request_hash=digest))
+        try:
+            db.flush()
+            return None
+        except IntegrityError:
+            # A concurrent request with the same key committed first; the
+            # flush waited for it on the primary key
+            db.rollback()
+            record = db.get(models.IdempotencyKey, key)
+    if record is not None and record.request_hash != digest:
+        raise KeyReused(f"Idempotency-Key {key!r} was already used for a different request")
+    if record is None or record.response is None:
+        raise InProgress(f"A request with Idempotency-Key {key!r} is still in progress")
+    return json.loads(record.response)
+
+def store(db: Session, key: str, response):
+    """
+    Save the JSON-ready response of the request that claimed `key`, in that
+    request's transaction. Does not commit.
+    """
+    table = models.IdempotencyKey.__table__
+    db.execute(update(table).where(table.c.key == key).values(response=json.dumps(response)))
+
+def purge(db: Session) -> int:
+    table = models.IdempotencyKey.__table__
+    deleted = db.execute(delete(table).where(table.c.created_at < _cutoff())).rowcount
+    db.commit()
+    return deleted
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the idempotency_keys table")
+    parser.add_argument("command", choices=["purge"])
+    parser.parse_args()
+
+    with SessionLocal() as db:
+        print(f"Deleted {purge(db)} expired idempotency keys")
+
+if __name__ == "__main__":
+    main()
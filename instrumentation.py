@@ -0,0 +1,284 @@
+"""
+Request-level performance instrumentation.
+
+- Middleware times every request into a per-route latency histogram and adds
+  a Server-Timing header (app, db, llm and tool time) to the response
+- instrument_engine hooks SQLAlchemy cursor events to count statements and DB
+  time per request, flag N+1 patterns (the same statement run
+  N_PLUS_ONE_THRESHOLD or more times in one request) and log statements
+  slower than SLOW_QUERY_MS along with their plan
+- AICallbacks is a LangChain callback handler recording a span for each LLM
+  call and each agent tool call
+- render() returns everything in the Prometheus text format for /metrics
+
+Per-request numbers live in a contextvar, which follows the request into
+threadpool routes and ai_pool's worker threads.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+try:
+    from langchain_core.callbacks import BaseCallbackHandler
+except ImportError:
+    BaseCallbackHandler = object
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() in ("1", "true", "yes")
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# -------------------- Metrics --------------------
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values, **extra):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in [*zip(names, values), *extra.items()]]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            series["counts"][bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self.lock:
+            series = {labels: (list(s["counts"]), s["sum"]) for labels, s in self.series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labels, labels, le=bound)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = collections.Counter()
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.series[labels] += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self.lock:
+            series = dict(self.series)
+        for labels, value in sorted(series.items()):
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+request_seconds = Histogram("http_request_duration_seconds", "Request latency, to the last body byte", ("method", "route", "status"))
+request_statements = Histogram("http_request_db_statements", "SQL statements run per request", ("route",), COUNT_BUCKETS)
+request_db_seconds = Histogram("http_request_db_seconds", "Time spent in SQL per request", ("route",))
+statement_seconds = Histogram("db_statement_duration_seconds", "SQL statement latency", ("engine",))
+slow_statements = Counter("db_slow_statements_total", f"SQL statements slower than {SLOW_QUERY_MS:g} ms", ("engine",))
+n_plus_one = Counter("http_n_plus_one_total", f"Requests running one statement {N_PLUS_ONE_THRESHOLD}+ times", ("route",))
+llm_seconds = Histogram("ai_llm_call_duration_seconds", "LLM call latency", ("model",))
+tool_seconds = Histogram("ai_tool_call_duration_seconds", "Agent tool call latency", ("tool",))
+
+METRICS = [request_seconds, request_statements, request_db_seconds, statement_seconds, slow_statements, n_plus_one, llm_seconds, tool_seconds]
+
+def render() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+# -------------------- Per request --------------------
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = collections.Counter()
+        self.db_seconds = 0.0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.tool_calls = 0
+        self.tool_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def server_timing(self) -> str:
+        entries = [f"app;dur={(time.perf_counter() - self.started) * 1000:.1f}"]
+        count = sum(self.statements.values())
+        if count:
+            entries.append(f'db;dur={self.db_seconds * 1000:.1f};desc="{count} queries"')
+        if self.llm_calls:
+            entries.append(f'llm;dur={self.llm_seconds * 1000:.1f};desc="{self.llm_calls} calls"')
+        if self.tool_calls:
+            entries.append(f'tool;dur={self.tool_seconds * 1000:.1f};desc="{self.tool_calls} calls"')
+        return ", ".join(entries)
+
+_current = ContextVar("request_stats", default=None)
+
+def current():
+    return _current.get()
+
+def _route(scope) -> str:
+    # The route template, not the raw path, keeps label cardinality bounded
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+class Middleware:
+    """
+    ASGI middleware. Server-Timing covers the work done before the response
+    starts; the latency histogram runs to the end of the body, so streamed
+    responses are timed in full.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                MutableHeaders(scope=message).append("Server-Timing", stats.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            _finish(scope, stats, status)
+
+def _finish(scope, stats: RequestStats, status: int):
+    route = _route(scope)
+    request_seconds.observe(time.perf_counter() - stats.started, scope["method"], route, str(status))
+    request_statements.observe(sum(stats.statements.values()), route)
+    request_db_seconds.observe(stats.db_seconds, route)
+    repeated = [(count, statement) for statement, count in stats.statements.items() if count >= N_PLUS_ONE_THRESHOLD]
+    if repeated:
+        n_plus_one.inc(route)
+        count, statement = max(repeated)
+        logger.warning("Possible N+1 on %s %s: statement ran %d times: %s", scope["method"], route, count, statement)
+
+# -------------------- SQL --------------------
+def _explain(conn, statement: str, parameters) -> str:
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return "\n".join(" ".join(str(value) for value in row) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+def instrument_engine(engine, name: str):
+    """
+    Time every statement `engine` runs. Pass AsyncEngine.sync_engine for an
+    async engine.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("instrumentation_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["instrumentation_started"].pop()
+        statement_seconds.observe(elapsed, name)
+        stats = _current.get()
+        if stats is not None:
+            with stats.lock:
+                stats.statements[statement] += 1
+                stats.db_seconds += elapsed
+        if elapsed * 1000 < SLOW_QUERY_MS:
+            return
+        slow_statements.inc(name)
+        plan = ""
+        # Plain EXPLAIN does not run the statement; only reads are explained
+        if SLOW_QUERY_EXPLAIN and not executemany and statement.split(None, 1)[0].upper() in ("SELECT", "WITH"):
+            try:
+                plan = "\n" + _explain(conn, statement, parameters)
+            except Exception as e:
+                plan = f"\n(no plan: {e})"
+        logger.warning("Slow query on %s: %.0f ms: %s%s", name, elapsed * 1000, statement, plan)
+
+    @event.listens_for(engine, "handle_error")
+    def failed(context):
+        # after_cursor_execute does not fire for a failed statement
+        started = context.connection.info.get("instrumentation_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+# -------------------- AI --------------------
+class AICallbacks(BaseCallbackHandler):
+    """
+    LangChain callbacks timing each LLM call and each tool call, into the
+    histograms and the request that made them.
+    """
+    def __init__(self, stats: RequestStats = None):
+        self.stats = stats
+        self.started = {}
+
+    def _start(self, run_id, label):
+        self.started[run_id] = (time.perf_counter(), label)
+
+    def _end(self, run_id, histogram, kind):
+        started = self.started.pop(run_id, None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started[0]
+        histogram.observe(elapsed, started[1])
+        if self.stats is not None:
+            with self.stats.lock:
+                setattr(self.stats, f"{kind}_calls", getattr(self.stats, f"{kind}_calls") + 1)
+                setattr(self.stats, f"{kind}_seconds", getattr(self.stats, f"{kind}_seconds") + elapsed)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, ((serialized or {}).get("id") or ["llm"])[-1])
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, ((serialized or {}).get("id") or ["llm"])[-1])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id, llm_seconds, "llm")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, llm_seconds, "llm")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, (serialized or {}).get("name") or kwargs.get("name") or "tool")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, tool_seconds, "tool")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, tool_seconds, "tool")
+
+def callbacks():
+    # For config={"callbacks": ...} on LLM and agent calls
+    if BaseCallbackHandler is object:
+        return []
+    return [AICallbacks(current())]
@@ -1,20 +1,6 @@
-from langchain_community.utilities import SQLDatabase
-from dotenv import load_dotenv
-import os
+# The agent's SQLDatabase, for scripts that import it from here. It used to
+# be built with SQLDatabase.from_uri, reflecting every table and running
+# sample-row queries at import; table info now comes from schema_cache.
+from sql_agent import get_database
 
-load_dotenv()
-
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-db = SQLDatabase.from_uri(
-    DATABASE_URL,
-    include_tables=[
-        "users",
-        "categories",
-        "products",
-        "orders",
-        "order_items",
-        "reviews"
-    ],
-    sample_rows_in_table_info=2
-)
+db = get_database()
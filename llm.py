@@ -1,6 +1,36 @@
-from langchain_ollama import ChatOllama
+import os
+import threading
 
-llm = ChatOllama(
-    model="llama3.1:8b",
-    temperature=0,
-)
+# "ollama" talks to the local Ollama server; "fake" answers every prompt with
+# FAKE_LLM_RESPONSE so the AI path can run without a model
+LLM_BACKEND = os.getenv("LLM_BACKEND", "ollama")
+FAKE_LLM_RESPONSE = os.getenv("FAKE_LLM_RESPONSE", "SELECT count(*) AS users FROM users")
+
+def _build():
+    if LLM_BACKEND == "fake":
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        return FakeListChatModel(responses=[FAKE_LLM_RESPONSE])
+    from langchain_ollama import ChatOllama
+    return ChatOllama(
+        model="llama3.1:8b",
+        temperature=0,
+    )
+
+# Built on first use, so importing the app does not load the client
+llm = None
+_lock = threading.Lock()
+
+def get_llm():
+    global llm
+    if llm is None:
+        with _lock:
+            if llm is None:
+                llm = _build()
+    return llm
+
+def set_llm(model):
+    """
+    Swap the chat model used by the AI path, e.g. for a fake in tests.
+    """
+    global llm
+    llm = model
@@ -1,219 +1,542 @@
-from fastapi import FastAPI, Depends, HTTPException
+import asyncio
+import json
+import time
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-import crud, database, models, schemas
-from sql_agent import run_query
-
-app = FastAPI(title="E-commerce API", version="1.0")
+from typing import Optional
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+import ai_cache, ai_pool, cache, crud, database, export, fastjson, idempotency, instrumentation, models, rollups, schemas, server
+from etags import changes, etag, if_match
+from pagination import cursor_headers, cursor_key, cursor_values, next_cursor, paginated
+from sql_agent import run_query, stream_query
+
+# Warm-up, background threads and shutdown draining live in server.lifespan
+app = FastAPI(title="E-commerce API", version="1.0", lifespan=server.lifespan())
+app.add_middleware(instrumentation.Middleware)
+
+# -------------------- Database routing --------------------
+READ_METHODS = ("GET", "HEAD")
+# Unix time until which this client reads from the primary
+PRIMARY_UNTIL_COOKIE = "primary_until"
+
+def reads_from_replica(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(PRIMARY_UNTIL_COOKIE, 0)) < time.time()
+    except ValueError:
+        return True
 
-def get_db():
-    db = database.SessionLocal()
+def get_db(request: Request, response: Response):
+    """
+    GET routes read from a replica, unless the client wrote in the last
+    READ_YOUR_WRITES_SECONDS; every other method uses the primary, and a
+    commit there starts that window. A write that fails or is refused
+    (404, 409, 412) leaves the client on the replicas.
+    """
+    replica = request.method in READ_METHODS and bool(database.replicas) and reads_from_replica(request)
+    db = database.SessionLocal(replica=replica)
+    if request.method not in READ_METHODS and database.replicas:
+        window = database.READ_YOUR_WRITES_SECONDS
+        event.listen(db, "after_commit", lambda session: response.set_cookie(
+            PRIMARY_UNTIL_COOKIE, f"{time.time() + window:.0f}", max_age=int(window) + 1, httponly=True, samesite="lax"
+        ))
     try:
         yield db
     finally:
         db.close()
 
+def cached(request: Request, db: Session, cache_key: str, load, trusted: bool = False):
+    """
+    cache.cached_json, reading from the primary on a miss: an entry filled
+    from a lagging replica would outlive the invalidation of the write it
+    has not seen yet, for every client.
+    """
+    def load_from_primary():
+        db.use_primary()
+        return load()
+    return cache.cached_json(request, cache_key, load_from_primary, trusted)
+
+# -------------------- Expansion --------------------
+def expand_param(model):
+    def parse(expand: Optional[str] = None):
+        paths = tuple(path.strip() for path in expand.split(",") if path.strip()) if expand else ()
+        try:
+            crud.expand_options(model, paths)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return paths
+    return parse
+
+# -------------------- Fast JSON --------------------
+def fast_json(fast: Optional[bool] = None) -> bool:
+    return fastjson.FAST_JSON if fast is None else fast
+
+def fast_page(db: Session, model, schema, key: str, skip: int, limit: int, after, filters=()):
+    # Column tuples straight to orjson, skipping ORM entities and validation
+    rows = crud.get_rows(db, fastjson.columns(model, schema), getattr(model, key), skip, limit, after, filters)
+    return fastjson.FastJSONResponse(rows, headers=cursor_headers(rows, limit, key))
+
+# -------------------- Conditional writes --------------------
+def conditional(write, not_found: str, response: Response = None):
+    try:
+        row = write()
+    except crud.VersionMismatch as e:
+        raise HTTPException(status_code=412, detail=str(e), headers={"ETag": etag(e.version)})
+    except crud.WriteRejected as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if row is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    if response is not None:
+        response.headers["ETag"] = etag(row.version)
+    return row
+
+# -------------------- Idempotency --------------------
+IdempotencyKey = Header(None, alias="Idempotency-Key", max_length=idempotency.MAX_KEY_LENGTH)
+
+def idempotent(db: Session, key: Optional[str], route: str, payload, create, schema):
+    """
+    Run `create()` at most once per Idempotency-Key; a retry is answered with
+    the stored response and an Idempotent-Replayed header. The response is
+    stored just before create() commits (crud._commit), in its transaction.
+    """
+    if key is None:
+        return create()
+    try:
+        stored = idempotency.claim(db, key, route, payload)
+    except idempotency.KeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except idempotency.InProgress as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "1"})
+    if stored is not None:
+        return JSONResponse(stored, headers={"Idempotent-Replayed": "true"})
+    db.info["before_commit"] = lambda created: idempotency.store(db, key, jsonable_encoder(schema.from_orm(created)))
+    try:
+        return create()
+    finally:
+        db.info.pop("before_commit", None)
+
 # ==================== AI QUERY ====================
 
 class AIQuery(BaseModel):
     question: str
+    mode: Optional[str] = None
 
 @app.post("/ai/query")
-def ai_query(payload: AIQuery):
+async def ai_query(payload: AIQuery):
     """
     Natural language → SQL → Answer
     """
-    answer = run_query(payload.question)
-    return {"answer": answer}
+    key = (ai_cache.normalize(payload.question), payload.mode)
+    try:
+        return await ai_pool.executor.run(run_query, payload.question, payload.mode, key=key)
+    except ai_pool.Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="AI query timed out")
+
+async def server_sent_events(events):
+    try:
+        async for name, data in events:
+            yield f"event: {name}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+    except asyncio.TimeoutError:
+        yield f"event: error\ndata: {json.dumps('AI query timed out')}\n\n"
+
+@app.post("/ai/query/stream")
+def ai_query_stream(payload: AIQuery):
+    """
+    Natural language → SQL → rows → answer, as Server-Sent Events
+    """
+    try:
+        ai_pool.executor.check()
+    except ai_pool.Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    return StreamingResponse(
+        server_sent_events(ai_pool.executor.stream(stream_query, payload.question, payload.mode)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/ai/cache/stats")
+def ai_cache_stats():
+    return ai_cache.answers.stats()
+
+@app.get("/ai/stats")
+def ai_stats():
+    return ai_pool.executor.stats()
 
 # -------------------- Root --------------------
 @app.get("/")
 def root():
     return {"message": "E-commerce API is running!"}
 
+@app.get("/cache/stats")
+def cache_stats():
+    return cache.stats()
+
+@app.get("/db/replicas")
+def replica_status():
+    return [replica.status() for replica in database.replicas]
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(instrumentation.render(), media_type="text/plain; version=0.0.4")
+
 # -------------------- Users --------------------
-@app.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    user = crud.get_user(db, user_id)
+@app.get("/users/{user_id}", response_model=schemas.UserDetail, response_model_exclude_unset=True)
+def read_user(user_id: int, response: Response, expand: tuple = Depends(expand_param(models.User)), db: Session = Depends(get_db)):
+    user = crud.get_user(db, user_id, expand)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    response.headers["ETag"] = etag(user.version)
     return user
 
-@app.get("/users", response_model=list[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_users(db, skip=skip, limit=limit)
+@app.get("/users", response_model=list[schemas.UserDetail], response_model_exclude_unset=True)
+def read_users(response: Response, skip: int = 0, limit: int = 100, after: Optional[int] = Depends(cursor_key), expand: tuple = Depends(expand_param(models.User)), fast: bool = Depends(fast_json), db: Session = Depends(get_db)):
+    if fast and not expand:
+        return fast_page(db, models.User, schemas.User, "user_id", skip, limit, after)
+    rows = crud.get_users(db, skip=skip, limit=limit, after=after, expand=expand)
+    return paginated(response, rows, limit, "user_id")
+
+@app.post("/users/bulk", response_model=list[schemas.BulkResult])
+def bulk_create_users(users: list[schemas.UserCreate], db: Session = Depends(get_db)):
+    return crud.bulk_create_users(db, [user.dict() for user in users])
 
 @app.post("/users", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    created = crud.create_user(db, **user.dict())
+def create_user(user: schemas.UserCreate, idempotency_key: Optional[str] = IdempotencyKey, db: Session = Depends(get_db)):
+    created = idempotent(db, idempotency_key, "users", user.dict(), lambda: crud.create_user(db, **user.dict()), schemas.User)
     if not created:
         raise HTTPException(status_code=400, detail="User already exists or error occurred")
     return created
 
 @app.put("/users/{user_id}", response_model=schemas.User)
-def update_user(user_id: int, user: schemas.UserCreate, db: Session = Depends(get_db)):
-    updated = crud.update_user(db, user_id, **user.dict())
-    if not updated:
-        raise HTTPException(status_code=404, detail="User not found")
-    return updated
+def update_user(user_id: int, user: schemas.UserCreate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.patch_user(db, user_id, version, **user.dict()), "User not found", response)
+
+@app.patch("/users/{user_id}", response_model=schemas.User)
+def patch_user(user_id: int, user: schemas.UserUpdate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.patch_user(db, user_id, version, **changes(user)), "User not found", response)
 
 @app.delete("/users/{user_id}", response_model=schemas.User)
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    deleted = crud.delete_user(db, user_id)
-    if not deleted:
-        raise HTTPException(status_code=404, detail="User not found")
-    return deleted
+def delete_user(user_id: int, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.delete_user(db, user_id, version), "User not found")
 
 # -------------------- Categories --------------------
-@app.get("/categories/{category_id}", response_model=schemas.Category)
-def read_category(category_id: int, db: Session = Depends(get_db)):
-    category = crud.get_category(db, category_id)
+@app.get("/categories/{category_id}", response_model=schemas.CategoryDetail, response_model_exclude_unset=True)
+def read_category(category_id: int, response: Response, expand: tuple = Depends(expand_param(models.Category)), db: Session = Depends(get_db)):
+    category = crud.get_category(db, category_id, expand)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
+    response.headers["ETag"] = etag(category.version)
     return category
 
-@app.get("/categories", response_model=list[schemas.Category])
-def read_categories(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_categories(db, skip=skip, limit=limit)
+@app.get("/categories", response_model=list[schemas.CategoryDetail], response_model_exclude_unset=True)
+def read_categories(request: Request, response: Response, skip: int = 0, limit: int = 100, after: Optional[int] = Depends(cursor_key), expand: tuple = Depends(expand_param(models.Category)), fast: bool = Depends(fast_json), db: Session = Depends(get_db)):
+    # Expanded responses mix rows from several tables, so only the plain shape is cached
+    if expand:
+        rows = crud.get_categories(db, skip=skip, limit=limit, after=after, expand=expand)
+        return paginated(response, rows, limit, "category_id")
+    def load():
+        if fast:
+            columns = fastjson.columns(models.Category, schemas.Category)
+            rows = crud.get_rows(db, columns, models.Category.category_id, skip, limit, after)
+            return rows, cursor_headers(rows, limit, "category_id")
+        rows = crud.get_categories(db, skip=skip, limit=limit, after=after)
+        return [schemas.Category.from_orm(row) for row in rows], cursor_headers(rows, limit, "category_id")
+    return cached(request, db, cache.list_key("categories", skip, limit, after), load, trusted=fast)
 
 @app.post("/categories", response_model=schemas.Category)
-def create_category(category: schemas.CategoryCreate, db: Session = Depends(get_db)):
-    return crud.create_category(db, **category.dict())
+def create_category(category: schemas.CategoryCreate, idempotency_key: Optional[str] = IdempotencyKey, db: Session = Depends(get_db)):
+    return idempotent(db, idempotency_key, "categories", category.dict(), lambda: crud.create_category(db, **category.dict()), schemas.Category)
 
 @app.put("/categories/{category_id}", response_model=schemas.Category)
-def update_category(category_id: int, category: schemas.CategoryCreate, db: Session = Depends(get_db)):
-    updated = crud.update_category(db, category_id, **category.dict())
-    if not updated:
-        raise HTTPException(status_code=404, detail="Category not found")
-    return updated
+def update_category(category_id: int, category: schemas.CategoryCreate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.patch_category(db, category_id, version, **category.dict()), "Category not found", response)
+
+@app.patch("/categories/{category_id}", response_model=schemas.Category)
+def patch_category(category_id: int, category: schemas.CategoryUpdate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.patch_category(db, category_id, version, **changes(category)), "Category not found", response)
 
 @app.delete("/categories/{category_id}", response_model=schemas.Category)
-def delete_category(category_id: int, db: Session = Depends(get_db)):
-    deleted = crud.delete_category(db, category_id)
-    if not deleted:
-        raise HTTPException(status_code=404, detail="Category not found")
-    return deleted
+def delete_category(category_id: int, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.delete_category(db, category_id, version), "Category not found")
 
 # -------------------- Products --------------------
-@app.get("/products/{product_id}", response_model=schemas.Product)
-def read_product(product_id: int, db: Session = Depends(get_db)):
-    product = crud.get_product(db, product_id)
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return product
-
-@app.get("/products", response_model=list[schemas.Product])
-def read_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_products(db, skip=skip, limit=limit)
+def search_cursor(sort: str = "relevance", cursor: Optional[list] = Depends(cursor_values)):
+    # Search cursors carry the mode of the first page and the sort key
+    if sort not in crud.SEARCH_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(crud.SEARCH_SORTS)}")
+    if cursor is None:
+        return None
+    try:
+        mode, value, product_id = cursor
+        if mode not in ("fulltext", "fuzzy"):
+            raise ValueError(mode)
+        value = float(value) if sort == "relevance" else Decimal(str(value))
+        return mode == "fuzzy", (value, int(product_id))
+    except (ValueError, TypeError, InvalidOperation):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Declared before /products/{product_id} so "search" is not taken for an id
+@app.get("/products/search", response_model=schemas.ProductSearch)
+def search_products(response: Response, q: str, sort: str = "relevance", category_id: Optional[int] = None, min_price: Optional[float] = None, max_price: Optional[float] = None, in_stock: bool = False, min_rating: Optional[float] = None, limit: int = 20, cursor = Depends(search_cursor), db: Session = Depends(get_db)):
+    q = q.strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="q must not be empty")
+    filters = {"category_id": category_id, "min_price": min_price, "max_price": max_price, "in_stock": in_stock, "min_rating": min_rating}
+    fuzzy, after = cursor or (None, None)
+    rows, fuzzy = crud.search_products(db, q, sort, after, limit, fuzzy, **filters)
+    mode = "fuzzy" if fuzzy else "fulltext"
+    sort_key = (lambda row: row.score) if sort == "relevance" else (lambda row: row.Product.price)
+    cursor = next_cursor(rows, limit, lambda row: (mode, sort_key(row), row.Product.product_id))
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return {
+        "items": [schemas.SearchHit(**schemas.Product.from_orm(product).dict(), score=score) for product, score in rows],
+        "facets": crud.search_facets(db, q, fuzzy, **filters) if after is None else None,
+        "mode": mode,
+    }
+
+@app.get("/products/{product_id}", response_model=schemas.ProductDetail, response_model_exclude_unset=True)
+def read_product(product_id: int, request: Request, expand: tuple = Depends(expand_param(models.Product)), db: Session = Depends(get_db)):
+    def load():
+        product = crud.get_product(db, product_id, expand)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return product
+    if expand:
+        return load()
+    def load_with_etag():
+        product = load()
+        return schemas.Product.from_orm(product), {"ETag": etag(product.version)}
+    return cached(request, db, cache.key("products", product_id), load_with_etag)
+
+PRODUCT_SORT_KEYS = {None: ("product_id",), "rating": ("rating_avg", "product_id")}
+
+def product_cursor(sort: Optional[str] = None, cursor: Optional[list] = Depends(cursor_values)):
+    if sort not in PRODUCT_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(k for k in PRODUCT_SORT_KEYS if k)}")
+    if cursor is None:
+        return None
+    try:
+        if sort == "rating":
+            rating, product_id = cursor
+            return Decimal(str(rating)), int(product_id)
+        (product_id,) = cursor
+        return int(product_id)
+    except (ValueError, TypeError, InvalidOperation):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/products", response_model=list[schemas.ProductDetail], response_model_exclude_unset=True)
+def read_products(request: Request, response: Response, skip: int = 0, limit: int = 100, sort: Optional[str] = None, min_rating: Optional[float] = None, after = Depends(product_cursor), expand: tuple = Depends(expand_param(models.Product)), fast: bool = Depends(fast_json), db: Session = Depends(get_db)):
+    key = PRODUCT_SORT_KEYS[sort]
+    if expand:
+        rows = crud.get_products(db, skip=skip, limit=limit, after=after, expand=expand, sort=sort, min_rating=min_rating)
+        return paginated(response, rows, limit, key)
+    def load():
+        if fast:
+            columns = fastjson.columns(models.Product, schemas.Product)
+            rows = crud.get_product_rows(db, columns, skip=skip, limit=limit, after=after, sort=sort, min_rating=min_rating)
+            return rows, cursor_headers(rows, limit, key)
+        rows = crud.get_products(db, skip=skip, limit=limit, after=after, sort=sort, min_rating=min_rating)
+        return [schemas.Product.from_orm(row) for row in rows], cursor_headers(rows, limit, key)
+    return cached(request, db, cache.list_key("products", skip, limit, after, sort, min_rating), load, trusted=fast)
+
+@app.post("/products/bulk", response_model=list[schemas.BulkResult])
+def bulk_create_products(products: list[schemas.ProductCreate], db: Session = Depends(get_db)):
+    return crud.bulk_create_products(db, [product.dict() for product in products])
 
 @app.post("/products", response_model=schemas.Product)
-def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)):
-    return crud.create_product(db, **product.dict())
+def create_product(product: schemas.ProductCreate, idempotency_key: Optional[str] = IdempotencyKey, db: Session = Depends(get_db)):
+    return idempotent(db, idempotency_key, "products", product.dict(), lambda: crud.create_product(db, **product.dict()), schemas.Product)
 
 @app.put("/products/{product_id}", response_model=schemas.Product)
-def update_product(product_id: int, product: schemas.ProductCreate, db: Session = Depends(get_db)):
-    updated = crud.update_product(db, product_id, **product.dict())
-    if not updated:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return updated
+def update_product(product_id: int, product: schemas.ProductCreate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.patch_product(db, product_id, version, **product.dict()), "Product not found", response)
+
+@app.patch("/products/{product_id}", response_model=schemas.Product)
+def patch_product(product_id: int, product: schemas.ProductUpdate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    values = changes(product)
+    if "stock" in values and "stock_delta" in values:
+        raise HTTPException(status_code=400, detail="Send stock or stock_delta, not both")
+    return conditional(lambda: crud.patch_product(db, product_id, version, **values), "Product not found", response)
 
 @app.delete("/products/{product_id}", response_model=schemas.Product)
-def delete_product(product_id: int, db: Session = Depends(get_db)):
-    deleted = crud.delete_product(db, product_id)
-    if not deleted:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return deleted
+def delete_product(product_id: int, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.delete_product(db, product_id, version), "Product not found")
 
 # -------------------- Orders --------------------
-@app.get("/orders/{order_id}", response_model=schemas.Order)
-def read_order(order_id: int, db: Session = Depends(get_db)):
-    order = crud.get_order(db, order_id)
+@app.get("/orders/{order_id}", response_model=schemas.OrderDetail, response_model_exclude_unset=True)
+def read_order(order_id: int, response: Response, expand: tuple = Depends(expand_param(models.Order)), db: Session = Depends(get_db)):
+    order = crud.get_order(db, order_id, expand)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
+    response.headers["ETag"] = etag(order.version)
     return order
 
-@app.get("/orders", response_model=list[schemas.Order])
-def read_orders(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_orders(db, skip=skip, limit=limit)
+@app.get("/orders", response_model=list[schemas.OrderDetail], response_model_exclude_unset=True)
+def read_orders(response: Response, skip: int = 0, limit: int = 100, since: Optional[datetime] = None, until: Optional[datetime] = None, after: Optional[int] = Depends(cursor_key), expand: tuple = Depends(expand_param(models.Order)), fast: bool = Depends(fast_json), db: Session = Depends(get_db)):
+    # since/until on order_date limit the scan to the months they cover
+    if fast and not expand:
+        return fast_page(db, models.Order, schemas.Order, "order_id", skip, limit, after, crud.time_range(models.Order.order_date, since, until))
+    rows = crud.get_orders(db, skip=skip, limit=limit, after=after, expand=expand, since=since, until=until)
+    return paginated(response, rows, limit, "order_id")
+
+@app.post("/orders/bulk", response_model=list[schemas.BulkResult])
+def bulk_create_orders(orders: list[schemas.OrderCreate], db: Session = Depends(get_db)):
+    return crud.bulk_create_orders(db, [order.dict() for order in orders])
+
+@app.post("/orders/place", response_model=schemas.PlacedOrder)
+def place_order(order: schemas.OrderPlace, idempotency_key: Optional[str] = IdempotencyKey, db: Session = Depends(get_db)):
+    items = [item.dict() for item in order.items]
+    try:
+        placed = idempotent(db, idempotency_key, "orders/place", order.dict(), lambda: crud.place_order(db, order.user_id, items), schemas.PlacedOrder)
+    except crud.OrderRejected as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not placed:
+        raise HTTPException(status_code=400, detail="User not found or error occurred")
+    return placed
 
 @app.post("/orders", response_model=schemas.Order)
-def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db)):
-    return crud.create_order(db, **order.dict())
+def create_order(order: schemas.OrderCreate, idempotency_key: Optional[str] = IdempotencyKey, db: Session = Depends(get_db)):
+    return idempotent(db, idempotency_key, "orders", order.dict(), lambda: crud.create_order(db, **order.dict()), schemas.Order)
 
 @app.put("/orders/{order_id}", response_model=schemas.Order)
-def update_order(order_id: int, order: schemas.OrderCreate, db: Session = Depends(get_db)):
-    updated = crud.update_order(db, order_id, **order.dict())
-    if not updated:
-        raise HTTPException(status_code=404, detail="Order not found")
-    return updated
+def update_order(order_id: int, order: schemas.OrderCreate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.patch_order(db, order_id, version, **order.dict()), "Order not found", response)
+
+@app.patch("/orders/{order_id}", response_model=schemas.Order)
+def patch_order(order_id: int, order: schemas.OrderUpdate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.patch_order(db, order_id, version, **changes(order)), "Order not found", response)
 
 @app.delete("/orders/{order_id}", response_model=schemas.Order)
-def delete_order(order_id: int, db: Session = Depends(get_db)):
-    deleted = crud.delete_order(db, order_id)
-    if not deleted:
-        raise HTTPException(status_code=404, detail="Order not found")
-    return deleted
+def delete_order(order_id: int, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.delete_order(db, order_id, version), "Order not found")
 
 # -------------------- Order Items --------------------
-@app.get("/order_items/{order_item_id}", response_model=schemas.OrderItem)
-def read_order_item(order_item_id: int, db: Session = Depends(get_db)):
-    item = crud.get_order_item(db, order_item_id)
+@app.get("/order_items/{order_item_id}", response_model=schemas.OrderItemDetail, response_model_exclude_unset=True)
+def read_order_item(order_item_id: int, response: Response, expand: tuple = Depends(expand_param(models.OrderItem)), db: Session = Depends(get_db)):
+    item = crud.get_order_item(db, order_item_id, expand)
     if not item:
         raise HTTPException(status_code=404, detail="Order item not found")
+    response.headers["ETag"] = etag(item.version)
     return item
 
-@app.get("/order_items", response_model=list[schemas.OrderItem])
-def read_order_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_order_items(db, skip=skip, limit=limit)
+@app.get("/order_items", response_model=list[schemas.OrderItemDetail], response_model_exclude_unset=True)
+def read_order_items(response: Response, skip: int = 0, limit: int = 100, since: Optional[datetime] = None, until: Optional[datetime] = None, after: Optional[int] = Depends(cursor_key), expand: tuple = Depends(expand_param(models.OrderItem)), fast: bool = Depends(fast_json), db: Session = Depends(get_db)):
+    if fast and not expand:
+        return fast_page(db, models.OrderItem, schemas.OrderItem, "order_item_id", skip, limit, after, crud.time_range(models.OrderItem.created_at, since, until))
+    rows = crud.get_order_items(db, skip=skip, limit=limit, after=after, expand=expand, since=since, until=until)
+    return paginated(response, rows, limit, "order_item_id")
+
+@app.post("/order_items/bulk", response_model=list[schemas.BulkResult])
+def bulk_create_order_items(order_items: list[schemas.OrderItemCreate], db: Session = Depends(get_db)):
+    return crud.bulk_create_order_items(db, [item.dict() for item in order_items])
 
 @app.post("/order_items", response_model=schemas.OrderItem)
-def create_order_item(item: schemas.OrderItemCreate, db: Session = Depends(get_db)):
-    return crud.create_order_item(db, **item.dict())
+def create_order_item(item: schemas.OrderItemCreate, idempotency_key: Optional[str] = IdempotencyKey, db: Session = Depends(get_db)):
+    return idempotent(db, idempotency_key, "order_items", item.dict(), lambda: crud.create_order_item(db, **item.dict()), schemas.OrderItem)
 
 @app.put("/order_items/{order_item_id}", response_model=schemas.OrderItem)
-def update_order_item(order_item_id: int, item: schemas.OrderItemCreate, db: Session = Depends(get_db)):
-    updated = crud.update_order_item(db, order_item_id, **item.dict())
-    if not updated:
-        raise HTTPException(status_code=404, detail="Order item not found")
-    return updated
+def update_order_item(order_item_id: int, item: schemas.OrderItemCreate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.patch_order_item(db, order_item_id, version, **item.dict()), "Order item not found", response)
+
+@app.patch("/order_items/{order_item_id}", response_model=schemas.OrderItem)
+def patch_order_item(order_item_id: int, item: schemas.OrderItemUpdate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.patch_order_item(db, order_item_id, version, **changes(item)), "Order item not found", response)
 
 @app.delete("/order_items/{order_item_id}", response_model=schemas.OrderItem)
-def delete_order_item(order_item_id: int, db: Session = Depends(get_db)):
-    deleted = crud.delete_order_item(db, order_item_id)
-    if not deleted:
-        raise HTTPException(status_code=404, detail="Order item not found")
-    return deleted
+def delete_order_item(order_item_id: int, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.delete_order_item(db, order_item_id, version), "Order item not found")
 
 # -------------------- Reviews --------------------
-@app.get("/reviews/{review_id}", response_model=schemas.Review)
-def read_review(review_id: int, db: Session = Depends(get_db)):
-    review = crud.get_review(db, review_id)
+@app.get("/reviews/{review_id}", response_model=schemas.ReviewDetail, response_model_exclude_unset=True)
+def read_review(review_id: int, response: Response, expand: tuple = Depends(expand_param(models.Review)), db: Session = Depends(get_db)):
+    review = crud.get_review(db, review_id, expand)
     if not review:
         raise HTTPException(status_code=404, detail="Review not found")
+    response.headers["ETag"] = etag(review.version)
     return review
 
-@app.get("/reviews", response_model=list[schemas.Review])
-def read_reviews(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_reviews(db, skip=skip, limit=limit)
+@app.get("/reviews", response_model=list[schemas.ReviewDetail], response_model_exclude_unset=True)
+def read_reviews(response: Response, skip: int = 0, limit: int = 100, after: Optional[int] = Depends(cursor_key), expand: tuple = Depends(expand_param(models.Review)), fast: bool = Depends(fast_json), db: Session = Depends(get_db)):
+    if fast and not expand:
+        return fast_page(db, models.Review, schemas.Review, "review_id", skip, limit, after)
+    rows = crud.get_reviews(db, skip=skip, limit=limit, after=after, expand=expand)
+    return paginated(response, rows, limit, "review_id")
+
+@app.post("/reviews/bulk", response_model=list[schemas.BulkResult])
+def bulk_create_reviews(reviews: list[schemas.ReviewCreate], db: Session = Depends(get_db)):
+    return crud.bulk_create_reviews(db, [review.dict() for review in reviews])
 
 @app.post("/reviews", response_model=schemas.Review)
-def create_review(review: schemas.ReviewCreate, db: Session = Depends(get_db)):
-    created = crud.create_review(db, **review.dict())
+def create_review(review: schemas.ReviewCreate, idempotency_key: Optional[str] = IdempotencyKey, db: Session = Depends(get_db)):
+    created = idempotent(db, idempotency_key, "reviews", review.dict(), lambda: crud.create_review(db, **review.dict()), schemas.Review)
     if not created:
         raise HTTPException(status_code=400, detail="Review already exists or error occurred")
     return created
 
 @app.put("/reviews/{review_id}", response_model=schemas.Review)
-def update_review(review_id: int, review: schemas.ReviewCreate, db: Session = Depends(get_db)):
-    updated = crud.update_review(db, review_id, **review.dict())
-    if not updated:
-        raise HTTPException(status_code=404, detail="Review not found")
-    return updated
+def update_review(review_id: int, review: schemas.ReviewCreate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.patch_review(db, review_id, version, **review.dict()), "Review not found", response)
+
+@app.patch("/reviews/{review_id}", response_model=schemas.Review)
+def patch_review(review_id: int, review: schemas.ReviewUpdate, response: Response, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.patch_review(db, review_id, version, **changes(review)), "Review not found", response)
 
 @app.delete("/reviews/{review_id}", response_model=schemas.Review)
-def delete_review(review_id: int, db: Session = Depends(get_db)):
-    deleted = crud.delete_review(db, review_id)
-    if not deleted:
-        raise HTTPException(status_code=404, detail="Review not found")
-    return deleted
+def delete_review(review_id: int, version: Optional[int] = Depends(if_match), db: Session = Depends(get_db)):
+    return conditional(lambda: crud.delete_review(db, review_id, version), "Review not found")
+
+# ==================== ANALYTICS ====================
+# Served from the rollup tables, which lag the base tables by up to
+# ROLLUP_REFRESH_INTERVAL seconds
+
+@app.get("/analytics/top-products", response_model=list[schemas.ProductRevenue])
+def top_products(since: Optional[date] = None, until: Optional[date] = None, category_id: Optional[int] = None, limit: int = 10, db: Session = Depends(get_db)):
+    return crud.top_products(db, since, until, category_id, limit)
+
+@app.get("/analytics/revenue", response_model=list[schemas.RevenuePoint])
+def revenue(since: Optional[date] = None, until: Optional[date] = None, granularity: str = "day", category_id: Optional[int] = None, db: Session = Depends(get_db)):
+    if granularity not in ("day", "month"):
+        raise HTTPException(status_code=400, detail="granularity must be 'day' or 'month'")
+    return crud.revenue_series(db, since, until, granularity, category_id)
+
+@app.get("/analytics/category-ratings", response_model=list[schemas.CategoryRating])
+def category_ratings(db: Session = Depends(get_db)):
+    return crud.category_ratings(db)
 
+@app.get("/analytics/top-customers", response_model=list[schemas.CustomerStats])
+def top_customers(limit: int = 10, db: Session = Depends(get_db)):
+    return crud.top_customers(db, limit)
+
+@app.get("/analytics/status")
+def rollup_status(db: Session = Depends(get_db)):
+    return rollups.status(db)
+
+@app.post("/analytics/refresh")
+def refresh_rollups(full: bool = False, db: Session = Depends(get_db)):
+    return rollups.refresh(db, full)
+
+# ==================== EXPORT ====================
+
+@app.get("/export/{table}")
+def export_table(table: str, format: str = "ndjson", since: Optional[datetime] = None):
+    """
+    Stream a whole table as NDJSON, CSV or Parquet, optionally only the rows
+    at or after `since`
+    """
+    if table not in export.TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table {table}")
+    try:
+        chunks = export.stream(table, format, since)
+    except export.ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        chunks,
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
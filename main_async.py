@@ -0,0 +1,249 @@
+import asyncio
+from fastapi import FastAPI, Depends, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel
+from typing import Optional
+import ai_cache, ai_pool, async_crud as crud, instrumentation, schemas, server
+from async_database import async_engine, get_db
+from etags import changes, etag, if_match
+from pagination import cursor_key, paginated
+from sql_agent import run_query
+
+# Async mode: the basic CRUD routes of main.py served from an AsyncSession
+# pool, so a slow query no longer holds a threadpool worker.
+#   uvicorn main_async:app
+#   python server.py --app main_async:app --workers 4
+#
+# This is a limited subset of main.py, not a drop-in replacement: it has no
+# ?expand= or ?fast=, no bulk, /orders/place or /products/search routes, no
+# Idempotency-Key support on create routes, no response cache, analytics or
+# export, and every route uses the primary database. Use main.py for those.
+
+app = FastAPI(title="E-commerce API (async)", version="1.0", lifespan=server.lifespan(async_engine))
+app.add_middleware(instrumentation.Middleware)
+
+# -------------------- Conditional writes --------------------
+async def conditional(write, not_found: str, response: Response = None):
+    # As main.conditional, awaiting `write()`
+    try:
+        row = await write()
+    except crud.VersionMismatch as e:
+        raise HTTPException(status_code=412, detail=str(e), headers={"ETag": etag(e.version)})
+    except crud.WriteRejected as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if row is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    if response is not None:
+        response.headers["ETag"] = etag(row.version)
+    return row
+
+# ==================== AI QUERY ====================
+
+class AIQuery(BaseModel):
+    question: str
+    mode: Optional[str] = None
+
+@app.post("/ai/query")
+async def ai_query(payload: AIQuery):
+    """
+    Natural language → SQL → Answer
+    """
+    key = (ai_cache.normalize(payload.question), payload.mode)
+    try:
+        return await ai_pool.executor.run(run_query, payload.question, payload.mode, key=key)
+    except ai_pool.Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="AI query timed out")
+
+# -------------------- Root --------------------
+@app.get("/")
+async def root():
+    return {"message": "E-commerce API is running!"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(instrumentation.render(), media_type="text/plain; version=0.0.4")
+
+# -------------------- Users --------------------
+@app.get("/users/{user_id}", response_model=schemas.User)
+async def read_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    user = await crud.get_user(db, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+@app.get("/users", response_model=list[schemas.User])
+async def read_users(response: Response, skip: int = 0, limit: int = 100, after: Optional[int] = Depends(cursor_key), db: AsyncSession = Depends(get_db)):
+    rows = await crud.get_users(db, skip=skip, limit=limit, after=after)
+    return paginated(response, rows, limit, "user_id")
+
+@app.post("/users", response_model=schemas.User)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    created = await crud.create_user(db, **user.dict())
+    if not created:
+        raise HTTPException(status_code=400, detail="User already exists or error occurred")
+    return created
+
+@app.put("/users/{user_id}", response_model=schemas.User)
+async def update_user(user_id: int, user: schemas.UserCreate, response: Response, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.patch_user(db, user_id, version, **user.dict()), "User not found", response)
+
+@app.patch("/users/{user_id}", response_model=schemas.User)
+async def patch_user(user_id: int, user: schemas.UserUpdate, response: Response, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.patch_user(db, user_id, version, **changes(user)), "User not found", response)
+
+@app.delete("/users/{user_id}", response_model=schemas.User)
+async def delete_user(user_id: int, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.delete_user(db, user_id, version), "User not found")
+
+# -------------------- Categories --------------------
+@app.get("/categories/{category_id}", response_model=schemas.Category)
+async def read_category(category_id: int, db: AsyncSession = Depends(get_db)):
+    category = await crud.get_category(db, category_id)
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return category
+
+@app.get("/categories", response_model=list[schemas.Category])
+async def read_categories(response: Response, skip: int = 0, limit: int = 100, after: Optional[int] = Depends(cursor_key), db: AsyncSession = Depends(get_db)):
+    rows = await crud.get_categories(db, skip=skip, limit=limit, after=after)
+    return paginated(response, rows, limit, "category_id")
+
+@app.post("/categories", response_model=schemas.Category)
+async def create_category(category: schemas.CategoryCreate, db: AsyncSession = Depends(get_db)):
+    return await crud.create_category(db, **category.dict())
+
+@app.put("/categories/{category_id}", response_model=schemas.Category)
+async def update_category(category_id: int, category: schemas.CategoryCreate, response: Response, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.patch_category(db, category_id, version, **category.dict()), "Category not found", response)
+
+@app.patch("/categories/{category_id}", response_model=schemas.Category)
+async def patch_category(category_id: int, category: schemas.CategoryUpdate, response: Response, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.patch_category(db, category_id, version, **changes(category)), "Category not found", response)
+
+@app.delete("/categories/{category_id}", response_model=schemas.Category)
+async def delete_category(category_id: int, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.delete_category(db, category_id, version), "Category not found")
+
+# -------------------- Products --------------------
+@app.get("/products/{product_id}", response_model=schemas.Product)
+async def read_product(product_id: int, db: AsyncSession = Depends(get_db)):
+    product = await crud.get_product(db, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return product
+
+@app.get("/products", response_model=list[schemas.Product])
+async def read_products(response: Response, skip: int = 0, limit: int = 100, after: Optional[int] = Depends(cursor_key), db: AsyncSession = Depends(get_db)):
+    rows = await crud.get_products(db, skip=skip, limit=limit, after=after)
+    return paginated(response, rows, limit, "product_id")
+
+@app.post("/products", response_model=schemas.Product)
+async def create_product(product: schemas.ProductCreate, db: AsyncSession = Depends(get_db)):
+    return await crud.create_product(db, **product.dict())
+
+@app.put("/products/{product_id}", response_model=schemas.Product)
+async def update_product(product_id: int, product: schemas.ProductCreate, response: Response, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.patch_product(db, product_id, version, **product.dict()), "Product not found", response)
+
+@app.patch("/products/{product_id}", response_model=schemas.Product)
+async def patch_product(product_id: int, product: schemas.ProductUpdate, response: Response, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    values = changes(product)
+    if "stock" in values and "stock_delta" in values:
+        raise HTTPException(status_code=400, detail="Send stock or stock_delta, not both")
+    return await conditional(lambda: crud.patch_product(db, product_id, version, **values), "Product not found", response)
+
+@app.delete("/products/{product_id}", response_model=schemas.Product)
+async def delete_product(product_id: int, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.delete_product(db, product_id, version), "Product not found")
+
+# -------------------- Orders --------------------
+@app.get("/orders/{order_id}", response_model=schemas.Order)
+async def read_order(order_id: int, db: AsyncSession = Depends(get_db)):
+    order = await crud.get_order(db, order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
+
+@app.get("/orders", response_model=list[schemas.Order])
+async def read_orders(response: Response, skip: int = 0, limit: int = 100, after: Optional[int] = Depends(cursor_key), db: AsyncSession = Depends(get_db)):
+    rows = await crud.get_orders(db, skip=skip, limit=limit, after=after)
+    return paginated(response, rows, limit, "order_id")
+
+@app.post("/orders", response_model=schemas.Order)
+async def create_order(order: schemas.OrderCreate, db: AsyncSession = Depends(get_db)):
+    return await crud.create_order(db, **order.dict())
+
+@app.put("/orders/{order_id}", response_model=schemas.Order)
+async def update_order(order_id: int, order: schemas.OrderCreate, response: Response, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.patch_order(db, order_id, version, **order.dict()), "Order not found", response)
+
+@app.patch("/orders/{order_id}", response_model=schemas.Order)
+async def patch_order(order_id: int, order: schemas.OrderUpdate, response: Response, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.patch_order(db, order_id, version, **changes(order)), "Order not found", response)
+
+@app.delete("/orders/{order_id}", response_model=schemas.Order)
+async def delete_order(order_id: int, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.delete_order(db, order_id, version), "Order not found")
+
+# -------------------- Order Items --------------------
+@app.get("/order_items/{order_item_id}", response_model=schemas.OrderItem)
+async def read_order_item(order_item_id: int, db: AsyncSession = Depends(get_db)):
+    item = await crud.get_order_item(db, order_item_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Order item not found")
+    return item
+
+@app.get("/order_items", response_model=list[schemas.OrderItem])
+async def read_order_items(response: Response, skip: int = 0, limit: int = 100, after: Optional[int] = Depends(cursor_key), db: AsyncSession = Depends(get_db)):
+    rows = await crud.get_order_items(db, skip=skip, limit=limit, after=after)
+    return paginated(response, rows, limit, "order_item_id")
+
+@app.post("/order_items", response_model=schemas.OrderItem)
+async def create_order_item(item: schemas.OrderItemCreate, db: AsyncSession = Depends(get_db)):
+    return await crud.create_order_item(db, **item.dict())
+
+@app.put("/order_items/{order_item_id}", response_model=schemas.OrderItem)
+async def update_order_item(order_item_id: int, item: schemas.OrderItemCreate, response: Response, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.patch_order_item(db, order_item_id, version, **item.dict()), "Order item not found", response)
+
+@app.patch("/order_items/{order_item_id}", response_model=schemas.OrderItem)
+async def patch_order_item(order_item_id: int, item: schemas.OrderItemUpdate, response: Response, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.patch_order_item(db, order_item_id, version, **changes(item)), "Order item not found", response)
+
+@app.delete("/order_items/{order_item_id}", response_model=schemas.OrderItem)
+async def delete_order_item(order_item_id: int, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.delete_order_item(db, order_item_id, version), "Order item not found")
+
+# -------------------- Reviews --------------------
+@app.get("/reviews/{review_id}", response_model=schemas.Review)
+async def read_review(review_id: int, db: AsyncSession = Depends(get_db)):
+    review = await crud.get_review(db, review_id)
+    if not review:
+        raise HTTPException(status_code=404, detail="Review not found")
+    return review
+
+@app.get("/reviews", response_model=list[schemas.Review])
+async def read_reviews(response: Response, skip: int = 0, limit: int = 100, after: Optional[int] = Depends(cursor_key), db: AsyncSession = Depends(get_db)):
+    rows = await crud.get_reviews(db, skip=skip, limit=limit, after=after)
+    return paginated(response, rows, limit, "review_id")
+
+@app.post("/reviews", response_model=schemas.Review)
+async def create_review(review: schemas.ReviewCreate, db: AsyncSession = Depends(get_db)):
+    created = await crud.create_review(db, **review.dict())
+    if not created:
+        raise HTTPException(status_code=400, detail="Review already exists or error occurred")
+    return created
+
+@app.put("/reviews/{review_id}", response_model=schemas.Review)
+async def update_review(review_id: int, review: schemas.ReviewCreate, response: Response, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.patch_review(db, review_id, version, **review.dict()), "Review not found", response)
+
+@app.patch("/reviews/{review_id}", response_model=schemas.Review)
+async def patch_review(review_id: int, review: schemas.ReviewUpdate, response: Response, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.patch_review(db, review_id, version, **changes(review)), "Review not found", response)
+
+@app.delete("/reviews/{review_id}", response_model=schemas.Review)
+async def delete_review(review_id: int, version: Optional[int] = Depends(if_match), db: AsyncSession = Depends(get_db)):
+    return await conditional(lambda: crud.delete_review(db, review_id, version), "Review not found")
@@ -0,0 +1,71 @@
+"""
+Versioned schema migrations.
+
+Each vNNNN_*.py module in this package defines upgrade(conn). Applied
+versions are recorded in the schema_migrations table, and pending ones run in
+version order. A module that sets TRANSACTIONAL = False runs in autocommit
+mode, which CREATE INDEX CONCURRENTLY requires.
+
+    python -m migrations            # apply pending migrations
+    python -m migrations status     # list applied and pending versions
+"""
+import importlib
+import pkgutil
+from sqlalchemy import inspect, text
+
+def available():
+    return sorted(
+        name for _, name, _ in pkgutil.iter_modules(__path__)
+        if name.startswith("v") and name[1:5].isdigit()
+    )
+
+def applied(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR(100) PRIMARY KEY, "
+            "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def pending(engine):
+    done = applied(engine)
+    return [name for name in available() if name not in done]
+
+def upgrade(engine):
+    for name in pending(engine):
+        module = importlib.import_module(f"{__name__}.{name}")
+        if getattr(module, "TRANSACTIONAL", True):
+            with engine.begin() as conn:
+                module.upgrade(conn)
+        else:
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                module.upgrade(conn)
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:version)"), {"version": name})
+        print(f"Applied migration {name}")
+
+# -------------------- Helpers --------------------
+def is_postgres(conn) -> bool:
+    return conn.dialect.name == "postgresql"
+
+def create_index(conn, name: str, table: str, columns: str, where: str = None, unique: bool = False, using: str = None):
+    """
+    CREATE INDEX IF NOT EXISTS, built CONCURRENTLY on PostgreSQL so the
+    table stays writable while a large index builds.
+    """
+    autocommit = conn.get_execution_options().get("isolation_level") == "AUTOCOMMIT"
+    concurrently = " CONCURRENTLY" if is_postgres(conn) and autocommit else ""
+    method = f" USING {using}" if using else ""
+    sql = f"CREATE {'UNIQUE ' if unique else ''}INDEX{concurrently} IF NOT EXISTS {name} ON {table}{method} ({columns})"
+    if where:
+        sql += f" WHERE {where}"
+    conn.execute(text(sql))
+
+def add_column(conn, table: str, column: str, ddl: str):
+    """
+    ALTER TABLE ... ADD COLUMN unless it exists; `ddl` is the type and
+    constraints, e.g. "INTEGER NOT NULL DEFAULT 0".
+    """
+    if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
@@ -0,0 +1,11 @@
+import sys
+import migrations
+from database import engine
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["status"]:
+        done = migrations.applied(engine)
+        for name in migrations.available():
+            print(f"{'applied' if name in done else 'pending':<8} {name}")
+    else:
+        migrations.upgrade(engine)
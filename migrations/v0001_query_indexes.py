@@ -0,0 +1,39 @@
+"""
+Indexes for the foreign-key joins and filters the API and the SQL agent run,
+plus the reviews (user_id, product_id) uniqueness crud.create_review and the
+bulk upsert rely on.
+
+reviews.product_id gets no index of its own: the (product_id, created_at)
+index serves product lookups as its leading column.
+"""
+from sqlalchemy import text
+from migrations import create_index, is_postgres
+
+TRANSACTIONAL = False
+
+def upgrade(conn):
+    create_index(conn, "ix_orders_user_id", "orders", "user_id")
+    create_index(conn, "ix_orders_order_date", "orders", "order_date")
+    create_index(conn, "ix_orders_status", "orders", "status")
+    create_index(conn, "ix_orders_pending_order_date", "orders", "order_date", where="status = 'pending'")
+    create_index(conn, "ix_order_items_order_id", "order_items", "order_id")
+    create_index(conn, "ix_order_items_product_id", "order_items", "product_id")
+    create_index(conn, "ix_products_category_id", "products", "category_id")
+    create_index(conn, "ix_reviews_product_id_created_at", "reviews", "product_id, created_at")
+
+    duplicates = conn.execute(text(
+        "SELECT count(*) FROM (SELECT 1 FROM reviews GROUP BY user_id, product_id HAVING count(*) > 1) d"
+    )).scalar()
+    if duplicates:
+        raise RuntimeError(
+            f"{duplicates} (user_id, product_id) pairs have more than one review; "
+            "remove the duplicates before adding uq_reviews_user_product"
+        )
+    create_index(conn, "uq_reviews_user_product", "reviews", "user_id, product_id", unique=True)
+    if is_postgres(conn):
+        conn.execute(text(
+            "DO $$ BEGIN "
+            "IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_reviews_user_product') THEN "
+            "ALTER TABLE reviews ADD CONSTRAINT uq_reviews_user_product UNIQUE USING INDEX uq_reviews_user_product; "
+            "END IF; END $$"
+        ))
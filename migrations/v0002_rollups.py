@@ -0,0 +1,25 @@
+"""
+Summary tables for rollups.py, plus their rollup_state rows. The rows start
+out stale, so the first refresh builds every rollup in full.
+"""
+from sqlalchemy import text
+import models
+
+TABLES = [
+    models.DailyProductRevenue,
+    models.ProductRatingStats,
+    models.UserOrderStats,
+    models.RollupState,
+]
+
+def upgrade(conn):
+    for model in TABLES:
+        model.__table__.create(conn, checkfirst=True)
+    for model in TABLES[:-1]:
+        conn.execute(
+            text(
+                "INSERT INTO rollup_state (name, watermark, stale) "
+                "SELECT :name, 0, TRUE WHERE NOT EXISTS (SELECT 1 FROM rollup_state WHERE name = :name)"
+            ),
+            {"name": model.__tablename__},
+        )
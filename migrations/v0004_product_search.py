@@ -0,0 +1,28 @@
+"""
+Product search (crud.search_products). PostgreSQL only: products gets a
+generated, weighted tsvector over name (A) and description (B) with a GIN
+index, and a trigram GIN index on name for the typo fallback. These stay out
+of models.py because neither type exists on the SQLite stand-ins, which
+search with LIKE instead.
+
+(price, product_id) backs the price sorts on every backend.
+"""
+from sqlalchemy import text
+from migrations import create_index, is_postgres
+
+TRANSACTIONAL = False
+
+def upgrade(conn):
+    create_index(conn, "ix_products_price", "products", "price, product_id")
+    if not is_postgres(conn):
+        return
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(text(
+        "ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+        ") STORED"
+    ))
+    create_index(conn, "ix_products_search_vector", "products", "search_vector", using="gin")
+    create_index(conn, "ix_products_name_trgm", "products", "name gin_trgm_ops", using="gin")
@@ -0,0 +1,24 @@
+"""
+Row versions behind ETag / If-Match on PATCH, PUT and DELETE, and the
+idempotency_keys table behind the Idempotency-Key header on create routes.
+
+ADD COLUMN with a constant default only touches the catalog on PostgreSQL
+11+, so existing rows start at version 1 without rewriting the tables.
+"""
+from sqlalchemy import text
+from migrations import add_column, create_index
+
+TABLES = ("users", "categories", "products", "orders", "order_items", "reviews")
+
+def upgrade(conn):
+    for table in TABLES:
+        add_column(conn, table, "version", "INTEGER NOT NULL DEFAULT 1")
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+        "key VARCHAR(200) PRIMARY KEY, "
+        "route VARCHAR(100) NOT NULL, "
+        "request_hash VARCHAR(64) NOT NULL, "
+        "response TEXT, "
+        "created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP)"
+    ))
+    create_index(conn, "ix_idempotency_keys_created_at", "idempotency_keys", "created_at")
@@ -0,0 +1,150 @@
+"""
+Monthly range partitioning of orders (by order_date) and order_items (by a
+new created_at column, filled from the order's date), as partitions.py
+describes. PostgreSQL only; SQLite just gets the created_at column.
+
+A partitioned table's unique constraints must include the partition key, so
+the primary keys become (order_id, order_date) and (order_item_id,
+created_at), with ids still drawn from the same sequences, and
+order_items.order_id loses its foreign key to orders: orders.order_id alone
+is no longer unique to the database. The API and bulk_import still check
+it (crud writes items with their order, _delete nulls them, bulk_import
+validates against models.py), but SQL run outside them can leave items
+pointing at no order. Orders with no order_date stop the migration. reviews stays a plain
+table: its (user_id, product_id) uniqueness, which crud and bulk_import
+upsert on, cannot be enforced across partitions.
+
+Rows are copied in BATCH_SIZE id ranges into new partitioned tables, which
+get the old tables' indexes and foreign keys before they replace them in one
+transaction. Rows inserted meanwhile are copied under a lock during the
+swap, but updates and deletes of rows already copied are not, so run this
+with writes to orders and order_items stopped.
+"""
+from datetime import date
+from sqlalchemy import inspect, text
+from migrations import add_column, is_postgres
+import partitions
+
+TRANSACTIONAL = False
+
+BATCH_SIZE = 500000
+
+# table -> id column the copy walks
+KEYS = {"orders": "order_id", "order_items": "order_item_id"}
+
+def _index_ddl(conn, table: str) -> list:
+    # Every index but the primary key, as CREATE INDEX statements
+    return [row[0] for row in conn.execute(text(
+        "SELECT pg_get_indexdef(indexrelid) FROM pg_index "
+        "WHERE indrelid = CAST(:table AS regclass) AND NOT indisprimary"
+    ), {"table": table})]
+
+def _copy_sql(conn, table: str) -> str:
+    """
+    INSERT ... SELECT of an id range (:low, :high] into the new table. Items
+    take their order's date as created_at, so an order and its items land in
+    the same month.
+    """
+    columns = [c["name"] for c in inspect(conn).get_columns(table) if c["name"] != "created_at" or table != "order_items"]
+    names = ", ".join(columns)
+    source = ", ".join(f"s.{name}" for name in columns)
+    if table == "order_items":
+        return (
+            f"INSERT INTO order_items_partitioned ({names}, created_at) "
+            f"SELECT {source}, COALESCE(o.order_date, now()) FROM order_items s LEFT JOIN orders o ON o.order_id = s.order_id "
+            "WHERE s.order_item_id > :low AND s.order_item_id <= :high"
+        )
+    return f"INSERT INTO {table}_partitioned ({names}) SELECT {source} FROM {table} s WHERE s.{KEYS[table]} > :low AND s.{KEYS[table]} <= :high"
+
+def _index_on_new_table(ddl: str) -> str:
+    # "CREATE INDEX ix ON public.orders USING ..." -> "... ix_new ON public.orders_partitioned USING ..."
+    head, tail = ddl.split(" ON ", 1)
+    qualified, rest = tail.split(" ", 1)
+    return f"{head}_new ON {qualified}_partitioned {rest}"
+
+def upgrade(conn):
+    if not is_postgres(conn):
+        add_column(conn, "order_items", "created_at", "TIMESTAMP")
+        return
+    if partitions.is_partitioned(conn, "orders"):
+        return
+
+    # order_date becomes part of the primary key; a made-up date would put
+    # the order in the wrong month of every report
+    missing = conn.execute(text("SELECT count(*) FROM orders WHERE order_date IS NULL")).scalar()
+    if missing:
+        raise RuntimeError(
+            f"{missing} orders have no order_date. Set their real dates (or delete them) "
+            "before partitioning: SELECT order_id FROM orders WHERE order_date IS NULL"
+        )
+    first = conn.execute(text("SELECT min(order_date) FROM orders")).scalar()
+    this_month = partitions.month_start(date.today())
+    first = partitions.month_start(first.date()) if first else this_month
+    last = partitions.add_months(this_month, partitions.PARTITION_MONTHS_AHEAD)
+
+    # Left over from an interrupted run: start again from scratch
+    for table in KEYS:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table}_partitioned CASCADE"))
+    conn.execute(text(
+        "CREATE TABLE orders_partitioned (LIKE orders INCLUDING DEFAULTS) PARTITION BY RANGE (order_date)"
+    ))
+    # Databases created from the current models already have the column
+    created_at = "" if "created_at" in {c["name"] for c in inspect(conn).get_columns("order_items")} \
+        else ", created_at TIMESTAMP WITH TIME ZONE DEFAULT now()"
+    conn.execute(text(
+        f"CREATE TABLE order_items_partitioned (LIKE order_items INCLUDING DEFAULTS{created_at}) PARTITION BY RANGE (created_at)"
+    ))
+    for table in partitions.PARTITIONED:
+        partitions.create_partitions(conn, table, first, last, parent=f"{table}_partitioned")
+
+    copied = {}
+    copies = {table: text(_copy_sql(conn, table)) for table in KEYS}
+    for table, key in KEYS.items():
+        high = conn.execute(text(f"SELECT COALESCE(MAX({key}), 0) FROM {table}")).scalar()
+        for low in range(0, high, BATCH_SIZE):
+            conn.execute(copies[table], {"low": low, "high": min(low + BATCH_SIZE, high)})
+            print(f"  {table}: copied ids up to {min(low + BATCH_SIZE, high)}/{high}", flush=True)
+        copied[table] = high
+
+    # Keys, foreign keys and indexes are built on the new tables while the
+    # old ones still serve traffic; indexes get a _new suffix until the swap.
+    # The primary keys also make the partition columns NOT NULL
+    conn.execute(text("ALTER TABLE orders_partitioned ADD PRIMARY KEY (order_id, order_date)"))
+    conn.execute(text("ALTER TABLE order_items_partitioned ADD PRIMARY KEY (order_item_id, created_at)"))
+    conn.execute(text("ALTER TABLE orders_partitioned ADD FOREIGN KEY (user_id) REFERENCES users (user_id)"))
+    conn.execute(text("ALTER TABLE order_items_partitioned ADD FOREIGN KEY (product_id) REFERENCES products (product_id)"))
+    renames = []
+    for table in KEYS:
+        for ddl in _index_ddl(conn, table):
+            if "ix_order_items_created_at" in ddl:
+                continue
+            conn.execute(text(_index_on_new_table(ddl)))
+            renames.append(ddl.split(" ON ", 1)[0].split()[-1])
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_order_items_created_at_new ON order_items_partitioned (created_at)"
+    ))
+    renames.append("ix_order_items_created_at")
+
+    with conn.engine.begin() as swap:
+        swap.execute(text("LOCK TABLE orders, order_items IN EXCLUSIVE MODE"))
+        for table, key in KEYS.items():
+            high = swap.execute(text(f"SELECT COALESCE(MAX({key}), 0) FROM {table}")).scalar()
+            if high > copied[table]:
+                swap.execute(copies[table], {"low": copied[table], "high": high})
+            sequence = swap.execute(text(f"SELECT pg_get_serial_sequence('{table}', '{key}')")).scalar()
+            swap.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}_partitioned.{key}"))
+        swap.execute(text("DROP TABLE order_items"))
+        swap.execute(text("DROP TABLE orders"))
+        for table in KEYS:
+            swap.execute(text(f"ALTER TABLE {table}_partitioned RENAME TO {table}"))
+            constraints = swap.execute(
+                text("SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass) AND conname LIKE :prefix"),
+                {"table": table, "prefix": f"{table}\\_partitioned\\_%"},
+            ).scalars().all()
+            for name in constraints:
+                swap.execute(text(f"ALTER TABLE {table} RENAME CONSTRAINT {name} TO {name.replace(f'{table}_partitioned_', f'{table}_', 1)}"))
+        for name in renames:
+            swap.execute(text(f"ALTER INDEX {name}_new RENAME TO {name}"))
+
+    for table in KEYS:
+        conn.execute(text(f"ANALYZE {table}"))
@@ -0,0 +1,12 @@
+"""
+rollup_changes, the queue of rollup groups touched by updates and deletes
+that rollups.refresh recomputes, and the pending watermark rollup_state
+holds back until late-committing inserts below it have settled.
+"""
+import models
+from migrations import add_column, is_postgres
+
+def upgrade(conn):
+    models.RollupChange.__table__.create(conn, checkfirst=True)
+    add_column(conn, "rollup_state", "pending_watermark", "BIGINT")
+    add_column(conn, "rollup_state", "pending_since", "TIMESTAMP WITH TIME ZONE" if is_postgres(conn) else "TIMESTAMP")
@@ -0,0 +1,19 @@
+"""
+cache_generations, through which jobs run outside the servers (bulk_import,
+reconcile_ratings.py, rollups.py) tell every worker to flush its caches for
+a table; see cache.publish. One row per table, starting at 0.
+"""
+from sqlalchemy import text
+from database import Base
+import models
+
+def upgrade(conn):
+    models.CacheGeneration.__table__.create(conn, checkfirst=True)
+    for table in Base.metadata.sorted_tables:
+        conn.execute(
+            text(
+                "INSERT INTO cache_generations (table_name, generation) "
+                "SELECT :name, 0 WHERE NOT EXISTS (SELECT 1 FROM cache_generations WHERE table_name = :name)"
+            ),
+            {"name": table.name},
+        )
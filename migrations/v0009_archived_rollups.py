@@ -0,0 +1,11 @@
+"""
+What rollups.py needs to keep the months partitions.py archives:
+user_order_stats_archived for the per-user totals of detached months, and
+rollup_state.archived_before, the start of the months still attached.
+"""
+import models
+from migrations import add_column
+
+def upgrade(conn):
+    models.UserOrderStatsArchived.__table__.create(conn, checkfirst=True)
+    add_column(conn, "rollup_state", "archived_before", "DATE")
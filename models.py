@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Numeric, Text, ForeignKey, TIMESTAMP
+from sqlalchemy import Column, Integer, BigInteger, Boolean, Date, String, Numeric, Text, ForeignKey, TIMESTAMP, UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship
 from database import Base
 from sqlalchemy.sql import func
@@ -11,6 +11,9 @@ class User(Base):
     email = Column(String(150), unique=True, nullable=False)
     password_hash = Column(Text, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    # Bumped by every write; served as the ETag that If-Match preconditions name
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     orders = relationship("Order", back_populates="user")
     reviews = relationship("Review", back_populates="user")
@@ -21,19 +24,33 @@ class Category(Base):
     category_id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False)
     description = Column(Text)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     products = relationship("Product", back_populates="category")
 
 # Products Table
 class Product(Base):
     __tablename__ = "products"
+    # The search_vector column and the search GIN indexes are PostgreSQL only
+    # and live in migrations/v0004_product_search.py
+    __table_args__ = (
+        Index("ix_products_rating_avg", "rating_avg", "product_id"),
+        Index("ix_products_price", "price", "product_id"),
+    )
     product_id = Column(Integer, primary_key=True, index=True)
     name = Column(String(150), nullable=False)
     description = Column(Text)
     price = Column(Numeric(10,2), nullable=False)
     stock = Column(Integer, nullable=False)
-    category_id = Column(Integer, ForeignKey("categories.category_id"))
+    category_id = Column(Integer, ForeignKey("categories.category_id"), index=True)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    # Maintained from reviews by crud.rating_updates; 0 until the first rating
+    rating_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_avg = Column(Numeric(3,2), nullable=False, default=0, server_default="0")
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     category = relationship("Category", back_populates="products")
     order_items = relationship("OrderItem", back_populates="product")
@@ -42,11 +59,19 @@ class Product(Base):
 # Orders Table
 class Order(Base):
     __tablename__ = "orders"
+    # On PostgreSQL, orders and order_items are partitioned by month, with
+    # the partition column in their primary keys; see
+    # migrations/v0006_partition_orders.py and partitions.py
+    __table_args__ = (
+        Index("ix_orders_pending_order_date", "order_date", postgresql_where=text("status = 'pending'")),
+    )
     order_id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.user_id"))
-    order_date = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    user_id = Column(Integer, ForeignKey("users.user_id"), index=True)
+    order_date = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now(), index=True)
     total_amount = Column(Numeric(10,2), nullable=False)
-    status = Column(String(50), default="pending")
+    status = Column(String(50), default="pending", index=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     user = relationship("User", back_populates="orders")
     items = relationship("OrderItem", back_populates="order")
@@ -55,10 +80,15 @@ class Order(Base):
 class OrderItem(Base):
     __tablename__ = "order_items"
     order_item_id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.order_id"))
-    product_id = Column(Integer, ForeignKey("products.product_id"))
+    # No foreign key in the partitioned PostgreSQL schema
+    order_id = Column(Integer, ForeignKey("orders.order_id"), index=True)
+    product_id = Column(Integer, ForeignKey("products.product_id"), index=True)
     quantity = Column(Integer, nullable=False)
     price = Column(Numeric(10,2), nullable=False)
+    # Same as the order's order_date when written with the order
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), index=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     order = relationship("Order", back_populates="items")
     product = relationship("Product", back_populates="order_items")
@@ -66,12 +96,105 @@ class OrderItem(Base):
 # Reviews Table
 class Review(Base):
     __tablename__ = "reviews"
+    __table_args__ = (
+        UniqueConstraint("user_id", "product_id", name="uq_reviews_user_product"),
+        Index("ix_reviews_product_id_created_at", "product_id", "created_at"),
+    )
     review_id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.product_id"))
     user_id = Column(Integer, ForeignKey("users.user_id"))
     rating = Column(Integer)
     comment = Column(Text)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     user = relationship("User", back_populates="reviews")
     product = relationship("Product", back_populates="reviews")
+
+# -------------------- Rollups --------------------
+# Summary tables maintained by rollups.py, so analytic questions read a few
+# pre-aggregated rows instead of scanning orders, order_items and reviews
+
+# Revenue per product per day
+class DailyProductRevenue(Base):
+    __tablename__ = "daily_product_revenue"
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.product_id"), primary_key=True, index=True)
+    quantity = Column(Integer, nullable=False)
+    revenue = Column(Numeric(14,2), nullable=False)
+    order_count = Column(Integer, nullable=False)
+
+# Review totals per product
+class ProductRatingStats(Base):
+    __tablename__ = "product_rating_stats"
+    product_id = Column(Integer, ForeignKey("products.product_id"), primary_key=True)
+    rating_count = Column(Integer, nullable=False)
+    rating_sum = Column(Integer, nullable=False)
+    rating_avg = Column(Numeric(4,2))
+
+# Order totals per user
+class UserOrderStats(Base):
+    __tablename__ = "user_order_stats"
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    order_count = Column(Integer, nullable=False)
+    total_spent = Column(Numeric(14,2), nullable=False, index=True)
+    first_order_at = Column(TIMESTAMP(timezone=True))
+    last_order_at = Column(TIMESTAMP(timezone=True))
+
+# Order totals per user over the months partitions.archive has detached,
+# folded in as each month goes; rollups.py adds them to user_order_stats
+class UserOrderStatsArchived(Base):
+    __tablename__ = "user_order_stats_archived"
+    user_id = Column(Integer, primary_key=True)
+    order_count = Column(Integer, nullable=False)
+    total_spent = Column(Numeric(14,2), nullable=False)
+    first_order_at = Column(TIMESTAMP(timezone=True))
+    last_order_at = Column(TIMESTAMP(timezone=True))
+
+# Refresh bookkeeping: every source id up to the watermark is folded in for
+# good; pending_watermark becomes the watermark ROLLUP_SETTLE_SECONDS after
+# pending_since, once writes still holding lower ids have committed. stale
+# means the rollup has never been built. Source rows before archived_before
+# have been archived (partitions.py), and rebuilds leave them alone
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+    name = Column(String(100), primary_key=True)
+    watermark = Column(BigInteger, nullable=False, default=0)
+    pending_watermark = Column(BigInteger)
+    pending_since = Column(TIMESTAMP(timezone=True))
+    stale = Column(Boolean, nullable=False, default=True)
+    refreshed_at = Column(TIMESTAMP(timezone=True))
+    archived_before = Column(Date)
+
+# Rollup groups touched by updates and deletes, written in the writer's
+# transaction and recomputed and deleted by the next refresh. The key columns
+# are named after the rollup primary keys; all of them NULL asks for a rebuild
+class RollupChange(Base):
+    __tablename__ = "rollup_changes"
+    change_id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    name = Column(String(100), nullable=False, index=True)
+    day = Column(Date)
+    product_id = Column(Integer)
+    user_id = Column(Integer)
+
+# -------------------- Caches --------------------
+# Per-table generations bumped by jobs outside the servers (bulk_import,
+# reconcile_ratings.py, rollups.py) and polled by every worker, which
+# flushes its own caches for a table whose generation moved; see cache.publish
+class CacheGeneration(Base):
+    __tablename__ = "cache_generations"
+    table_name = Column(String(100), primary_key=True)
+    generation = Column(BigInteger, nullable=False, default=0)
+
+# -------------------- Idempotency --------------------
+# First responses of create requests sent with an Idempotency-Key header,
+# replayed by idempotency.py when the request is retried
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    key = Column(String(200), primary_key=True)
+    route = Column(String(100), nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    # Written in the same transaction as the request's writes
+    response = Column(Text)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), index=True)
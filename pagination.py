@@ -0,0 +1,58 @@
+import base64
+import json
+from typing import Optional
+from fastapi import HTTPException, Response
+
+# -------------------- Cursors --------------------
+def encode_cursor(*values):
+    raw = json.dumps(list(values), separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or not values:
+        raise ValueError("Invalid cursor")
+    return values
+
+def next_cursor(rows, limit: int, key):
+    """
+    Cursor for the page after `rows`, or None when this was the last page.
+    """
+    if len(rows) < limit or not rows:
+        return None
+    return encode_cursor(*key(rows[-1]))
+
+# -------------------- FastAPI helpers --------------------
+def cursor_key(cursor: Optional[str] = None):
+    if cursor is None:
+        return None
+    try:
+        (key,) = decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(key, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
+def cursor_values(cursor: Optional[str] = None):
+    # Composite keys, e.g. (rating_avg, product_id); the route checks the shape
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def cursor_headers(rows, limit: int, key):
+    keys = (key,) if isinstance(key, str) else key
+    field = lambda row, k: row[k] if isinstance(row, dict) else getattr(row, k)
+    cursor = next_cursor(rows, limit, lambda row: tuple(field(row, k) for k in keys))
+    return {"X-Next-Cursor": cursor} if cursor else {}
+
+def paginated(response: Response, rows, limit: int, key):
+    response.headers.update(cursor_headers(rows, limit, key))
+    return rows
@@ -0,0 +1,253 @@
+"""
+Monthly range partitions of orders (by order_date) and order_items (by
+created_at). PostgreSQL only; migrations/v0006_partition_orders.py converts
+the tables, and this module keeps them in shape afterwards.
+
+    python partitions.py list
+    python partitions.py ensure                        # create the months ahead
+    python partitions.py archive --keep-months 24 --to archive/
+
+Each month is a partition named <table>_pYYYY_MM, with a <table>_default
+partition catching rows outside them. Every worker creates the next
+PARTITION_MONTHS_AHEAD months at startup and every PARTITION_CHECK_INTERVAL
+seconds after that, so rows always have a partition waiting for them.
+
+archive detaches the months older than --keep-months from both tables,
+writes each one to <table>_pYYYY_MM.csv.gz and then drops it. A partition
+detached by an interrupted run is picked up again by the next one. The
+rollups keep the archived months, rebuilds included: in the transaction
+that detaches a month of orders, its per-user totals are folded into
+user_order_stats_archived and the rollups' archived_before moves past it
+(see rollups.archived).
+"""
+import argparse
+import gzip
+import logging
+import os
+import re
+import threading
+from datetime import date
+from sqlalchemy import text
+import database, rollups
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_CHECK_INTERVAL = float(os.getenv("PARTITION_CHECK_INTERVAL", "86400"))
+
+# table -> partition column
+PARTITIONED = {"orders": "order_date", "order_items": "created_at"}
+
+logger = logging.getLogger(__name__)
+
+# -------------------- Months --------------------
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+def partition_month(table: str, name: str):
+    match = re.fullmatch(rf"{table}_p(\d{{4}})_(\d{{2}})", name)
+    return date(int(match[1]), int(match[2]), 1) if match else None
+
+# -------------------- Catalog --------------------
+def is_partitioned(conn, table: str) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return bool(conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :table AND pg_table_is_visible(c.oid)"),
+        {"table": table},
+    ).first())
+
+def attached(conn, table: str) -> list:
+    return [row[0] for row in conn.execute(
+        text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = CAST(:table AS regclass) ORDER BY c.relname"),
+        {"table": table},
+    )]
+
+def detached(conn, table: str) -> list:
+    # Month tables left behind by an archive run that stopped after detaching
+    rows = conn.execute(
+        text("SELECT relname FROM pg_class WHERE relkind = 'r' AND NOT relispartition AND relname LIKE :pattern AND pg_table_is_visible(oid) ORDER BY relname"),
+        {"pattern": f"{table}_p%"},
+    )
+    return [name for (name,) in rows if partition_month(table, name)]
+
+# -------------------- Creation --------------------
+def create_partition(conn, table: str, month: date, parent: str = None):
+    """
+    CREATE TABLE IF NOT EXISTS for one month of `table`, attached to
+    `parent` (default `table`). Bounds are UTC month starts.
+    """
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(table, month)}" PARTITION OF "{parent or table}" '
+        f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{add_months(month, 1).isoformat()} 00:00:00+00')"
+    ))
+
+def create_partitions(conn, table: str, first: date, last: date, parent: str = None):
+    month = month_start(first)
+    while month <= last:
+        create_partition(conn, table, month, parent)
+        month = add_months(month, 1)
+    conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{table}_default" PARTITION OF "{parent or table}" DEFAULT'))
+
+def ensure(engine, months_ahead: int = PARTITION_MONTHS_AHEAD) -> list:
+    """
+    Create this month's and the next `months_ahead` months' partitions where
+    missing. Returns the names created. Workers take turns on an advisory
+    lock, so concurrent startups do not race on the same CREATE.
+    """
+    created = []
+    with engine.begin() as conn:
+        if conn.dialect.name != "postgresql":
+            return created
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('partitions'))"))
+        this_month = month_start(date.today())
+        for table in PARTITIONED:
+            if not is_partitioned(conn, table):
+                continue
+            existing = set(attached(conn, table))
+            for ahead in range(months_ahead + 1):
+                month = add_months(this_month, ahead)
+                if partition_name(table, month) not in existing:
+                    create_partition(conn, table, month)
+                    created.append(partition_name(table, month))
+    return created
+
+# -------------------- Archival --------------------
+class _CountingWriter:
+    def __init__(self, file):
+        self.file = file
+        self.lines = 0
+
+    def write(self, data):
+        self.lines += data.count(b"\n") if isinstance(data, bytes) else data.count("\n")
+        return self.file.write(data.encode() if isinstance(data, str) else data)
+
+def export_partition(engine, name: str, directory: str) -> int:
+    """
+    COPY a detached month to <directory>/<name>.csv.gz, via a .partial file
+    so a finished file is always complete. Returns the rows written.
+    """
+    path = os.path.join(directory, f"{name}.csv.gz")
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(f'SELECT count(*) FROM "{name}"')
+        expected = cursor.fetchone()[0]
+        with gzip.open(path + ".partial", "wb") as file:
+            writer = _CountingWriter(file)
+            cursor.copy_expert(f'COPY "{name}" TO STDOUT WITH (FORMAT csv, HEADER)', writer)
+        raw.rollback()
+    finally:
+        raw.close()
+    # The tables hold no multi-line text, so lines are rows plus the header
+    if writer.lines - 1 != expected:
+        raise RuntimeError(f"{name}: wrote {writer.lines - 1} rows, expected {expected}")
+    os.replace(path + ".partial", path)
+    return expected
+
+def _older(table: str, names, cutoff: date) -> list:
+    return [name for name in names if (month := partition_month(table, name)) and month < cutoff]
+
+def archive(engine, keep_months: int, directory: str, drop: bool = True) -> list:
+    """
+    Detach, export and drop every month of the partitioned tables that
+    ended more than `keep_months` months ago. Returns (name, rows) pairs.
+    """
+    os.makedirs(directory, exist_ok=True)
+    cutoff = add_months(month_start(date.today()), -keep_months)
+    archived = []
+    for table in PARTITIONED:
+        with engine.connect() as conn:
+            if not is_partitioned(conn, table):
+                continue
+            pending = _older(table, attached(conn, table), cutoff)
+            leftover = _older(table, detached(conn, table), cutoff)
+        for name in pending:
+            month = partition_month(table, name)
+            with engine.begin() as conn:
+                # Detaching needs a brief exclusive lock on the parent; give up
+                # rather than queue every other query behind a long one
+                conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+                for stmt in rollups.archived(table, month, add_months(month, 1)):
+                    conn.execute(stmt)
+                conn.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'))
+        for name in sorted(pending + leftover):
+            rows = export_partition(engine, name, directory)
+            if drop:
+                with engine.begin() as conn:
+                    conn.execute(text(f'DROP TABLE "{name}"'))
+            archived.append((name, rows))
+            logger.info("Archived %s: %d rows", name, rows)
+    return archived
+
+# -------------------- Scheduler --------------------
+_stop = threading.Event()
+_maintainer = None
+
+def _run(interval: float):
+    while True:
+        try:
+            created = ensure(database.engine)
+            if created:
+                logger.info("Created partitions %s", ", ".join(created))
+        except Exception:
+            logger.exception("Creating partitions failed")
+        if _stop.wait(interval):
+            return
+
+def start_maintainer(interval: float = PARTITION_CHECK_INTERVAL):
+    """
+    Create upcoming partitions now and every `interval` seconds on a daemon
+    thread. PARTITION_CHECK_INTERVAL=0 disables it, e.g. when a cron job
+    runs `python partitions.py ensure` instead.
+    """
+    global _maintainer
+    if interval <= 0 or _maintainer is not None:
+        return
+    _stop.clear()
+    _maintainer = threading.Thread(target=_run, args=(interval,), name="partitions", daemon=True)
+    _maintainer.start()
+
+def stop_maintainer():
+    global _maintainer
+    _stop.set()
+    if _maintainer is not None:
+        _maintainer.join()
+        _maintainer = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the monthly partitions of orders and order_items")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list")
+    ensure_parser = sub.add_parser("ensure")
+    ensure_parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    archive_parser = sub.add_parser("archive")
+    archive_parser.add_argument("--keep-months", type=int, required=True, help="months to keep attached, before the current one")
+    archive_parser.add_argument("--to", required=True, help="directory for the .csv.gz files")
+    archive_parser.add_argument("--keep-tables", action="store_true", help="leave the detached tables in place after exporting")
+    args = parser.parse_args()
+
+    engine = database.engine
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("partitions.py needs PostgreSQL")
+    if args.command == "list":
+        with engine.connect() as conn:
+            for table in PARTITIONED:
+                names = attached(conn, table) if is_partitioned(conn, table) else []
+                print(f"{table}: {', '.join(names) if names else 'not partitioned'}")
+                for name in detached(conn, table):
+                    print(f"  {name} (detached, not yet archived)")
+    elif args.command == "ensure":
+        created = ensure(engine, args.months_ahead)
+        print(f"Created {', '.join(created)}" if created else "Nothing to create")
+    else:
+        for name, rows in archive(engine, args.keep_months, args.to, drop=not args.keep_tables):
+            print(f"{name}: {rows} rows -> {os.path.join(args.to, name)}.csv.gz")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+from database import SessionLocal
+import crud
+
+# Recompute products.rating_count / rating_sum / rating_avg from reviews and
+# fix any product whose stored values have drifted, e.g. after reviews were
+# edited outside the API.
+#   python reconcile_ratings.py
+
+with SessionLocal() as db:
+    fixed = crud.reconcile_ratings(db)
+print(f"Reconciled ratings: {fixed} product(s) fixed")
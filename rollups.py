@@ -0,0 +1,383 @@
+"""
+Maintenance of the summary tables in the Rollups section of models.py.
+
+A refresh recomputes only the groups (rollup rows) that changed:
+- groups of source rows inserted past the rollup's watermark in rollup_state.
+  The watermark trails the highest id seen by ROLLUP_SETTLE_SECONDS, so a
+  row whose transaction commits after a higher id was seen is still picked
+  up, as long as no write transaction runs longer than that
+- groups recorded in rollup_changes by updates and deletes of the columns a
+  rollup aggregates (see touched), in the writer's own transaction. Other
+  writes, such as a change of order status, record nothing
+
+Only mark_stale (used after bulk imports) and --full rebuild a rollup in
+full. Refreshers, one per worker, take turns on an advisory lock; writers
+never wait for a refresh.
+
+Months of orders archived by partitions.py are gone from the source tables
+but not from the rollups: daily_product_revenue leaves its days before
+rollup_state.archived_before alone, and user_order_stats adds the per-user
+totals folded into user_order_stats_archived as each month was detached.
+
+    python rollups.py           # incremental refresh
+    python rollups.py --full    # rebuild every rollup
+"""
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timezone
+from sqlalchemy import delete, distinct, func, insert, literal_column, or_, select, tuple_, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+import cache, models
+from database import SessionLocal
+
+ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", "60"))
+ROLLUP_SETTLE_SECONDS = float(os.getenv("ROLLUP_SETTLE_SECONDS", "120"))
+# Groups recomputed per statement
+ROLLUP_CHUNK_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+# Shown to the SQL agent and the fast path next to the table schemas
+DESCRIPTIONS = {
+    "daily_product_revenue": "units, revenue and order count per product per day; use it instead of summing order_items",
+    "product_rating_stats": "review count, rating sum and average rating per product; use it instead of aggregating reviews",
+    "user_order_stats": "order count, total spent and first/last order time per user; use it instead of aggregating orders",
+}
+
+class Rollup:
+    def __init__(self, model, source_key, sources, aggregate, archive_column=None, day_key=None, archived=None):
+        self.model = model
+        self.name = model.__tablename__
+        # Primary key of the source rows the watermark tracks
+        self.source_key = source_key
+        # Source table -> the columns whose changes alter the rollup
+        self.sources = sources
+        # Returns the grouped SELECT producing the rollup rows and its group keys
+        self.aggregate = aggregate
+        # Source column partitions.py archives months on, if any
+        self.archive_column = archive_column
+        # Day group key of a rollup whose groups each fall in one month; the
+        # days before archived_before are left as they are
+        self.day_key = day_key
+        # (model, combine) for a rollup whose groups span months: the model
+        # holds the totals of the archived rows per group, and combine(current,
+        # new) returns the SET clause adding two sets of totals
+        self.archived = archived
+
+def _daily_product_revenue():
+    day = func.date(models.Order.order_date)
+    query = (
+        select(
+            day.label("day"),
+            models.OrderItem.product_id,
+            func.sum(models.OrderItem.quantity).label("quantity"),
+            func.sum(models.OrderItem.quantity * models.OrderItem.price).label("revenue"),
+            func.count(distinct(models.OrderItem.order_id)).label("order_count"),
+        )
+        .select_from(models.OrderItem)
+        .join(models.Order, models.Order.order_id == models.OrderItem.order_id)
+        .where(models.OrderItem.product_id.isnot(None))
+        .group_by(day, models.OrderItem.product_id)
+    )
+    return query, (day, models.OrderItem.product_id)
+
+def _product_rating_stats():
+    query = (
+        select(
+            models.Review.product_id,
+            func.count(models.Review.rating).label("rating_count"),
+            func.coalesce(func.sum(models.Review.rating), 0).label("rating_sum"),
+            func.round(func.avg(models.Review.rating), 2).label("rating_avg"),
+        )
+        .where(models.Review.product_id.isnot(None))
+        .group_by(models.Review.product_id)
+    )
+    return query, (models.Review.product_id,)
+
+def _user_order_stats():
+    query = (
+        select(
+            models.Order.user_id,
+            func.count().label("order_count"),
+            func.coalesce(func.sum(models.Order.total_amount), 0).label("total_spent"),
+            func.min(models.Order.order_date).label("first_order_at"),
+            func.max(models.Order.order_date).label("last_order_at"),
+        )
+        .where(models.Order.user_id.isnot(None))
+        .group_by(models.Order.user_id)
+    )
+    return query, (models.Order.user_id,)
+
+def _add_user_order_stats(current, new) -> dict:
+    return {
+        "order_count": current.order_count + new.order_count,
+        "total_spent": current.total_spent + new.total_spent,
+        "first_order_at": func.least(current.first_order_at, new.first_order_at),
+        "last_order_at": func.greatest(current.last_order_at, new.last_order_at),
+    }
+
+ROLLUPS = [
+    Rollup(
+        models.DailyProductRevenue, models.OrderItem.order_item_id,
+        {"orders": {"order_date"}, "order_items": {"order_id", "product_id", "quantity", "price"}},
+        _daily_product_revenue,
+        archive_column=models.Order.order_date, day_key=models.DailyProductRevenue.day,
+    ),
+    Rollup(models.ProductRatingStats, models.Review.review_id, {"reviews": {"product_id", "rating"}}, _product_rating_stats),
+    Rollup(
+        models.UserOrderStats, models.Order.order_id, {"orders": {"user_id", "total_amount", "order_date"}}, _user_order_stats,
+        archive_column=models.Order.order_date, archived=(models.UserOrderStatsArchived, _add_user_order_stats),
+    ),
+]
+
+# -------------------- Change tracking --------------------
+def _group_columns(rollup: Rollup) -> list:
+    return [column.name for column in rollup.model.__table__.primary_key.columns]
+
+def touched(table: str, where, columns=None) -> list:
+    """
+    INSERTs recording the rollup groups of the `table` rows matching `where`,
+    for the writer to execute in its transaction: before an update that can
+    move the rows out of their groups or a delete, and after an update that
+    can move them into others. `columns` are the columns the write changes;
+    rollups aggregating none of them are skipped, so most updates record
+    nothing.
+    """
+    statements = []
+    for rollup in ROLLUPS:
+        watched = rollup.sources.get(table)
+        if watched is None or (columns is not None and not watched & set(columns)):
+            continue
+        query, group_keys = rollup.aggregate()
+        groups = query.with_only_columns(literal_column(f"'{rollup.name}'"), *group_keys).where(where)
+        statements.append(insert(models.RollupChange).from_select(["name", *_group_columns(rollup)], groups))
+    return statements
+
+def mark_stale(*tables) -> list:
+    """
+    INSERTs asking for a rebuild of every rollup fed by `tables`, for writes
+    too broad to track group by group (bulk imports). Insert-only, so they
+    never wait for a running refresh.
+    """
+    return [insert(models.RollupChange).values(name=rollup.name) for rollup in ROLLUPS if set(rollup.sources) & set(tables)]
+
+def _take_changes(db: Session, rollup: Rollup):
+    """
+    Delete the rollup's recorded changes and return (rebuild, groups). A
+    change committed meanwhile is not deleted, so it waits for the next
+    refresh.
+    """
+    table = models.RollupChange.__table__
+    keys = [table.c[name] for name in _group_columns(rollup)]
+    rows = db.execute(delete(table).where(table.c.name == rollup.name).returning(*keys)).all()
+    rebuild = any(all(value is None for value in row) for row in rows)
+    return rebuild, {tuple(row) for row in rows if not all(value is None for value in row)}
+
+# -------------------- Archived months --------------------
+def archived(table: str, start: date, end: date) -> list:
+    """
+    Statements for partitions.archive to run in the transaction that
+    detaches the [start, end) month of `table`, while its rows can still be
+    read: fold them into the archived totals of the rollups whose groups
+    span months, and move archived_before up to `end`.
+    """
+    statements = []
+    state = models.RollupState.__table__
+    for rollup in ROLLUPS:
+        column = rollup.archive_column
+        if column is None or column.table.name != table:
+            continue
+        if rollup.archived is not None:
+            model, combine = rollup.archived
+            query, _ = rollup.aggregate()
+            rows = query.where(column >= start, column < end)
+            stmt = postgresql.insert(model).from_select([c.name for c in query.selected_columns], rows)
+            statements.append(stmt.on_conflict_do_update(
+                index_elements=_group_columns(rollup), set_=combine(model.__table__.c, stmt.excluded)
+            ))
+        statements.append(
+            update(state)
+            .where(state.c.name == rollup.name, or_(state.c.archived_before.is_(None), state.c.archived_before < end))
+            .values(archived_before=end)
+        )
+    return statements
+
+def _fold_archived(db: Session, rollup: Rollup, groups=None):
+    # Add the archived totals of `groups` (every group if None) to the rows
+    # just built from the attached source rows. Archiving is PostgreSQL only
+    model, combine = rollup.archived
+    source = model.__table__
+    target = rollup.model.__table__
+    keys = _group_columns(rollup)
+    query = select(*source.columns)
+    if groups is not None:
+        query = query.where(tuple_(*(source.c[name] for name in keys)).in_(groups))
+    stmt = postgresql.insert(target).from_select([c.name for c in source.columns], query)
+    db.execute(stmt.on_conflict_do_update(index_elements=keys, set_=combine(target.c, stmt.excluded)))
+
+def _before_horizon(rollup: Rollup, horizon) -> bool:
+    # Whether groups before `horizon` are to be left alone
+    return horizon is not None and rollup.day_key is not None
+
+# -------------------- Refresh --------------------
+def _lock(db: Session, name: str) -> bool:
+    # Refreshers (one per worker) take turns per rollup; a busy one is skipped
+    if db.get_bind().dialect.name != "postgresql":
+        return True
+    return db.scalar(select(func.pg_try_advisory_xact_lock(func.hashtext(f"rollups:{name}"))))
+
+def _state(db: Session, name: str):
+    state = db.get(models.RollupState, name)
+    if state is None:
+        state = models.RollupState(name=name, watermark=0, stale=True)
+        db.add(state)
+    return state
+
+def _recompute(db: Session, rollup: Rollup, groups, horizon=None):
+    """
+    Replace the rollup rows of `groups`, a subquery of group keys or a list
+    of key tuples, with their aggregates over all of their source rows,
+    archived ones included.
+    """
+    query, group_keys = rollup.aggregate()
+    columns = [c.name for c in query.selected_columns]
+    target = tuple_(*rollup.model.__table__.primary_key.columns)
+    if not isinstance(groups, list):
+        chunks = [groups]
+    else:
+        chunks = [groups[i:i + ROLLUP_CHUNK_SIZE] for i in range(0, len(groups), ROLLUP_CHUNK_SIZE)]
+    for chunk in chunks:
+        db.execute(delete(rollup.model).where(target.in_(chunk)))
+        db.execute(insert(rollup.model).from_select(columns, query.where(tuple_(*group_keys).in_(chunk))))
+        if horizon is not None and rollup.archived is not None:
+            _fold_archived(db, rollup, chunk)
+
+def _rebuild(db: Session, rollup: Rollup, horizon=None):
+    query, _ = rollup.aggregate()
+    columns = [c.name for c in query.selected_columns]
+    if _before_horizon(rollup, horizon):
+        # The days before the horizon have no source rows left
+        db.execute(delete(rollup.model).where(rollup.day_key >= horizon))
+        db.execute(insert(rollup.model).from_select(columns, query.where(rollup.archive_column >= horizon)))
+        return
+    db.execute(delete(rollup.model))
+    db.execute(insert(rollup.model).from_select(columns, query))
+    if horizon is not None and rollup.archived is not None:
+        _fold_archived(db, rollup)
+
+def _advance(state, high: int, now: datetime):
+    # Ids up to a watermark seen ROLLUP_SETTLE_SECONDS ago were allocated that
+    # long ago, so their transactions have committed (or failed) by now
+    since = state.pending_since
+    if since is not None and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    if since is None or (now - since).total_seconds() >= ROLLUP_SETTLE_SECONDS:
+        if since is not None:
+            state.watermark = max(state.watermark, state.pending_watermark)
+        state.pending_watermark = high
+        state.pending_since = now
+
+def refresh_one(db: Session, rollup: Rollup, full: bool = False):
+    started = time.perf_counter()
+    if not _lock(db, rollup.name):
+        db.rollback()
+        return {"mode": "busy", "watermark": None, "seconds": 0.0}
+    state = _state(db, rollup.name)
+    high = db.scalar(select(func.coalesce(func.max(rollup.source_key), 0)))
+    rebuild, changed = _take_changes(db, rollup)
+    query, group_keys = rollup.aggregate()
+    horizon = state.archived_before
+    if _before_horizon(rollup, horizon):
+        # Rows backfilled into archived days are not counted
+        day = _group_columns(rollup).index(rollup.day_key.name)
+        changed = {group for group in changed if group[day] is None or group[day] >= horizon}
+        query = query.where(rollup.archive_column >= horizon)
+
+    if full or rebuild or state.stale:
+        mode = "full"
+        _rebuild(db, rollup, horizon)
+    elif high > state.watermark or changed:
+        mode = "incremental"
+        # Groups of the rows past the watermark, then the groups writers
+        # recorded, each recomputed over all of its source rows
+        if high > state.watermark:
+            _recompute(db, rollup, query.with_only_columns(*group_keys).where(
+                rollup.source_key > state.watermark, rollup.source_key <= high
+            ), horizon)
+        if changed:
+            _recompute(db, rollup, list(changed), horizon)
+    else:
+        db.rollback()
+        return {"mode": "noop", "watermark": state.watermark, "seconds": 0.0}
+
+    now = datetime.now(timezone.utc)
+    _advance(state, high, now)
+    state.stale = False
+    state.refreshed_at = now
+    # Reaches the other workers, and the servers when run from the command line
+    db.execute(cache.publish(rollup.name))
+    db.commit()
+    cache.invalidate(rollup.name)
+    return {"mode": mode, "watermark": high, "seconds": round(time.perf_counter() - started, 3)}
+
+def refresh(db: Session, full: bool = False):
+    return {rollup.name: refresh_one(db, rollup, full) for rollup in ROLLUPS}
+
+def status(db: Session):
+    pending = dict(
+        db.query(models.RollupChange.name, func.count()).group_by(models.RollupChange.name).all()
+    )
+    return {
+        state.name: {
+            "watermark": state.watermark,
+            "stale": state.stale,
+            "pending_changes": pending.get(state.name, 0),
+            "archived_before": state.archived_before,
+            "refreshed_at": state.refreshed_at,
+        }
+        for state in db.query(models.RollupState).all()
+    }
+
+# -------------------- Scheduler --------------------
+_stop = threading.Event()
+_refresher = None
+
+def _run(interval: float):
+    while not _stop.wait(interval):
+        try:
+            with SessionLocal() as db:
+                refresh(db)
+        except Exception:
+            logger.exception("Rollup refresh failed")
+
+def start_refresher(interval: float = ROLLUP_REFRESH_INTERVAL):
+    """
+    Refresh the rollups every `interval` seconds on a daemon thread.
+    ROLLUP_REFRESH_INTERVAL=0 disables it, e.g. when a cron job runs
+    `python rollups.py` instead.
+    """
+    global _refresher
+    if interval <= 0 or _refresher is not None:
+        return
+    _stop.clear()
+    _refresher = threading.Thread(target=_run, args=(interval,), name="rollups", daemon=True)
+    _refresher.start()
+
+def stop_refresher():
+    global _refresher
+    _stop.set()
+    if _refresher is not None:
+        _refresher.join()
+        _refresher = None
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Refresh the analytics rollups")
+    parser.add_argument("--full", action="store_true", help="rebuild instead of refreshing incrementally")
+    args = parser.parse_args()
+    with SessionLocal() as db:
+        for name, result in refresh(db, args.full).items():
+            print(f"{name}: {result['mode']} up to id {result['watermark']} in {result['seconds']}s")
@@ -1,13 +1,145 @@
-FORBIDDEN = [
-    "insert",
-    "update",
-    "delete",
-    "drop",
-    "truncate",
-    "alter",
-    "create"
-]
-
-def is_safe(question: str) -> bool:
-    q = question.lower()
-    return not any(word in q for word in FORBIDDEN)
+import os
+import sqlglot
+from sqlglot import exp
+
+ALLOWED_TABLES = {
+    "users",
+    "categories",
+    "products",
+    "orders",
+    "order_items",
+    "reviews",
+    "daily_product_revenue",
+    "product_rating_stats",
+    "user_order_stats"
+}
+
+# Columns left out of the schema the model sees, and never readable by it
+HIDDEN_COLUMNS = {"password_hash", "version"}
+# Tables holding a hidden column, so a * or whole-row reference would read it
+HIDDEN_COLUMN_TABLES = {"users"}
+
+MAX_ROWS = int(os.getenv("AI_MAX_ROWS", "1000"))
+
+QUERY_TYPES = (exp.Select, exp.Union, exp.Except, exp.Intersect)
+
+# Nodes that write, lock, or escape the query into the server
+FORBIDDEN_NODES = tuple(
+    getattr(exp, name) for name in (
+        "Insert", "Update", "Delete", "Merge", "Create", "Drop", "Alter",
+        "AlterTable", "TruncateTable", "Command", "Into", "Lock", "Set",
+        "Grant", "Copy",
+    )
+    if hasattr(exp, name)
+)
+
+FORBIDDEN_FUNCTION_PREFIXES = ("pg_", "dblink", "lo_", "set_config", "current_setting", "query_to_xml")
+
+# A CTE may not take the name of a relation the query could not read, so a
+# query never looks like it reads a system catalog or an internal table
+RESERVED_PREFIXES = ("pg_", "information_schema")
+INTERNAL_TABLES = {"rollup_state", "rollup_changes", "user_order_stats_archived", "cache_generations", "idempotency_keys", "import_progress", "schema_migrations"}
+
+class InvalidQuery(ValueError):
+    pass
+
+class UnsafeQuery(ValueError):
+    pass
+
+def _limit_value(node):
+    value = node.expression if node is not None else None
+    return int(value.name) if isinstance(value, exp.Literal) and value.is_int else None
+
+def _with_clause(node):
+    return next((value for value in node.args.values() if isinstance(value, exp.With)), None)
+
+def _ctes_in_scope(table) -> set:
+    """
+    Names of the CTEs `table` can refer to: every CTE of an enclosing WITH,
+    except that inside a CTE's own definition only the CTEs before it count
+    (all of them under WITH RECURSIVE), as in PostgreSQL. A table read in a
+    CTE's body is the real table, not the CTE.
+    """
+    names = set()
+    child, parent = table, table.parent
+    while parent is not None:
+        if isinstance(parent, exp.With):
+            ctes = parent.expressions
+            if not parent.args.get("recursive"):
+                ctes = ctes[:next(i for i, cte in enumerate(ctes) if cte is child)]
+            names.update(cte.alias_or_name.lower() for cte in ctes)
+        else:
+            with_clause = _with_clause(parent)
+            if with_clause is not None and with_clause is not child:
+                names.update(cte.alias_or_name.lower() for cte in with_clause.expressions)
+        child, parent = parent, parent.parent
+    return names
+
+def _check_columns(tree):
+    """
+    Reject a hidden column by name, and anything that would read one without
+    naming it: * or t.* over a table holding one, or its whole row (SELECT u
+    FROM users u, row_to_json(users)).
+    """
+    tables = [table for table in tree.find_all(exp.Table) if table.name.lower() in HIDDEN_COLUMN_TABLES]
+    aliases = {table.alias_or_name.lower() for table in tables}
+    for column in tree.find_all(exp.Column):
+        if isinstance(column.this, exp.Star):
+            if column.table.lower() in aliases:
+                raise UnsafeQuery(f"{column.table}.* is not allowed, name the columns")
+        elif column.name.lower() in HIDDEN_COLUMNS:
+            raise UnsafeQuery(f"Column {column.name} is not allowed")
+        elif not column.table and column.name.lower() in aliases:
+            raise UnsafeQuery(f"Whole-row reference {column.name} is not allowed")
+    for table in tables:
+        select = table.find_ancestor(exp.Select)
+        if select is not None and any(isinstance(e, exp.Star) for e in select.expressions):
+            raise UnsafeQuery(f"SELECT * over {table.name} is not allowed, name the columns")
+
+def guard(sql: str, limit: int = MAX_ROWS) -> str:
+    """
+    Parse `sql` and return it re-rendered with a LIMIT of at most `limit`.
+    Raises UnsafeQuery unless it is a single SELECT reading only the allowed
+    tables and none of their hidden columns, and InvalidQuery if it does not
+    parse.
+    """
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="postgres") if s is not None]
+    except sqlglot.errors.ParseError as e:
+        raise InvalidQuery(f"Could not parse SQL: {e}")
+    if len(statements) != 1:
+        raise UnsafeQuery("Exactly one statement is allowed")
+
+    tree = statements[0]
+    if not isinstance(tree, QUERY_TYPES):
+        raise UnsafeQuery(f"Only SELECT statements are allowed, got {tree.key.upper()}")
+    for node in tree.walk():
+        node = node[0] if isinstance(node, tuple) else node
+        if isinstance(node, FORBIDDEN_NODES):
+            raise UnsafeQuery(f"{node.key.upper()} is not allowed")
+        if isinstance(node, exp.Anonymous) and node.name.lower().startswith(FORBIDDEN_FUNCTION_PREFIXES):
+            raise UnsafeQuery(f"Function {node.name} is not allowed")
+
+    for cte in tree.find_all(exp.CTE):
+        name = cte.alias_or_name.lower()
+        if name.startswith(RESERVED_PREFIXES) or name in INTERNAL_TABLES:
+            raise UnsafeQuery(f"CTE name {cte.alias_or_name} is not allowed")
+    for table in tree.find_all(exp.Table):
+        name = table.name.lower()
+        if table.db and table.db.lower() != "public":
+            raise UnsafeQuery(f"Table {table.db}.{table.name} is not allowed")
+        if name not in ALLOWED_TABLES and (table.db or name not in _ctes_in_scope(table)):
+            raise UnsafeQuery(f"Table {table.name} is not allowed")
+    _check_columns(tree)
+
+    current = _limit_value(tree.args.get("limit"))
+    if current is None or current > limit:
+        tree = tree.limit(limit, copy=False)
+    return tree.sql(dialect="postgres")
+
+def is_safe(sql: str) -> bool:
+    try:
+        guard(sql)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,166 @@
+"""
+Table info for the SQL agent, built from the models.py metadata instead of
+live reflection and cached on disk under a hash of that metadata.
+
+- table_info() returns CREATE TABLE statements (hidden columns left out) and
+  the latest sample rows, with no database round trip
+- refresh_samples() reads SCHEMA_SAMPLE_ROWS rows per table on the read-only
+  engine; start_sampler() repeats it every SCHEMA_SAMPLE_INTERVAL seconds
+- CachedSQLDatabase is a LangChain SQLDatabase serving table info from here.
+  It skips SQLDatabase's reflection of every table; building one only lists
+  the table names
+
+The cache file is SCHEMA_CACHE_DIR/schema-<version>.json. A model change
+gives a new version, so a stale file is never read.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+import safety
+from database import Base, ai_engine
+from sql_fastpath import HIDDEN_COLUMNS
+
+SCHEMA_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".schema_cache"))
+SCHEMA_SAMPLE_ROWS = int(os.getenv("SCHEMA_SAMPLE_ROWS", "3"))
+SCHEMA_SAMPLE_INTERVAL = float(os.getenv("SCHEMA_SAMPLE_INTERVAL", "3600"))
+
+logger = logging.getLogger(__name__)
+
+def _ddl(table) -> str:
+    create = CreateTable(table)
+    create.columns = [column for column in create.columns if column.element.name not in HIDDEN_COLUMNS]
+    return str(create.compile(dialect=postgresql.dialect())).strip()
+
+class SchemaCache:
+    def __init__(self, tables):
+        self.tables = sorted(tables)
+        self.lock = threading.Lock()
+        self.version = None
+        self.ddl = None
+        self.samples = {}
+        self.sampled_at = None
+
+    def path(self) -> str:
+        return os.path.join(SCHEMA_CACHE_DIR, f"schema-{self.version}.json")
+
+    def _load(self):
+        if self.ddl is not None:
+            return
+        with self.lock:
+            if self.ddl is not None:
+                return
+            ddl = {name: _ddl(Base.metadata.tables[name]) for name in self.tables}
+            self.version = hashlib.sha1(json.dumps([ddl, SCHEMA_SAMPLE_ROWS], sort_keys=True).encode()).hexdigest()[:12]
+            try:
+                with open(self.path()) as f:
+                    cached = json.load(f)
+                self.samples, self.sampled_at = cached["samples"], cached["sampled_at"]
+            except (OSError, ValueError, KeyError):
+                pass
+            self.ddl = ddl
+
+    def _save(self):
+        os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+        temp = f"{self.path()}.{os.getpid()}.tmp"
+        with open(temp, "w") as f:
+            json.dump({"version": self.version, "ddl": self.ddl, "samples": self.samples, "sampled_at": self.sampled_at}, f)
+        os.replace(temp, self.path())
+
+    def table_info(self, table_names=None) -> str:
+        self._load()
+        names = list(table_names) if table_names else self.tables
+        missing = [name for name in names if name not in self.ddl]
+        if missing:
+            raise ValueError(f"table_names {missing} not found in database")
+        parts = []
+        for name in names:
+            part = self.ddl[name]
+            if self.samples.get(name):
+                part += f"\n\n/*\n{self.samples[name]}\n*/"
+            parts.append(part)
+        return "\n\n".join(parts)
+
+    def refresh_samples(self, engine=None):
+        self._load()
+        samples = {}
+        with (engine or ai_engine()).connect() as conn:
+            for name in self.tables:
+                columns = [column for column in Base.metadata.tables[name].columns if column.name not in HIDDEN_COLUMNS]
+                try:
+                    rows = conn.execute(select(*columns).limit(SCHEMA_SAMPLE_ROWS)).all()
+                except Exception:
+                    # e.g. a table whose migration has not run yet. PostgreSQL
+                    # refuses the next tables' queries until the rollback
+                    logger.warning("No sample rows for %s", name, exc_info=True)
+                    conn.rollback()
+                    continue
+                lines = [f"{len(rows)} rows from {name} table:", "\t".join(column.name for column in columns)]
+                lines += ["\t".join(str(value)[:100] for value in row) for row in rows]
+                samples[name] = "\n".join(lines)
+        with self.lock:
+            self.samples = samples
+            self.sampled_at = time.time()
+            self._save()
+
+schema = SchemaCache(safety.ALLOWED_TABLES)
+
+class CachedSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase on `engine` limited to `tables`, with table info from
+    `cache`. It is given the models' metadata and lazy reflection, so the
+    constructor only lists the table names (one round trip) and never
+    reflects a table.
+    """
+    def __init__(self, engine, tables, cache: SchemaCache = schema):
+        self.schema_cache = cache
+        super().__init__(
+            engine,
+            metadata=Base.metadata,
+            include_tables=sorted(tables),
+            sample_rows_in_table_info=0,
+            lazy_table_reflection=True,
+        )
+
+    def get_table_info(self, table_names=None):
+        return self.schema_cache.table_info(table_names)
+
+# -------------------- Scheduler --------------------
+_stop = threading.Event()
+_sampler = None
+
+def _run(interval: float):
+    # First pass straight away, off the startup path
+    while True:
+        try:
+            schema.refresh_samples()
+        except Exception:
+            logger.exception("Schema sample refresh failed")
+        if _stop.wait(interval):
+            return
+
+def start_sampler(interval: float = SCHEMA_SAMPLE_INTERVAL):
+    """
+    Refresh the sample rows every `interval` seconds on a daemon thread.
+    SCHEMA_SAMPLE_INTERVAL=0 disables it; the agent then sees the rows last
+    written to the cache file, if any.
+    """
+    global _sampler
+    if interval <= 0 or _sampler is not None:
+        return
+    _stop.clear()
+    _sampler = threading.Thread(target=_run, args=(interval,), name="schema-samples", daemon=True)
+    _sampler.start()
+
+def stop_sampler():
+    global _sampler
+    _stop.set()
+    if _sampler is not None:
+        _sampler.join()
+        _sampler = None
@@ -1,6 +1,19 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, conlist
+from pydantic.utils import GetterDict
+from sqlalchemy import inspect
 from typing import Optional
-from datetime import datetime
+from datetime import date, datetime
+
+class LoadedGetterDict(GetterDict):
+    """
+    Reads a relationship only if it was eagerly loaded (?expand=...), so
+    serializing never triggers a lazy load; unloaded ones are left unset.
+    """
+    def get(self, key, default=None):
+        state = inspect(self._obj)
+        if key in state.mapper.relationships and key in state.unloaded:
+            return default
+        return getattr(self._obj, key, default)
 
 # ----------------- Users -----------------
 class UserBase(BaseModel):
@@ -10,9 +23,15 @@ class UserBase(BaseModel):
 class UserCreate(UserBase):
     password_hash: str
 
+class UserUpdate(BaseModel):
+    name: Optional[str]
+    email: Optional[str]
+    password_hash: Optional[str]
+
 class User(UserBase):
     user_id: int
     created_at: datetime
+    version: int = 1
 
     class Config:
         orm_mode = True
@@ -25,8 +44,13 @@ class CategoryBase(BaseModel):
 class CategoryCreate(CategoryBase):
     pass
 
+class CategoryUpdate(BaseModel):
+    name: Optional[str]
+    description: Optional[str]
+
 class Category(CategoryBase):
     category_id: int
+    version: int = 1
 
     class Config:
         orm_mode = True
@@ -42,13 +66,43 @@ class ProductBase(BaseModel):
 class ProductCreate(ProductBase):
     pass
 
+class ProductUpdate(BaseModel):
+    name: Optional[str]
+    description: Optional[str]
+    price: Optional[float]
+    stock: Optional[int]
+    # Added to the stored stock in the UPDATE itself, e.g. -2 when two are sold
+    stock_delta: Optional[int]
+    category_id: Optional[int]
+
 class Product(ProductBase):
     product_id: int
     created_at: datetime
+    version: int = 1
+    rating_count: int = 0
+    rating_avg: float = 0
 
     class Config:
         orm_mode = True
 
+class SearchHit(Product):
+    score: float
+
+class CategoryFacet(BaseModel):
+    category_id: Optional[int]
+    name: Optional[str]
+    count: int
+
+    class Config:
+        orm_mode = True
+
+class ProductSearch(BaseModel):
+    items: list[SearchHit]
+    # Only computed for the first page
+    facets: Optional[list[CategoryFacet]]
+    # "fulltext", or "fuzzy" when nothing matched and trigram similarity was used
+    mode: str
+
 # ----------------- Orders -----------------
 class OrderBase(BaseModel):
     user_id: int
@@ -58,9 +112,15 @@ class OrderBase(BaseModel):
 class OrderCreate(OrderBase):
     pass
 
+class OrderUpdate(BaseModel):
+    user_id: Optional[int]
+    total_amount: Optional[float]
+    status: Optional[str]
+
 class Order(OrderBase):
     order_id: int
     order_date: datetime
+    version: int = 1
 
     class Config:
         orm_mode = True
@@ -75,12 +135,32 @@ class OrderItemBase(BaseModel):
 class OrderItemCreate(OrderItemBase):
     pass
 
+class OrderItemUpdate(BaseModel):
+    order_id: Optional[int]
+    product_id: Optional[int]
+    quantity: Optional[int]
+    price: Optional[float]
+
 class OrderItem(OrderItemBase):
     order_item_id: int
+    created_at: Optional[datetime]
+    version: int = 1
 
     class Config:
         orm_mode = True
 
+# ----------------- Checkout -----------------
+class OrderLine(BaseModel):
+    product_id: int
+    quantity: int = Field(..., gt=0)
+
+class OrderPlace(BaseModel):
+    user_id: int
+    items: conlist(OrderLine, min_items=1)
+
+class PlacedOrder(Order):
+    items: list[OrderItem]
+
 # ----------------- Reviews -----------------
 class ReviewBase(BaseModel):
     product_id: int
@@ -91,9 +171,103 @@ class ReviewBase(BaseModel):
 class ReviewCreate(ReviewBase):
     pass
 
+class ReviewUpdate(BaseModel):
+    product_id: Optional[int]
+    user_id: Optional[int]
+    rating: Optional[int]
+    comment: Optional[str]
+
 class Review(ReviewBase):
     review_id: int
     created_at: datetime
+    version: int = 1
+
+    class Config:
+        orm_mode = True
+
+# ----------------- Bulk -----------------
+class BulkResult(BaseModel):
+    index: int
+    id: Optional[int]
+    error: Optional[str] = None
+
+# ----------------- Expanded reads -----------------
+class CategoryDetail(Category):
+    products: Optional[list[Product]]
+
+    class Config:
+        getter_dict = LoadedGetterDict
+
+class ReviewDetail(Review):
+    user: Optional[User]
+    product: Optional[Product]
+
+    class Config:
+        getter_dict = LoadedGetterDict
+
+class ProductDetail(Product):
+    category: Optional[Category]
+    reviews: Optional[list[Review]]
+
+    class Config:
+        getter_dict = LoadedGetterDict
+
+class OrderItemDetail(OrderItem):
+    product: Optional[Product]
+    order: Optional[Order]
+
+    class Config:
+        getter_dict = LoadedGetterDict
+
+class OrderDetail(Order):
+    user: Optional[User]
+    items: Optional[list[OrderItemDetail]]
+
+    class Config:
+        getter_dict = LoadedGetterDict
+
+class UserDetail(User):
+    orders: Optional[list[OrderDetail]]
+    reviews: Optional[list[Review]]
+
+    class Config:
+        getter_dict = LoadedGetterDict
+
+# ----------------- Analytics -----------------
+class ProductRevenue(BaseModel):
+    product_id: int
+    name: str
+    category_id: Optional[int]
+    quantity: int
+    revenue: float
+
+    class Config:
+        orm_mode = True
+
+class RevenuePoint(BaseModel):
+    period: date
+    quantity: int
+    revenue: float
+
+    class Config:
+        orm_mode = True
+
+class CategoryRating(BaseModel):
+    category_id: int
+    name: str
+    rating_count: int
+    rating_avg: Optional[float]
+
+    class Config:
+        orm_mode = True
+
+class CustomerStats(BaseModel):
+    user_id: int
+    name: str
+    order_count: int
+    total_spent: float
+    first_order_at: Optional[datetime]
+    last_order_at: Optional[datetime]
 
     class Config:
         orm_mode = True
@@ -0,0 +1,138 @@
+"""
+Multi-worker server, and the app lifespan used by main.py and main_async.py.
+
+    python server.py --workers 4 --port 8000
+    python server.py --app main_async:app --workers 8 --budget 80
+
+Each worker is a separate process with its own pools. The --budget
+connections per database server (DB_CONNECTION_BUDGET) are split across
+--workers (SERVER_WORKERS) in database.pool_limits, so adding workers does
+not add connections. With main_async the async pool takes the request share
+and the sync pool keeps a few connections for the background threads.
+
+Each worker also has its own memory, so with several workers the response
+cache needs CACHE_URL (Redis), and is off without it; the AI answer cache
+is in-process only and is off.
+
+On startup, before the worker accepts traffic, each worker:
+- drops pools inherited from a forking parent
+- opens its pool connections (WARM_UP=0 skips this and the priming)
+- primes the schema cache, the LLM client, the agent and the SQLAlchemy
+  statement cache
+- starts its background threads: rollups refresher, partition
+  maintainer, schema sampler, replica health checks and the cache watcher
+  that applies invalidations published by jobs outside the servers
+
+On shutdown it stops admitting AI questions, waits up to AI_DRAIN_TIMEOUT
+seconds for running ones, stops the threads, then disposes its pools and
+LLM client.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+AI_DRAIN_TIMEOUT = float(os.getenv("AI_DRAIN_TIMEOUT", "30"))
+WARM_UP = os.getenv("WARM_UP", "true").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger(__name__)
+
+def _prime():
+    # First-use costs paid here instead of by the first requests
+    import crud, database, llm, schema_cache, sql_agent
+
+    with database.SessionLocal() as db:
+        crud.get_categories(db, limit=1)
+        crud.get_products(db, limit=1)
+        crud.get_orders(db, limit=1)
+    schema_cache.schema.table_info()
+    llm.get_llm()
+    sql_agent.get_agent()
+
+async def _warm_async(engine) -> int:
+    connections = [await engine.connect() for _ in range(engine.sync_engine.pool.size())]
+    for connection in connections:
+        await connection.close()
+    return len(connections)
+
+def lifespan(*async_engines):
+    """
+    FastAPI lifespan for one worker. Pass the AsyncEngines the app uses so
+    they are warmed and disposed too.
+    """
+    @asynccontextmanager
+    async def run(app):
+        import ai_pool, cache, database, llm, partitions, rollups, schema_cache
+
+        started = time.perf_counter()
+        if database.SERVER_WORKERS > 1:
+            # One worker's invalidations would never reach the others' memory
+            off = ["AI answer cache"] + ([] if cache.CACHE_URL else ["response cache (no CACHE_URL)"])
+            logger.info("Worker %d of %d: %s off", os.getpid(), database.SERVER_WORKERS, ", ".join(off))
+        ai_pool.executor.reopen()
+        database.dispose_all(close=False)
+        if WARM_UP:
+            opened = await asyncio.to_thread(database.warm_up)
+            for engine in async_engines:
+                if engine.dialect.name != "sqlite":
+                    opened += await _warm_async(engine)
+            try:
+                await asyncio.to_thread(_prime)
+            except Exception:
+                logger.warning("Priming failed; the first requests will pay for it", exc_info=True)
+            logger.info("Worker %d warm in %.1fs with %d connections open", os.getpid(), time.perf_counter() - started, opened)
+        rollups.start_refresher()
+        partitions.start_maintainer()
+        schema_cache.start_sampler()
+        database.start_health_checks()
+        cache.start_watcher(database.engine)
+        try:
+            yield
+        finally:
+            abandoned = await ai_pool.executor.drain(AI_DRAIN_TIMEOUT)
+            if abandoned:
+                logger.warning("Worker %d abandoned %d AI questions after %.0fs", os.getpid(), abandoned, AI_DRAIN_TIMEOUT)
+            rollups.stop_refresher()
+            partitions.stop_maintainer()
+            schema_cache.stop_sampler()
+            database.stop_health_checks()
+            cache.stop_watcher()
+            database.dispose_all()
+            for engine in async_engines:
+                await engine.dispose()
+            llm.set_llm(None)
+    return run
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with several worker processes")
+    parser.add_argument("--app", default="main:app")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--budget", type=int, default=int(os.getenv("DB_CONNECTION_BUDGET", "0")), help="connections per database server for all workers together")
+    parser.add_argument("--graceful-timeout", type=float, default=AI_DRAIN_TIMEOUT, help="seconds to wait for in-flight requests on shutdown")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    # Read by database.py in every worker process
+    os.environ["SERVER_WORKERS"] = str(args.workers)
+    if args.app.split(":")[0] == "main_async":
+        os.environ["ASYNC_REQUESTS"] = "true"
+    if args.budget:
+        os.environ["DB_CONNECTION_BUDGET"] = str(args.budget)
+    logging.basicConfig(level=args.log_level.upper())
+    uvicorn.run(
+        args.app,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level=args.log_level,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import json
+import re
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+import instrumentation, models, rollups, safety
+from database import Base, ai_engine
+
+TABLES = sorted(safety.ALLOWED_TABLES)
+HIDDEN_COLUMNS = safety.HIDDEN_COLUMNS
+MAX_ROWS = 200
+
+PROMPT = """You are a PostgreSQL expert. Write one SELECT statement that answers the question.
+
+Tables:
+{schema}
+
+Only use the tables and columns listed. For totals, revenue and ratings prefer
+the rollup tables over aggregating the base tables. orders and order_items are
+partitioned by month on order_date and created_at: filter on those columns
+directly, e.g. order_date >= now() - interval '30 days', never on a function
+of them. Name the columns of users, never SELECT * or users.*. Return at most
+{limit} rows.
+Reply with the SQL only, no explanation.
+
+Question: {question}
+SQL:"""
+
+class FastPathError(Exception):
+    pass
+
+def render_schema(tables=TABLES) -> str:
+    """
+    One line per table: columns with types, primary keys and foreign keys.
+    """
+    dialect = postgresql.dialect()
+    lines = []
+    for name in tables:
+        columns = []
+        for column in Base.metadata.tables[name].columns:
+            if column.name in HIDDEN_COLUMNS:
+                continue
+            desc = f"{column.name} {column.type.compile(dialect=dialect).lower()}"
+            if column.primary_key:
+                desc += " pk"
+            for fk in column.foreign_keys:
+                desc += f" -> {fk.target_fullname}"
+            columns.append(desc)
+        line = f"{name}({', '.join(columns)})"
+        if name in rollups.DESCRIPTIONS:
+            line += f" -- rollup: {rollups.DESCRIPTIONS[name]}"
+        lines.append(line)
+    return "\n".join(lines)
+
+SCHEMA = render_schema()
+
+NARRATIVE_PROMPT = """Question: {question}
+SQL: {sql}
+First rows of the result (JSON): {rows}
+
+Answer the question in one or two sentences using the result."""
+
+def build_prompt(question: str, limit: int = MAX_ROWS) -> str:
+    return PROMPT.format(schema=SCHEMA, limit=limit, question=question)
+
+def extract_sql(reply: str) -> str:
+    fenced = re.search(r"```(?:sql)?\s*(.*?)```", reply, re.S | re.I)
+    sql = (fenced.group(1) if fenced else reply).strip()
+    return sql.split(";")[0].strip()
+
+def generate_sql(llm, question: str, limit: int = MAX_ROWS) -> str:
+    """
+    Ask for the SQL and pass it through safety.guard. safety.UnsafeQuery is
+    left to propagate: retrying a refused question through the agent would
+    only burn more LLM calls.
+    """
+    reply = llm.invoke(build_prompt(question, limit), config={"callbacks": instrumentation.callbacks()})
+    try:
+        return safety.guard(extract_sql(reply.content), limit)
+    except safety.InvalidQuery as e:
+        raise FastPathError(str(e)) from e
+
+def stream_rows(sql: str, batch_size: int, limit: int):
+    """
+    Yield the column names, then lists of row dicts fetched in batches from a
+    server-side cursor, so the first rows go out before the query finishes.
+    """
+    with ai_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(text(sql))
+        columns = list(result.keys())
+        yield columns
+        sent = 0
+        for partition in result.partitions(batch_size):
+            partition = partition[:limit - sent]
+            yield [dict(zip(columns, row)) for row in partition]
+            sent += len(partition)
+            if sent >= limit:
+                break
+
+def narrate(llm, question: str, sql: str, rows):
+    prompt = NARRATIVE_PROMPT.format(question=question, sql=sql, rows=json.dumps(rows[:20], default=str))
+    for chunk in llm.stream(prompt, config={"callbacks": instrumentation.callbacks()}):
+        if chunk.content:
+            yield chunk.content
+
+def execute(sql: str, limit: int = MAX_ROWS):
+    with ai_engine().connect() as conn:
+        result = conn.execute(text(sql))
+        columns = list(result.keys())
+        rows = [dict(zip(columns, row)) for row in result.fetchmany(limit)]
+    return columns, rows
+
+def summarize(rows) -> str:
+    if len(rows) == 1 and len(rows[0]) == 1:
+        return str(next(iter(rows[0].values())))
+    return f"Returned {len(rows)} row{'s' if len(rows) != 1 else ''}."
+
+def run(llm, question: str):
+    """
+    One LLM call to write the SQL, then direct execution against the engine.
+    """
+    sql = generate_sql(llm, question)
+    try:
+        columns, rows = execute(sql)
+    except Exception as e:
+        raise FastPathError(str(e)) from e
+    return {"answer": summarize(rows), "sql": sql, "columns": columns, "rows": rows}
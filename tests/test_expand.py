@@ -0,0 +1,64 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+import crud, main, models
+
+ITEMS = 20
+
+# (path, statements). Every expansion level adds at most one statement,
+# whatever the number of rows it covers.
+CASES = [
+    ("/orders/{order_id}", 1),
+    ("/orders/{order_id}?expand=user", 1),
+    ("/orders/{order_id}?expand=items", 2),
+    ("/orders/{order_id}?expand=items,product", 2),
+    ("/orders/{order_id}?expand=items,product,user", 2),
+    ("/orders/{order_id}?expand=items.product.category", 2),
+    ("/orders?limit=20&expand=items,product,user", 2),
+    ("/users/{user_id}?expand=orders.items.product", 3),
+    ("/products/{product_id}?expand=category,reviews", 2),
+    ("/order_items?limit=50&expand=product,order", 1),
+]
+
+@pytest.fixture(scope="module")
+def seeded(tmp_path_factory):
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('expand') / 'expand.db'}")
+    models.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    with Session() as db:
+        user = crud.create_user(db, "expand test", "expand@example.com", "x")
+        category = crud.create_category(db, "expand test")
+        products = [crud.create_product(db, f"expand {i}", None, 1, 1000, category.category_id) for i in range(ITEMS)]
+        for product in products[:5]:
+            crud.create_review(db, product.product_id, user.user_id, 4)
+        order = crud.place_order(db, user.user_id, [{"product_id": p.product_id, "quantity": 1} for p in products])
+        ids = {"order_id": order.order_id, "user_id": user.user_id, "product_id": products[0].product_id}
+
+    def get_db():
+        with Session() as db:
+            yield db
+
+    main.app.dependency_overrides[main.get_db] = get_db
+    yield engine, ids
+    main.app.dependency_overrides.pop(main.get_db, None)
+    engine.dispose()
+
+@pytest.mark.parametrize("path,expected", CASES)
+def test_statements_per_expand(seeded, path, expected):
+    engine, ids = seeded
+    statements = []
+    listener = lambda *args, **kwargs: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        response = TestClient(main.app).get(path.format(**ids))
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert response.status_code == 200
+    assert len(statements) == expected, statements
+
+def test_expanded_rows_are_loaded(seeded):
+    _, ids = seeded
+    body = TestClient(main.app).get(f"/orders/{ids['order_id']}?expand=items,product").json()
+    assert len(body["items"]) == ITEMS
+    assert all(item["product"]["name"].startswith("expand") for item in body["items"])
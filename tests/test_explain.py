@@ -0,0 +1,49 @@
+"""
+EXPLAIN check for the queries the app issues most: with sequential scans
+discouraged, none of them may still need a Seq Scan, which would mean an
+index from migrations/ is missing. Runs against DATABASE_URL, which must be
+a migrated PostgreSQL database; skipped otherwise.
+"""
+import os
+import pytest
+
+if not os.getenv("DATABASE_URL", "").startswith("postgresql"):
+    pytest.skip("needs a PostgreSQL DATABASE_URL", allow_module_level=True)
+
+from sqlalchemy import text
+import database
+
+QUERIES = [
+    ("orders of a user", "SELECT * FROM orders WHERE user_id = 1 ORDER BY order_id"),
+    ("items of an order", "SELECT * FROM order_items WHERE order_id = 1"),
+    ("items by product", "SELECT * FROM order_items WHERE product_id = 1"),
+    ("products in a category", "SELECT * FROM products WHERE category_id = 1 ORDER BY product_id"),
+    ("products by rating", "SELECT * FROM products ORDER BY rating_avg DESC, product_id DESC LIMIT 20"),
+    ("products by rating, next page", "SELECT * FROM products WHERE (rating_avg, product_id) < (4.5, 100) ORDER BY rating_avg DESC, product_id DESC LIMIT 20"),
+    ("reviews of a product by date", "SELECT * FROM reviews WHERE product_id = 1 ORDER BY created_at DESC LIMIT 20"),
+    ("review by user and product", "SELECT * FROM reviews WHERE user_id = 1 AND product_id = 1"),
+    ("recent pending orders", "SELECT * FROM orders WHERE status = 'pending' ORDER BY order_date DESC LIMIT 50"),
+    ("orders in a date range", "SELECT * FROM orders WHERE order_date >= now() - interval '7 days'"),
+    ("orders by status", "SELECT * FROM orders WHERE status = 'shipped'"),
+]
+
+def _nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _nodes(child)
+
+@pytest.fixture(scope="module")
+def conn():
+    with database.engine.connect() as conn:
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        yield conn
+        conn.rollback()
+
+@pytest.mark.parametrize("name,sql", QUERIES, ids=[name for name, _ in QUERIES])
+def test_uses_an_index(conn, name, sql):
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()[0]["Plan"]
+    scans = [
+        f"{node['Node Type']}({node.get('Index Name') or node.get('Relation Name')})"
+        for node in _nodes(plan) if "Relation Name" in node or "Index Name" in node
+    ]
+    assert not any(node["Node Type"] == "Seq Scan" for node in _nodes(plan)), ", ".join(scans)
@@ -0,0 +1,77 @@
+import pytest
+import safety
+
+ACCEPTED = [
+    "SELECT user_id, name, email FROM users",
+    "SELECT name, email FROM users ORDER BY created_at DESC LIMIT 5",
+    "SELECT p.name FROM products p JOIN categories c ON c.category_id = p.category_id WHERE c.name = 'Electronics'",
+    "SELECT * FROM orders WHERE user_id = 101",
+    "SELECT name, price FROM products ORDER BY price DESC LIMIT 5",
+    "SELECT * FROM products WHERE description ILIKE '%updated%'",
+    "SELECT p.name, SUM(oi.quantity * oi.price) AS revenue FROM order_items oi JOIN products p USING (product_id) GROUP BY p.name ORDER BY revenue DESC LIMIT 5",
+    "SELECT c.name, AVG(r.rating) FROM reviews r JOIN products p ON p.product_id = r.product_id JOIN categories c ON c.category_id = p.category_id GROUP BY c.name",
+    "SELECT date_trunc('month', order_date) AS month, SUM(total_amount) FROM orders GROUP BY 1 ORDER BY 1",
+    "WITH recent AS (SELECT * FROM orders WHERE order_date > now() - interval '30 days') SELECT count(*) FROM recent",
+    "WITH recent AS (SELECT * FROM orders), big AS (SELECT * FROM recent WHERE total_amount > 100) SELECT * FROM big",
+    "WITH RECURSIVE n AS (SELECT 1 AS i UNION ALL SELECT i + 1 FROM n WHERE i < 10) SELECT * FROM n",
+    "SELECT * FROM (WITH recent AS (SELECT * FROM orders) SELECT * FROM recent) t",
+    "WITH orders AS (SELECT * FROM orders WHERE status = 'pending') SELECT * FROM orders",
+    "SELECT user_id FROM orders UNION SELECT user_id FROM reviews",
+    "SELECT * FROM public.products LIMIT 10",
+    "SELECT * FROM products WHERE product_id IN (SELECT product_id FROM reviews WHERE rating = 5)",
+]
+
+REJECTED = [
+    "DELETE FROM users",
+    "UPDATE products SET price = 0",
+    "INSERT INTO users (name, email, password_hash) VALUES ('x', 'y', 'z')",
+    "DROP TABLE orders",
+    "TRUNCATE reviews",
+    "ALTER TABLE users ADD COLUMN admin boolean",
+    "CREATE TABLE t AS SELECT * FROM users",
+    "SELECT * FROM users; DROP TABLE users",
+    "SELECT * INTO backup_users FROM users",
+    "SELECT * FROM pg_catalog.pg_user",
+    "SELECT * FROM information_schema.tables",
+    "SELECT * FROM pg_shadow",
+    "SELECT pg_sleep(60)",
+    "SELECT * FROM products FOR UPDATE",
+    "WITH gone AS (DELETE FROM orders RETURNING *) SELECT * FROM gone",
+    "SELECT pg_read_file('/etc/passwd')",
+    "COPY users TO '/tmp/users.csv'",
+    "SET statement_timeout = 0",
+    "GRANT ALL ON users TO public",
+    # A CTE's name does not cover the table read in its own body
+    "WITH pg_shadow AS (SELECT * FROM pg_shadow) SELECT usename, passwd FROM pg_shadow",
+    "WITH idempotency_keys AS (SELECT * FROM idempotency_keys) SELECT * FROM idempotency_keys",
+    "WITH secrets AS (SELECT * FROM secrets) SELECT * FROM secrets",
+    "WITH a AS (SELECT * FROM b), b AS (SELECT * FROM users) SELECT * FROM a",
+    "WITH recent AS (SELECT * FROM orders) SELECT * FROM public.recent",
+    "SELECT * FROM (WITH recent AS (SELECT * FROM orders) SELECT * FROM recent) t JOIN recent r ON true",
+    # CTE names may not shadow relations that cannot be read
+    "WITH pg_user AS (SELECT * FROM users) SELECT * FROM pg_user",
+    "WITH rollup_state AS (SELECT * FROM orders) SELECT * FROM rollup_state",
+    # Hidden columns, named or reached through * or a whole-row reference
+    "SELECT email, password_hash FROM users",
+    "SELECT u.email, u.password_hash FROM users u",
+    "SELECT name, version FROM products",
+    "SELECT * FROM users",
+    "SELECT u.* FROM orders o JOIN users u USING (user_id)",
+    "SELECT * FROM orders o JOIN users u USING (user_id)",
+    "SELECT * FROM (SELECT * FROM users) t",
+    "SELECT row_to_json(u) FROM users u",
+]
+
+@pytest.mark.parametrize("sql", ACCEPTED)
+def test_accepted(sql):
+    safety.guard(sql)
+
+@pytest.mark.parametrize("sql", REJECTED)
+def test_rejected(sql):
+    with pytest.raises(ValueError):
+        safety.guard(sql)
+
+def test_limit_is_capped():
+    assert safety.guard("SELECT * FROM products LIMIT 5000", limit=100).endswith("LIMIT 100")
+    assert safety.guard("SELECT * FROM products LIMIT 5", limit=100).endswith("LIMIT 5")
+    assert safety.guard("SELECT * FROM products", limit=100).endswith("LIMIT 100")